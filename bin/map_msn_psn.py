@@ -19,9 +19,9 @@ import argparse
 import re
 from pprint import pprint as pp
 
-from matchbox_api_utils import MatchData 
+from matchbox_api_utils import query_server
 
-version = '4.1.101218'
+version = '4.2.101926'
 
 def get_args():
     parser = argparse.ArgumentParser(description = __doc__)
@@ -80,11 +80,13 @@ def map_id(mb_data, id_list, qtype):
     Call to MATCHBox and return PSN, MSN, or BSN data based on the qtype.
     """
     results = []
+    if qtype == 'psn':
+        all_psns = set(mb_data.get_cohort(outside=True).psns())
 
     # MSN and BSN results returns lists. Cat for easier str output.
     for pt in id_list:
         if qtype == 'psn':
-            if pt not in mb_data.data.keys():
+            if pt not in all_psns:
                 sys.stderr.write('WARN: No such patient with ID: %s.\n' % pt)
                 continue;
             bsn = mb_data.get_bsn(psn=pt)
@@ -174,8 +176,8 @@ if __name__=='__main__':
         sys.stdout.flush()
         json_db=None
 
-    data = MatchData(matchbox=args['matchbox'], method='mongo', json_db=json_db,
-        quiet=True)
+    data = query_server.get_match_data(matchbox=args['matchbox'], 
+        method='mongo', json_db=json_db, quiet=True)
     sys.stdout.write('\n')
 
     print('Getting MSN / PSN mapping data (Database date: %s)...' 
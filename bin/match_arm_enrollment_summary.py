@@ -3,6 +3,10 @@
 """
 Input a valid NCI-MATCH Arm ID and get a list of patients and trial status 
 information. Output intended to be similar to Treatment arms page of MATCHbox.
+
+Use ``all`` as the Arm ID to report on every arm in the study, and the 
+``--summary`` option to get a table of patient counts by arm and status rather
+than a list of patients.
 """
 import sys
 import os
@@ -13,7 +17,7 @@ from pprint import pprint as pp
 
 from matchbox_api_utils import *
 
-version = '1.0.111318'
+version = '1.2.101926'
 
 def get_args():
     parser = argparse.ArgumentParser(description = __doc__)
@@ -21,7 +25,7 @@ def get_args():
         'armid', 
         metavar='<ARM ID>',
         help='Valid NCI-MATCH study arm, or comma separated list of study arms, '
-            'in the format of EAY131-*.'
+            'in the format of EAY131-*. Use "all" to report on all arms.'
     )
     parser.add_argument(
         '-a', '--all', 
@@ -38,6 +42,12 @@ def get_args():
             'problems with mapping and whatnot as the data are a bit scattershot. '
             'You have been warned!'
     )
+    parser.add_argument(
+        '-s', '--summary',
+        action = 'store_true',
+        help = 'Output a table of patient counts by arm and arm status instead '
+            'of a list of patients.'
+    )
     parser.add_argument(
         '-o', '--outfile', 
         metavar = '<outfile>', 
@@ -78,13 +88,20 @@ def print_data(results, outfile):
             results[record]['source']
         ])
 
+def print_summary(summary, outfile):
+    statuses = sorted({s for counts in summary.values() for s in counts})
+    outfile.writerow(['ArmID'] + statuses + ['Total'])
+    for arm, counts in summary.items():
+        outfile.writerow([arm] + [counts.get(s, 0) for s in statuses] 
+            + [sum(counts.values())])
+
 def main(match_data, armids, output_all, outside, outfile):
     results = {}
 
     for arm in armids:
         arm_results = match_data.get_patients_by_arm(arm=arm, outside=outside)
-        if len(arm_results) < 1:
-            sys.stderr.write('No results for MATCH arm %s.\n' % armid)
+        if not arm_results:
+            sys.stderr.write('No results for MATCH arm %s.\n' % arm)
         else:
             for rec in arm_results:
                 try:
@@ -93,16 +110,13 @@ def main(match_data, armids, output_all, outside, outfile):
                 except IndexError:
                     msn = 'unknown'
 
-                histology = match_data.get_histology(psn=rec[0], outside=outside)
-                source = match_data.get_patient_demographics(psn=rec[0])['source']
-
                 results['%s|%s' %(arm, rec[0])] = {
                     'psn' : rec[0],
                     'arm' : rec[1],
                     'status' : rec[2],
                     'msn' : msn,
-                    'hist' : histology['PSN%s' % rec[0]],
-                    'source' : source
+                    'hist' : match_data.get_patient_meta(rec[0], 'ctep_term'),
+                    'source' : match_data.get_patient_meta(rec[0], 'source')
                 }
 
     if output_all:
@@ -120,7 +134,19 @@ if __name__ == '__main__':
     else:
         csv_fh = csv.writer(sys.stdout, lineterminator='\n')
 
-    arms = args.armid.split(',')
-    match_data = MatchData(quiet=True)
+    match_data = query_server.get_match_data(quiet=True)
+
+    if args.summary:
+        summary = match_data.get_arm_status_summary(outside=args.outside)
+        if args.armid != 'all':
+            summary = {arm : summary.get(arm, {}) 
+                for arm in args.armid.split(',')}
+        print_summary(summary, csv_fh)
+        sys.exit()
+
+    if args.armid == 'all':
+        arms = sorted(match_data.arm_data.get_match_arm_info())
+    else:
+        arms = args.armid.split(',')
 
     main(match_data, arms, args.all, args.outside, csv_fh)
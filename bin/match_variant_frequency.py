@@ -5,6 +5,10 @@ Input a list of genes by variant type and get back a table of NCI-MATCH hits
 that can be further analyzed in Excel. Can either input a patient (or comma 
 separated list of patients) to query, or query the entire dataset.  Will limit
 the patient set to the non-outside assay results only.
+
+Using the ``--pivot`` option, output patient and variant counts grouped by one
+or more fields (e.g. gene and disease) instead of a list of hits. If no genes
+are input with the pivot option, all variants are counted.
 """
 import sys
 import os
@@ -13,9 +17,9 @@ import csv
 import argparse
 from pprint import pprint as pp
 
-from matchbox_api_utils import MatchData
+from matchbox_api_utils import query_server
 
-version = '2.0.101218'
+version = '2.2.101926'
 
 def get_args():
     parser = argparse.ArgumentParser(description=__doc__,)
@@ -39,6 +43,10 @@ def get_args():
         help='Query variants across all variant types for a set of genes, '
         'rather than one by one.  Helpful if one wants to find any BRAF '
         'MOIs, no matter what type, for example.')
+    parser.add_argument('--pivot', metavar='<field_list>', 
+        help='Output patient and variant counts grouped by this comma separated'
+        ' list of fields rather than a list of hits. Valid fields are: gene, '
+        'variant_type, ctep_term, meddra_code, arm, arm_status, source.')
     parser.add_argument('--style', metavar='<pp,csv,tsv>', default='csv',
         help='Format for output. Can choose pretty print (pp), CSV, or TSV')
     parser.add_argument('-o', '--output', metavar='<output_file>',
@@ -112,6 +120,22 @@ def print_results(query_data,outfile,fmt):
                 var_data += parse_query_results(moi,'fusion')
             csv_writer.writerow(var_data)
 
+def print_pivot(pivot_data, group_by, outfile, fmt):
+    if fmt == 'pp':
+        pp(pivot_data)
+        return
+
+    delimiter = {'csv' : ',', 'tsv' : '\t'}[fmt]
+    if outfile != 'stdout':
+        csv_writer = csv.writer(open(outfile, 'w'), delimiter=delimiter)
+    else:
+        csv_writer = csv.writer(sys.stdout, delimiter=delimiter)
+
+    csv_writer.writerow(list(group_by) + ['Patients', 'Variants'])
+    for group, counts in pivot_data.items():
+        csv_writer.writerow(list(group) + [counts['patients'], 
+            counts['variants']])
+
 def split_genes(x):
     return [y.upper() for y in x.split(',')]
 
@@ -125,8 +149,8 @@ if __name__=='__main__':
             'few minutes...')
         sys.stdout.flush()
 
-    data = MatchData(matchbox=args.matchbox, method='mongo', json_db=json_db, 
-        quiet=True)
+    data = query_server.get_match_data(matchbox=args.matchbox, method='mongo',
+        json_db=json_db, quiet=True)
     sys.stdout.write('Database date: %s.\n' % data.db_date)
 
     query_list = {}
@@ -153,6 +177,15 @@ if __name__=='__main__':
     
     print("Patients to query: {}".format(patient_list))
 
+    if args.pivot:
+        group_by = args.pivot.split(',')
+        pivot_data = data.get_variant_summary(group_by=group_by, 
+            query=query_list or None, query_patients=patient_list)
+        if pivot_data is None:
+            sys.exit(1)
+        print_pivot(pivot_data, group_by, args.output, args.style)
+        sys.exit()
+
     # Gen a query result
     query_data, patient_total, biopsy_total = data.find_variant_frequency(
             query_list, patient_list)
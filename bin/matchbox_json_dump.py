@@ -12,7 +12,7 @@ from pprint import pprint as pp # noqa
 from matchbox_api_utils import MatchData
 from matchbox_api_utils import TreatmentArms
 
-version = '4.1.051719'
+version = '4.2.101926'
 
 def get_args():
     parser = argparse.ArgumentParser(description=__doc__)
@@ -36,6 +36,12 @@ def get_args():
     parser.add_argument('-m', '--mb_json', metavar='<mb_obj.json>', 
         help='Name of Match Data obj JSON file. DEFAULT: "mb_obj_<datestring>.'
         'json".')
+    parser.add_argument('-C', '--compact', action='store_true',
+        help='Write compact rather than indented JSON files, which are '
+        'smaller and quicker to load.')
+    parser.add_argument('-i', '--index', action='store_true',
+        help='Also write an offset index (<file>.idx) and a SHA-256 checksum '
+        '(<file>.sha256) for each JSON file.')
     parser.add_argument('-c', '--connection', metavar='<connection_method>', 
         dest='method', choices=['api', 'mongo'], default='mongo', 
         help='Connection method used to access MATCHBox data. Choose from '
@@ -46,17 +52,20 @@ def get_args():
     args = parser.parse_args()
     return args
 
-def main(data, arms, mb_filename=None, ta_filename=None, amois_filename=None):
+def main(data, arms, mb_filename=None, ta_filename=None, amois_filename=None,
+    pretty=True, index=False):
     sys.stdout.write('Dumping matchbox as a JSON file for easier and faster '
         'code testing...')
     sys.stdout.flush()
-    data.matchbox_dump(filename=mb_filename)
+    data.matchbox_dump(filename=mb_filename, pretty=pretty, index=index, 
+        checksum=index)
     sys.stdout.write('Done!\n')
 
     sys.stdout.write('Dumping Treatment Arms as a JSON file for easier and '
         'faster code testing...')
     sys.stdout.flush()
-    arms.ta_json_dump(amois_filename=amois_filename, ta_filename=ta_filename)
+    arms.ta_json_dump(amois_filename=amois_filename, ta_filename=ta_filename,
+        pretty=pretty, index=index, checksum=index)
     sys.stdout.write("Done!\n")
 
 if __name__=='__main__':
@@ -85,4 +94,5 @@ if __name__=='__main__':
         json_db=None)
     sys.stdout.write('Done!\n')
 
-    main(data, arms, args.mb_json, args.ta_json, args.amoi_json)
+    main(data, arms, args.mb_json, args.ta_json, args.amoi_json, 
+        pretty=not args.compact, index=args.index)
@@ -23,9 +23,9 @@ import csv
 from operator import itemgetter
 from pprint import pprint as pp
 
-from matchbox_api_utils import MatchData
+from matchbox_api_utils import query_server
 
-version = '3.0.101218'
+version = '3.1.101926'
 
 def get_args():
     parser = argparse.ArgumentParser(description=__doc__)
@@ -168,8 +168,8 @@ if __name__=='__main__':
         sys.stdout.flush()
         json_db = None
 
-    data = MatchData(matchbox=args.matchbox, method='mongo', json_db=json_db,
-        quiet=True)
+    data = query_server.get_match_data(matchbox=args.matchbox, method='mongo',
+        json_db=json_db, quiet=True)
     sys.stdout.write('Database date: %s.\n' % data.db_date)
 
     if args.outfile:
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Start a long running MATCHBox query server. The system default MATCHBox dataset
+is loaded once and its query methods are served over a Unix socket in the
+MATCHBox API Utils root dir ($HOME/.mb_utils). The other scripts in this
+package will use the server automatically when it is running, rather than
+loading the dataset every time they are run. With the --reload option, the
+server will pick up newer datasets (e.g. the nightly dump) as they are added to
+$HOME/.mb_utils, without a restart. Stop the server with Ctrl-C or SIGTERM.
+"""
+import sys
+import signal
+import argparse
+
+from matchbox_api_utils import query_server
+
+version = '1.2.101926'
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-m', '--matchbox',
+        metavar='<matchbox>',
+        default='adult',
+        help='Name of MATCHBox system to serve. Valid systems are: "adult", '
+            '"adult-uat", "ped". DEFAULT: %(default)s.'
+    )
+    parser.add_argument(
+        '-s', '--socket',
+        metavar='<socket_path>',
+        help='Unix socket on which to serve the data. Note that the other '
+            'scripts only look for the server on the default socket. DEFAULT:'
+            ' $HOME/.mb_utils/query_server_<matchbox>.sock.'
+    )
+    parser.add_argument(
+        '-r', '--reload',
+        metavar='<seconds>',
+        type=int,
+        help='Check for a new system default dataset every <seconds> seconds, '
+            'and serve it once it has been loaded.'
+    )
+    parser.add_argument(
+        '-c', '--cache_size',
+        metavar='<num_queries>',
+        type=int,
+        help='Cache the results of up to <num_queries> of the most recent '
+            'heavy queries (variant frequencies, histologies, etc.).'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version='%(prog)s  -  ' + version
+    )
+    args = parser.parse_args()
+    return args
+
+def stop(signum, frame):
+    raise KeyboardInterrupt
+
+if __name__ == '__main__':
+    args = get_args()
+    try:
+        server = query_server.QueryServer(matchbox=args.matchbox,
+            socket_path=args.socket, quiet=False, reload_interval=args.reload,
+            cache_size=args.cache_size)
+    except RuntimeError as e:
+        sys.stderr.write('ERROR: %s\n' % e)
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.stderr.write('\nShutting down query server.\n')
+    finally:
+        server.server_close()
@@ -7,10 +7,13 @@ import datetime
 from matchbox_api_utils.matchbox import Matchbox
 from matchbox_api_utils.match_data import MatchData
 from matchbox_api_utils.match_arms import TreatmentArms
+from matchbox_api_utils.cohort import Cohort
 
 from ._version import __version__ 
 
-__all__ = ['Matchbox','MatchData','TreatmentArms','matchbox_conf', 'utils']
+__all__ = ['Matchbox','MatchData','TreatmentArms','Cohort','matchbox_conf',
+    'utils', 'query_server', 'snapshot', 'reloader',
+    'pipeline']
 
 mb_utils_root = os.path.join(os.environ['HOME'], '.mb_utils')
 if not os.path.isdir(mb_utils_root):
@@ -18,7 +21,7 @@ if not os.path.isdir(mb_utils_root):
     sys.stderr.write('WARN: Can not find the MATCHBox API Utils root dir '
         '"%s". You may need to reconfigure your package!\n')
 
-def get_latest_data(dfiles):
+def get_latest_data(dfiles, quiet=False):
     """
     Get the most recent mb_obj file in the utils dir in the event that there are
     mulitple in there.
@@ -26,48 +29,87 @@ def get_latest_data(dfiles):
     largest = 0
     indexed_files = {}
 
-    for f in dfiles:
-        filename = os.path.basename(f)
+    # Sorted so that a .jsonl file wins over a .json file of the same date.
+    for f in sorted(dfiles):
+        filename = os.path.splitext(os.path.basename(f))[0]
         datestring = datetime.datetime.strptime(
-            filename.rstrip('.json').split('_')[2], "%m%d%y")
+            filename.split('_')[2], "%m%d%y")
         indexed_files[datestring] = f
     try:
         largest = sorted(indexed_files.keys())[-1]
     except IndexError:
         # there is no MATCHBox JSON Obj here from setup or whatever.
-        sys.stderr.write(
-        """
-        -> WARN: No system default MATCHBox DB of TA obj location! Recommend
-           running "matchbox_json_dump.py" and storing the resultant file in 
-           $HOME/.mb_utils/ for easier work later on. Alternatively, you can 
-           always do a live query.
-        """
-        )
+        if not quiet:
+            sys.stderr.write(
+            """
+            -> WARN: No system default MATCHBox DB of TA obj location! Recommend
+               running "matchbox_json_dump.py" and storing the resultant file in 
+               $HOME/.mb_utils/ for easier work later on. Alternatively, you can 
+               always do a live query.
+            """
+            )
         return None
     return indexed_files[largest]
 
 def get_files(string,file_list):
     return [x for x in file_list if os.path.basename(x).startswith(string)]
 
-if os.path.isdir(mb_utils_root):
+def find_data_files(root=None, quiet=False):
+    """
+    Find the config file and the most recent mb_obj, ta_obj, and amoi_lookup 
+    files in the MATCHBox API Utils root dir.
+
+    Returns:
+        dict: File paths keyed by ``mb_config_file``, ``mb_json_data``, 
+        ``ta_json_data``, and ``amoi_json_data``, with ``None`` for any that are
+        missing.
+    """
+    root = root or mb_utils_root
     json_files = [
-        os.path.join(mb_utils_root, f) 
-        for f in os.listdir(mb_utils_root) 
+        os.path.join(root, f) 
+        for f in os.listdir(root) 
         if f.endswith('.json')
     ]
+    # Parsed MB datasets can also be in JSON Lines format.
+    jsonl_files = [
+        os.path.join(root, f) 
+        for f in os.listdir(root) 
+        if f.endswith('.jsonl')
+    ]
 
-    # Set up default JSON files.
+    files = {'mb_config_file' : None}
     for f in json_files:
         if 'mb3.0_config.json' in f:
-            mb_config_file = f
+            files['mb_config_file'] = f
+    files['mb_json_data'] = get_latest_data(get_files('mb_obj', 
+        json_files + jsonl_files), quiet)
+    files['ta_json_data'] = get_latest_data(get_files('ta_obj', json_files),
+        quiet)
+    files['amoi_json_data'] = get_latest_data(
+        get_files('amoi_lookup', json_files), quiet)
+    return files
 
-    mb_data_files = get_files('mb_obj', json_files)
-    mb_json_data = get_latest_data(mb_data_files)
+def refresh_data_files(quiet=True):
+    """
+    Look for newer system default data files in the MATCHBox API Utils root dir,
+    and use them as the ``sys_default`` data for new ``MatchData`` and 
+    ``TreatmentArms`` objects from now on.  Objects that are already loaded are
+    not changed (see :class:`reloader.ReloadingMatchData` for that).
 
-    ta_data_files = get_files('ta_obj', json_files)
-    ta_json_data = get_latest_data(ta_data_files)
+    Returns:
+        dict: The system default data files, as from :func:`find_data_files`.
+    """
+    files = find_data_files(quiet=quiet)
+    globals().update((k, v) for k, v in files.items() if v is not None)
+    return files
 
-    amois_files = get_files('amoi_lookup', json_files)
-    amoi_json_data = get_latest_data(amois_files)
+if os.path.isdir(mb_utils_root):
+    # Set up default JSON files.
+    _files = find_data_files()
+    if _files['mb_config_file']:
+        mb_config_file = _files['mb_config_file']
+    mb_json_data = _files['mb_json_data']
+    ta_json_data = _files['ta_json_data']
+    amoi_json_data = _files['amoi_json_data']
 else:
     sys.stderr.write('Can not initialize default config and db JSON files.\n')
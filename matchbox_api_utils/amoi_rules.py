@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+
+# Values the MATCHBox team uses for an empty CNV gene field.
+NULL_GENES = ('-', '.', None, 'null', '')
+
+# The rules used by screen_worker_patients() in a process pool worker.  They 
+# are set once per worker by init_screen_worker(), rather than being pickled 
+# and sent along with every batch of patients.
+_worker_rules = None
+
+
+class AmoiRules(object):
+    """
+    **Compiled aMOI Rules Engine**
+
+    Compile the aMOI rules for all arms into integer coded decision tables.
+    Each variant key (hotspot ID, CNV gene, fusion ID, deleterious gene, or
+    positional gene / exon / function) maps to a pair of arm bitmasks, one for
+    the arms that include the variant and one for the arms that exclude it,
+    where bit ``n`` is the arm with ordinal ``n``.  Evaluating a whole set of
+    variants is then a matter of OR'ing together the masks for each variant,
+    and the result can be filtered by arm status or outside lab access with a
+    single mask operation before being decoded back to the ``Arm(i|e)``
+    strings that :meth:`TreatmentArms.map_amoi` returns.
+
+    The engine is usually generated by :class:`TreatmentArms` and available as
+    its ``amoi_rules`` attribute rather than being made directly.
+
+    The arms' IHC requirements and excluded diseases can also be compiled in,
+    so that :meth:`screen` can check a patient's eligibility for every arm at
+    once (see :meth:`MatchData.screen_cohort`).
+
+    Args:
+        rules_table (dict): aMOI rules table in the format of
+            ``TreatmentArms.amoi_lookup_table``.
+
+        arms (list): Arm IDs, in ordinal order.
+
+        ihc (dict): Optional dict of arm ID to that arm's ``ihc`` requirements
+            (assay : required result) from ``TreatmentArms.data``.
+
+        excl_diseases (dict): Optional dict of arm ID to that arm's
+            ``excl_diseases`` (CTEP category : MEDDRA code) from
+            ``TreatmentArms.data``.
+
+    Examples:
+        >>> rules = ta.amoi_rules
+        >>> incl, excl = rules.evaluate(patient_variants)
+        >>> rules.decode(incl, excl)
+        ['EAY131-H(i)', 'EAY131-N(e)', 'EAY131-P(e)', 'EAY131-Y(e)']
+
+    """
+
+    def __init__(self, rules_table, arms, ihc=None, excl_diseases=None):
+        self.arms = list(arms)
+        self.arm_ids = {arm : i for i, arm in enumerate(self.arms)}
+        self.mask = (1 << len(self.arms)) - 1
+
+        self.hotspot = self.__compile(rules_table['hotspot'])
+        self.cnv = self.__compile(rules_table['cnv'])
+        self.fusion = self.__compile(rules_table['fusion'])
+        self.deleterious = self.__compile(rules_table['deleterious'])
+        self.positional = self.__compile(rules_table['positional'],
+            key=lambda var: tuple(var.split('|')))
+
+        # Arms that have at least one inclusion variant rule.
+        self.inclusion_arms = 0
+        for table in (self.hotspot, self.cnv, self.fusion, self.deleterious,
+                self.positional):
+            for incl, excl in table.values():
+                self.inclusion_arms |= incl
+
+        # (assay, result) -> mask of arms requiring that IHC result, and 
+        # MEDDRA code -> mask of arms excluding that disease.
+        self.ihc = defaultdict(int)
+        for arm, assays in (ihc or {}).items():
+            for assay, result in (assays or {}).items():
+                self.ihc[(assay, result)] |= 1 << self.arm_ids[arm]
+        self.ihc = dict(self.ihc)
+        self.ihc_arms = 0
+        for arms_mask in self.ihc.values():
+            self.ihc_arms |= arms_mask
+
+        self.excl_diseases = defaultdict(int)
+        for arm, diseases in (excl_diseases or {}).items():
+            for meddra_code in (diseases or {}).values():
+                self.excl_diseases[meddra_code] |= 1 << self.arm_ids[arm]
+        self.excl_diseases = dict(self.excl_diseases)
+
+    def __repr__(self):
+        return '%s: %s arms' % (self.__class__, len(self.arms))
+
+    def __compile(self, rules, key=None):
+        # Turn a {variant: ['Arm(i|e)', ...]} table into a {variant: (incl,
+        # excl)} table of arm bitmasks.
+        table = {}
+        for var, amois in rules.items():
+            incl = excl = 0
+            for amoi in amois:
+                arm, flag = amoi[:-3], amoi[-2]
+                if flag == 'i':
+                    incl |= 1 << self.arm_ids[arm]
+                else:
+                    excl |= 1 << self.arm_ids[arm]
+            table[key(var) if key else var] = (incl, excl)
+        return table
+
+    def lookup(self, var_type, gene=None, identifier=None, varclass=None,
+        exon=None, function=None):
+        """
+        Look up the inclusion and exclusion arm bitmasks for a single variant.
+        Hotspot rules take precedence over deleterious rules, which take
+        precedence over positional rules, as in ``map_amoi()``.
+
+        Args:
+            var_type (str): One of ``snvs_indels``, ``cnvs`` or ``fusions``.
+            gene (str): HUGO gene name.
+            identifier (str): Variant ID (e.g. ``COSM476``).
+            varclass (str): Oncomine variant class.
+            exon (str): Exon number, with or without an ``Exon`` prefix.
+            function (str): Variant function (e.g. ``missense``).
+
+        Returns:
+            tuple: Inclusion and exclusion bitmasks, or ``None`` if there are
+            no rules for the variant.
+
+        """
+        if var_type == 'snvs_indels':
+            if identifier in self.hotspot:
+                return self.hotspot[identifier]
+            elif varclass == 'Deleterious' and gene in self.deleterious:
+                return self.deleterious[gene]
+            elif exon is not None:
+                return self.positional.get((gene, exon.lstrip('Exon'),
+                    function))
+        elif var_type == 'cnvs':
+            if gene in NULL_GENES:
+                gene = identifier
+            return self.cnv.get(gene)
+        elif var_type == 'fusions':
+            return self.fusion.get(identifier)
+        return None
+
+    def evaluate(self, variants):
+        """
+        Evaluate a set of variants (e.g. all of a patient's variants) against
+        every arm at once.
+
+        Args:
+            variants (list): List of variant dicts, with the same keys as for
+                :meth:`TreatmentArms.map_amoi`.
+
+        Returns:
+            tuple: Inclusion and exclusion bitmasks of all arms for which any of
+            the variants is an aMOI.
+
+        """
+        incl = excl = 0
+        for variant in variants:
+            masks = self.lookup(variant['type'], variant.get('gene'),
+                variant.get('identifier'), variant.get('oncominevariantclass'),
+                variant.get('exon'), variant.get('function'))
+            if masks:
+                incl |= masks[0]
+                excl |= masks[1]
+        return incl, excl
+
+    def decode(self, incl, excl, allowed=None):
+        """
+        Decode inclusion and exclusion bitmasks to a sorted list of
+        ``Arm(i|e)`` strings.
+
+        Args:
+            incl (int): Inclusion arm bitmask.
+            excl (int): Exclusion arm bitmask.
+            allowed (int): Optional mask of arms to keep in the output.
+
+        Returns:
+            list: Sorted list of Arm ID(s) with (i)nclusion or (e)xclusion
+            information.
+
+        """
+        if allowed is not None:
+            incl &= allowed
+            excl &= allowed
+        amois = []
+        for bits, flag in ((incl, '(i)'), (excl, '(e)')):
+            bitstring = bin(bits)[:1:-1]
+            i = bitstring.find('1')
+            while i != -1:
+                amois.append(self.arms[i] + flag)
+                i = bitstring.find('1', i + 1)
+        return sorted(amois)
+
+    def screen(self, variants, ihc=None, meddra_code=None):
+        """
+        Screen a patient against every arm at once and return a bitmask of the
+        arms for which the patient is eligible.
+
+        A patient is eligible for an arm if they have an inclusion aMOI for it
+        (or the arm has no inclusion variant rules, only IHC requirements), 
+        have no exclusion aMOI for it, meet all of its IHC requirements, and
+        their disease is not one of its excluded diseases.
+
+        Args:
+            variants (list): List of ``(type, gene, identifier, 
+                oncominevariantclass, exon, function)`` tuples (the arguments
+                to :meth:`lookup`).
+            ihc (dict): Patient's IHC results (assay : result).
+            meddra_code (str): Patient's disease MEDDRA code.
+
+        Returns:
+            int: Bitmask of arms for which the patient is eligible.
+
+        """
+        incl = excl = 0
+        for variant in variants:
+            masks = self.lookup(*variant)
+            if masks:
+                incl |= masks[0]
+                excl |= masks[1]
+
+        # IHC only arms start out as candidates for every patient.
+        eligible = (incl | (self.ihc_arms & ~self.inclusion_arms)) & ~excl
+
+        ihc = ihc or {}
+        for (assay, result), arms_mask in self.ihc.items():
+            if ihc.get(assay) != result:
+                eligible &= ~arms_mask
+
+        eligible &= ~self.excl_diseases.get(meddra_code, 0)
+        return eligible & self.mask
+
+
+def screen_patients(rules, patients):
+    """
+    Screen a batch of patients with :meth:`AmoiRules.screen`. This is a module
+    level function so that it can be run in a process pool.
+
+    Args:
+        rules (AmoiRules): Compiled rules.
+        patients (list): List of ``(key, variants, ihc, meddra_code)`` tuples.
+
+    Returns:
+        list: List of ``(key, eligible arms bitmask)`` tuples.
+
+    """
+    return [(key, rules.screen(variants, ihc, meddra_code)) 
+        for key, variants, ihc, meddra_code in patients]
+
+
+def init_screen_worker(rules):
+    """
+    Process pool initializer that sets the rules for 
+    :func:`screen_worker_patients` in the worker process.
+    """
+    global _worker_rules
+    _worker_rules = rules
+
+
+def screen_worker_patients(patients):
+    """
+    Run :func:`screen_patients` on a batch of patients in a process pool 
+    worker, with the rules set by :func:`init_screen_worker`.
+    """
+    return screen_patients(_worker_rules, patients)
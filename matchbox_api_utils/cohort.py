@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+
+def popcount(bits):
+    # Number of set bits in an int.  Use the native method when we have it
+    # (Python >= 3.10), otherwise fall back to counting the binary string.
+    try:
+        return bits.bit_count()
+    except AttributeError:
+        return bin(bits).count('1')
+
+
+class PatientIndex(object):
+    """
+    **Dense PSN Ordinal Index**
+
+    Assign a dense, zero based ordinal to each PSN in a MATCHBox dataset so
+    that patient sets can be represented as bitmaps, where bit ``n`` is set if
+    the patient with ordinal ``n`` is a member of the set.  Ordinals follow the
+    order of the input PSNs, so converting a bitmap back to a PSN list keeps
+    the dataset order.
+
+    Args:
+        psns (iterable): PSNs (without the ``PSN`` prefix) to index.
+
+    """
+
+    def __init__(self, psns):
+        self.psns = list(psns)
+        self.ordinals = {psn : i for i, psn in enumerate(self.psns)}
+        self.mask = (1 << len(self.psns)) - 1
+
+    def __len__(self):
+        return len(self.psns)
+
+    def __contains__(self, psn):
+        return psn in self.ordinals
+
+    def __repr__(self):
+        return '%s: %s patients' % (self.__class__, len(self.psns))
+
+    def bits(self, psns):
+        # Make a bitmap from an iterable of PSNs.  Unknown PSNs are skipped.
+        bits = 0
+        for psn in psns:
+            i = self.ordinals.get(psn)
+            if i is not None:
+                bits |= 1 << i
+        return bits
+
+    def cohort(self, psns=None, bits=None):
+        """
+        Make a :class:`Cohort` on this index from a list of PSNs or a raw
+        bitmap.
+        """
+        if bits is None:
+            bits = self.bits(psns or [])
+        return Cohort(self, bits)
+
+
+class Cohort(object):
+    """
+    **Patient Cohort Bitmap**
+
+    A set of patients from a :class:`PatientIndex`, stored as a single int
+    bitmap.  Cohorts from the same index can be combined with the ``&``,
+    ``|``, ``^`` and ``-`` operators, and complemented (relative to the whole
+    dataset) with ``~``.  These are single big integer operations, and so are
+    far cheaper than the equivalent set or dict operations on PSN strings.
+
+    Cohorts are usually generated from :meth:`MatchData.get_cohort` rather
+    than directly.
+
+    Args:
+        index (PatientIndex): Index on which the bitmap is based.
+        bits (int): Bitmap of patient ordinals.
+
+    Examples:
+        >>> arm_a = data.get_cohort(arm='EAY131-A')
+        >>> lung = data.get_cohort(histology='lung')
+        >>> len(arm_a & ~lung)
+        12
+        >>> (arm_a & ~lung).psns()[:2]
+        ['10626', '11476']
+
+    """
+    __slots__ = ('_index', '_bits')
+
+    def __init__(self, index, bits=0):
+        self._index = index
+        self._bits = bits & index.mask
+
+    def __check(self, other):
+        if not isinstance(other, Cohort):
+            return NotImplemented
+        if other._index is not self._index:
+            raise ValueError('Can not combine cohorts made from different '
+                'MATCHBox datasets.')
+        return other
+
+    def __and__(self, other):
+        other = self.__check(other)
+        if other is NotImplemented:
+            return other
+        return Cohort(self._index, self._bits & other._bits)
+
+    def __or__(self, other):
+        other = self.__check(other)
+        if other is NotImplemented:
+            return other
+        return Cohort(self._index, self._bits | other._bits)
+
+    def __xor__(self, other):
+        other = self.__check(other)
+        if other is NotImplemented:
+            return other
+        return Cohort(self._index, self._bits ^ other._bits)
+
+    def __sub__(self, other):
+        other = self.__check(other)
+        if other is NotImplemented:
+            return other
+        return Cohort(self._index, self._bits & ~other._bits)
+
+    def __invert__(self):
+        return Cohort(self._index, self._index.mask ^ self._bits)
+
+    def __eq__(self, other):
+        if not isinstance(other, Cohort):
+            return NotImplemented
+        return other._index is self._index and other._bits == self._bits
+
+    def __hash__(self):
+        return hash((id(self._index), self._bits))
+
+    def __len__(self):
+        return popcount(self._bits)
+
+    def __bool__(self):
+        return self._bits != 0
+
+    def __contains__(self, psn):
+        i = self._index.ordinals.get(str(psn).lstrip('PSN'))
+        return i is not None and bool(self._bits >> i & 1)
+
+    def __iter__(self):
+        # Walk the bitmap as a (reversed) binary string and find the set bits,
+        # which is much faster than shifting a large int one bit at a time.
+        psns = self._index.psns
+        bitstring = bin(self._bits)[:1:-1]
+        i = bitstring.find('1')
+        while i != -1:
+            yield psns[i]
+            i = bitstring.find('1', i + 1)
+
+    def __repr__(self):
+        return '%s: %s patients' % (self.__class__, len(self))
+
+    @property
+    def bits(self):
+        """Raw int bitmap of patient ordinals."""
+        return self._bits
+
+    def psns(self, add_prefix=False):
+        """
+        Return a list of PSNs in the cohort, in dataset order.
+
+        Args:
+            add_prefix (bool): Return IDs as ``PSNxxxxx`` rather than the bare
+                number. DEFAULT: ``False``.
+
+        Returns:
+            list: List of PSNs.
+
+        """
+        if add_prefix:
+            return ['PSN' + psn for psn in self]
+        return list(self)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from matchbox_api_utils.records import Record
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError('%s object is read-only' % self.__class__.__name__)
+
+
+class FrozenDict(dict):
+    """
+    **Read-only dict**
+
+    A ``dict`` that can't be changed once made.  Since it is still a ``dict``,
+    it compares equal to, prints like, and JSON serializes like the dict it
+    was made from, so frozen data works with existing code that only reads
+    it.  Use ``dict(frozen)`` or ``frozen.copy()`` for a mutable copy.
+    """
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def copy(self):
+        return dict(self)
+
+
+class FrozenList(list):
+    """
+    **Read-only list**
+
+    A ``list`` that can't be changed once made. See :class:`FrozenDict`.
+    """
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+    clear = _read_only
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def copy(self):
+        return list(self)
+
+
+def freeze(data):
+    """
+    Make a deep, read-only copy of a JSON like structure, with dicts as
+    :class:`FrozenDict`, lists as :class:`FrozenList`, and sets as
+    ``frozenset``.  Compact records (see :mod:`records`) are already
+    read-only, but their values are frozen too.  Other values (strings,
+    numbers, etc.) are already immutable and are shared rather than copied.
+    """
+    if isinstance(data, FrozenDict) or isinstance(data, FrozenList):
+        return data
+    elif isinstance(data, Record):
+        return data.map_values(freeze)
+    elif isinstance(data, dict):
+        return FrozenDict((k, freeze(v)) for k, v in data.items())
+    elif isinstance(data, list):
+        return FrozenList(freeze(x) for x in data)
+    elif isinstance(data, tuple):
+        return tuple(freeze(x) for x in data)
+    elif isinstance(data, set):
+        return frozenset(data)
+    return data
@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
+import re
 import sys
 import json
+import bisect
 import datetime
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 from matchbox_api_utils import utils
 from matchbox_api_utils import matchbox_conf
 
 from matchbox_api_utils.matchbox import Matchbox
+from matchbox_api_utils.amoi_rules import AmoiRules, NULL_GENES
+
+ArmAttributes = namedtuple('ArmAttributes', 
+    ['arm_id', 'status', 'outside_open', 'drug_name', 'version'])
 
 
 class TreatmentArms(object):
@@ -65,6 +71,13 @@ class TreatmentArms(object):
             etc. messages.
 
     """
+    # Variant fields the aMOI rules need for each variant type.
+    _variant_keys = {
+        'snvs_indels' : ('type', 'gene', 'identifier', 'exon', 'function', 
+            'oncominevariantclass'),
+        'cnvs'        : ('type', 'identifier'),
+        'fusions'     : ('type', 'identifier'),
+    }
 
     def __init__(self, matchbox='adult', method='mongo', config_file=None, 
         username=None, password=None, json_db='sys_default', load_raw=None, 
@@ -74,7 +87,9 @@ class TreatmentArms(object):
         self._json_db = json_db
         self.db_date = utils.get_today('long')
         self._quiet = quiet
-        self._latest_ver = {}
+
+        # Hotspot identifier -> gene map, used to look arms up by gene.
+        self._hotspot_genes = {}
 
         # Ensure we pass "ta" to Matchbox().
         if make_raw:
@@ -106,14 +121,14 @@ class TreatmentArms(object):
         if load_raw:
             if self._quiet is False:
                 sys.stderr.write('\n  ->  Starting from a raw TA JSON Obj\n')
-            self.db_date, matchbox_data = utils.load_dumped_json(load_raw)
+            self.db_date, matchbox_data = utils.stream_dumped_json(load_raw)
 
-            self.__get_latest_arms(matchbox_data)
             self.data = self.make_match_arms_db(matchbox_data)
 
         # Loading a MB parsed DB
         elif self._json_db:
             self.db_date, self.data = utils.load_dumped_json(self._json_db)
+            self.__load_hotspot_genes(self._json_db)
             if self._quiet is False:
                 sys.stderr.write('\n  ->  Starting from a processed TA JSON '
                     'Object.\n')
@@ -144,11 +159,24 @@ class TreatmentArms(object):
                 quiet=self._quiet,
             ).api_data
 
-            self.__get_latest_arms(matchbox_data)
             self.data = self.make_match_arms_db(matchbox_data)
         
         # Make a condensed aMOI lookup table too for running aMOIs rules.
-        self.amoi_lookup_table = self.__gen_rules_table()
+        self.amoi_lookup_table = self.__gen_rules_table(self.data)
+        self._gene_index = self.__make_gene_index(self.amoi_lookup_table,
+            self._hotspot_genes)
+
+        # And a table of arm attributes used to filter aMOI results.
+        self.__make_arm_attributes()
+
+        # Compile the rules into arm bitmask tables for mapping aMOIs.
+        self.amoi_rules = self.__compile_rules(self.data, self.amoi_lookup_table)
+
+        # Index all versions of each arm by effective date for as_of queries.
+        self.__make_version_index()
+
+        # And index the arm drugs by code and name for map_drug_arm().
+        self.__make_drug_index()
 
     def __str__(self):
         return utils.print_json(self.data)
@@ -162,35 +190,103 @@ class TreatmentArms(object):
     def __iter__(self):
         return self.data.itervalues()
 
-    def __get_latest_arms(self, data):
-        '''
-        We can have multiple versions of each arm in the database.  Previously
-        we had the ability in the API to filter out older versions and get only
-        the latest ones. With the generic Mongo call, we have to do this 
-        manually.
-        '''
-        arm_versions = defaultdict(list)
-        
-        for arm in data:
-            # if arm['treatmentArmId'] != "EAY131-A":
-                # continue
-            # Inconsistencies in the DB require a little hacking!
-            try:
-                version = datetime.datetime.strptime(
-                    arm['version'].rstrip('-old'), '%Y-%m-%d')
-            except:
-                version = datetime.datetime.strptime(
-                    arm['version'].rstrip('-old'), '%m-%d-%Y')
-            arm_versions[arm['treatmentArmId']].append((version, arm['version']))
-        
-        for arm, ver in arm_versions.items():
-            self._latest_ver[arm] = sorted(ver)[-1][1]
+    @staticmethod
+    def __parse_date(value):
+        # Arm versions are dates, but inconsistencies in the DB mean they can be
+        # in either YYYY-MM-DD or MM-DD-YYYY format, and may have an '-old' 
+        # suffix. Also accept date and datetime objects for as_of queries.
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        elif isinstance(value, datetime.date):
+            return value
+        value = value.rstrip('-old')
+        fmt = '%Y-%m-%d' if value[4] == '-' else '%m-%d-%Y'
+        return datetime.datetime.strptime(value, fmt).date()
+
+    def __make_version_index(self):
+        # Index every version of each arm by the date it went into effect. A 
+        # version is in effect from its version date until the next version's
+        # date. We also keep the sorted dates on which any arm changed, so that
+        # each of those 'epochs' can have its own compiled rules, which are made
+        # on first use and cached.  Arm data processed before we kept the arm
+        # history will just have the current version of each arm.
+        self._version_index = {}
+        epochs = set()
+        for arm, arm_data in self.data.items():
+            records = arm_data.get('history', []) + [arm_data]
+            versions = sorted(
+                (self.__parse_date(record['version']), record['version'], i)
+                for i, record in enumerate(records)
+            )
+            self._version_index[arm] = (
+                [x[0] for x in versions], 
+                [records[x[2]] for x in versions]
+            )
+            epochs.update(x[0] for x in versions)
+        self._epochs = sorted(epochs)
+        self._epoch_rules = {
+            len(self._epochs) - 1 : (self.amoi_rules, self._status_masks, 
+                self._outside_mask)
+        }
 
-    def ta_json_dump(self, amois_filename=None, ta_filename=None):
+    def __arm_as_of(self, arm, as_of):
+        # Return the version of the arm in effect on the as_of date, or None if
+        # the arm did not exist yet.
+        if as_of is None:
+            return self.data[arm]
+        dates, records = self._version_index[arm]
+        i = bisect.bisect_right(dates, self.__parse_date(as_of)) - 1
+        return records[i] if i >= 0 else None
+
+    def __rules_as_of(self, as_of):
+        # Return the compiled rules, status masks and outside lab mask in 
+        # effect on the as_of date, or None if no arms existed yet.
+        if as_of is None:
+            epoch = len(self._epochs) - 1
+        else:
+            epoch = bisect.bisect_right(self._epochs, 
+                self.__parse_date(as_of)) - 1
+            if epoch < 0:
+                return None
+
+        if epoch not in self._epoch_rules:
+            arm_data = {}
+            for arm in self.data:
+                record = self.__arm_as_of(arm, self._epochs[epoch])
+                if record is not None:
+                    arm_data[arm] = record
+            status_masks = defaultdict(int)
+            outside_mask = 0
+            for arm, record in arm_data.items():
+                status_masks[record['status']] |= 1 << self._arm_ids[arm]
+                if record['outside_open']:
+                    outside_mask |= 1 << self._arm_ids[arm]
+            self._epoch_rules[epoch] = (
+                self.__compile_rules(arm_data, self.__gen_rules_table(arm_data)),
+                dict(status_masks), 
+                outside_mask
+            )
+        return self._epoch_rules[epoch]
+
+    def __compile_rules(self, arm_data, rules_table):
+        # Compile the rules into arm bitmask tables. All arms keep the same 
+        # ordinals across versions, even if they did not exist yet.
+        return AmoiRules(
+            rules_table, 
+            sorted(self.data),
+            ihc={arm : arm_data[arm]['ihc'] for arm in arm_data},
+            excl_diseases={
+                arm : arm_data[arm]['excl_diseases'] for arm in arm_data
+            }
+        )
+
+    def ta_json_dump(self, amois_filename=None, ta_filename=None, pretty=True,
+        index=False, checksum=False):
         """
         Dump the TreatmentArms data to a JSON file that can be easily loaded 
         downstream. We will make both the treatment arms object, as well as the 
-        amois lookup table object.
+        amois lookup table object.  Each file is written to a temp file and 
+        renamed into place once it is complete.
 
         Args:
             amois_filename (str): Name of aMOI lookup JSON file. **Default:**
@@ -199,9 +295,19 @@ class TreatmentArms(object):
             ta_filename (str): Name of TA object JSON file **Default:**  
                 `ta_obj_<datestring>.json`
 
+            pretty (bool): Write indented JSON. If ``False``, write compact 
+                JSON.
+
+            index (bool): Also write an offset index for each file, 
+                ``<filename>.idx`` (see ``utils.write_json_dict()``).
+
+            checksum (bool): Also write the SHA-256 checksum of each file to
+                ``<filename>.sha256``.
+
         Returns:
             json: 
                 ta_obj_<date>.json
+                ta_obj_<date>.json.genes
                 amois_lookup_<date>.json
 
         """
@@ -210,8 +316,30 @@ class TreatmentArms(object):
         if not ta_filename:
             ta_filename = 'ta_obj_' + utils.get_today('short') + '.json'
 
-        utils.make_json(outfile=amois_filename, data=self.amoi_lookup_table)
-        utils.make_json(outfile=ta_filename, data=self.data)
+        for filename, data in ((amois_filename, self.amoi_lookup_table),
+                (ta_filename, self.data)):
+            utils.write_json_dict(outfile=filename, data=data, pretty=pretty,
+                index=index, checksum=checksum)
+
+        # The hotspot genes are not part of any arm record, so store them 
+        # alongside the arm data.
+        with utils.atomic_write(ta_filename + '.genes') as fh:
+            json.dump({'hotspot_genes' : self._hotspot_genes}, fh, 
+                sort_keys=True)
+
+    def __load_hotspot_genes(self, json_db):
+        # Load the hotspot genes stored alongside a processed arm file by 
+        # ta_json_dump(), if there are any. Early files stored them in each 
+        # arm's aMOIs instead, so move any of those out of the arm records.
+        try:
+            self._hotspot_genes.update(
+                utils.read_json(json_db + '.genes').get('hotspot_genes') or {})
+        except (OSError, ValueError):
+            pass
+        for arm in self.data.values():
+            for record in [arm] + arm.get('history', []):
+                self._hotspot_genes.update(
+                    record['amois'].pop('hotspot_genes', None) or {})
 
     @staticmethod
     def __retrieve_data_with_keys(data, k1, k2):
@@ -223,7 +351,7 @@ class TreatmentArms(object):
         else:
             return None
 
-    def __gen_rules_table(self, arm_id = None):
+    def __gen_rules_table(self, arm_data):
         # wanted data struct:
             # 'hotspots' : {
                 # 'hs_id' : [arm1, arm2, arm3],
@@ -253,8 +381,8 @@ class TreatmentArms(object):
         }
         ie_flag = {'True' : 'i', 'False' : 'e'}
 
-        for arm in self.data:
-            amoi_data = self.data[arm]['amois']
+        for arm in arm_data:
+            amoi_data = arm_data[arm]['amois']
             for var_type in rules_table:
                 # non_hs mois
                 if var_type in ('deleterious', 'positional'):
@@ -267,8 +395,119 @@ class TreatmentArms(object):
                     for var, flag in amoi_data[var_type].items():
                         rules_table[var_type][var].append('{}({})'.format(
                             arm, ie_flag[str(flag)]))
+
         return rules_table
 
+    @staticmethod
+    def __make_gene_index(rules_table, hotspot_genes):
+        # Make a gene -> aMOI category -> arms index across all of the rules
+        # so that get_arm_by_amoi() is a single lookup. Hotspots are only 
+        # indexed if we captured their gene when parsing the arm data (older
+        # processed arm files don't have it), and fusions are indexed on the 
+        # driver gene (or both genes if we can't tell which is the driver).
+        gene_index = defaultdict(lambda: defaultdict(set))
+        for category, rules in rules_table.items():
+            for var, arms in rules.items():
+                if category == 'hotspot':
+                    genes = [hotspot_genes.get(var)]
+                elif category == 'positional':
+                    genes = [var.split('|')[0]]
+                elif category == 'fusion':
+                    genes = var.split('.')[0].split('-')
+                    if len(genes) == 2:
+                        driver, partner = utils.map_fusion_driver(*genes)
+                        if driver != 'NA':
+                            genes = [driver]
+                else:
+                    genes = [var]
+
+                for gene in genes:
+                    if gene:
+                        gene_index[gene][category].update(arms)
+
+        return {
+            gene : {category : sorted(arms) for category, arms in cats.items()}
+            for gene, cats in gene_index.items()
+        }
+
+    def __make_arm_attributes(self):
+        # Make a compact table of the arm attributes that we filter aMOI 
+        # results on, so that we don't have to build an arm_summary() for every
+        # candidate arm. Each arm also gets an ordinal, and we keep a bitmask
+        # of arms for each status and for arms open to outside labs.
+        self.arm_attributes = {}
+        self._arm_ids = {}
+        self._status_masks = defaultdict(int)
+        self._outside_mask = 0
+
+        for i, arm in enumerate(sorted(self.data)):
+            arm_data = self.data[arm]
+            self.arm_attributes[arm] = ArmAttributes(arm, arm_data['status'], 
+                arm_data['outside_open'], arm_data['drug_name'], 
+                arm_data['version'])
+            self._arm_ids[arm] = i
+            self._status_masks[arm_data['status']] |= 1 << i
+            if arm_data['outside_open']:
+                self._outside_mask |= 1 << i
+        self._status_masks = dict(self._status_masks)
+
+    @staticmethod
+    def __drug_tokens(drugname):
+        # Lower case alphanumeric words in a drug name, so that e.g. 
+        # 'MLN0128(TAK-228)' can be found by 'mln0128', 'tak' or '228'.
+        return re.findall(r'[a-z0-9]+', drugname.lower())
+
+    def __make_drug_index(self):
+        # Map drug codes and normalized (lower case, single spaced) drug names
+        # to masks of arms using the arm ordinals, and make a character trie of
+        # drug name tokens where each node has the mask of all arms with a 
+        # token starting with that prefix (under the None key).
+        self._drug_codes = defaultdict(int)
+        self._drug_names = defaultdict(int)
+        self._drug_trie = {}
+        for arm, arm_data in self.data.items():
+            bit = 1 << self._arm_ids[arm]
+            self._drug_codes[arm_data['drug_id']] |= bit
+            name = ' '.join(arm_data['drug_name'].lower().split())
+            self._drug_names[name] |= bit
+            for token in self.__drug_tokens(arm_data['drug_name']):
+                node = self._drug_trie
+                for char in token:
+                    node = node.setdefault(char, {})
+                    node[None] = node.get(None, 0) | bit
+        self._drug_codes = dict(self._drug_codes)
+        self._drug_names = dict(self._drug_names)
+
+    def __search_drug_trie(self, drugname):
+        # Mask of arms with a drug name token starting with each of the query 
+        # tokens.
+        tokens = self.__drug_tokens(drugname)
+        if not tokens:
+            return 0
+        arms = (1 << len(self._arm_ids)) - 1
+        for token in tokens:
+            node = self._drug_trie
+            for char in token:
+                node = node.get(char)
+                if node is None:
+                    return 0
+            arms &= node[None]
+        return arms
+
+    def __allowed_arms(self, epoch, status=None, outside=False):
+        # Bitmask of arms with the requested status and / or open to outside 
+        # labs in an epoch from __rules_as_of(), or None if we're not 
+        # filtering.
+        if not (status or outside):
+            return None
+        rules, status_masks, outside_mask = epoch
+        allowed = rules.mask
+        if outside:
+            allowed &= outside_mask
+        if status:
+            allowed &= status_masks.get(status, 0)
+        return allowed
+
     def __parse_amois(self, amoi_data):
         parsed_amois = defaultdict(dict)
         wanted = {
@@ -315,6 +554,10 @@ class TreatmentArms(object):
                     parsed_amois[wanted[var]].update(
                         {entry['identifier'] : entry['inclusion']}
                     )
+                    # Keep the gene for hotspots so that we can look arms up
+                    # by gene later on.
+                    if wanted[var] == 'hotspot' and entry.get('gene'):
+                        self._hotspot_genes[entry['identifier']] = entry['gene']
 
         # Pad out data
         for i in wanted.values():
@@ -322,6 +565,31 @@ class TreatmentArms(object):
                 parsed_amois[i] = None
         return parsed_amois
 
+    def __make_arm_record(self, arm):
+        # Pare down one version of an arm from the raw API data.
+        record = {}
+        record['arm_id']    = arm['treatmentArmId']
+        record['name']      = arm.get('name', '-')
+        record['target']    = arm.get('gene', 'UNK')
+        record['drug_name'] = arm['targetName']
+        record['drug_id']   = arm['treatmentArmDrugs'][0]['drugId']
+        record['status']    = arm['treatmentArmStatus']
+        record['version']   = arm['version']
+        record['assigned']  = arm['numPatientsAssigned']
+
+        record['excl_diseases'] = self.__retrieve_data_with_keys(
+            arm['exclusionDiseases'], 'ctepCategory', '_id')
+        record['ihc']           = self.__retrieve_data_with_keys(
+            arm['assayResults'], 'gene', 'assayResultStatus')
+
+        # Make aMOI mappings.
+        record['amois'] = self.__parse_amois(arm['variantReport'])
+
+        record['outside_open'] = False
+        if 'OUTSIDE_ASSAY' in arm['studyTypes']:
+            record['outside_open'] = True
+        return record
+
     def make_match_arms_db(self, api_data):
         """
         **Make a database of MATCH Treatment Arms** 
@@ -330,42 +598,30 @@ class TreatmentArms(object):
         easily parsed later one.  
 
         Args:
-            api_data (json): Entire raw MATCHBox API retrieved dataset.
+            api_data (iterable): Entire raw MATCHBox API retrieved dataset, or
+                an iterator of its arm documents.
 
         Returns:
             json: All Arm data.
 
         """
-        arm_data = defaultdict(dict)
+        # We can have multiple versions of each arm in the database. Keep the
+        # most recent version as the arm data, and the older ones, oldest 
+        # first, in a 'history' list so that we can run as_of queries.  Each
+        # version is pared down as it is read, so that the raw data can be 
+        # streamed in rather than held in memory.
+        arm_versions = defaultdict(list)
         for arm in api_data:
-            # Only want the most recent version of the arm.
-            arm_id = arm['treatmentArmId']
-            if arm['version'] != self._latest_ver[arm_id]:
-                continue
-            # if arm_id != 'EAY131-V':
-                # continue
-            arm_data[arm_id]['arm_id']    = arm_id
-            arm_data[arm_id]['name']      = arm.get('name', '-')
-            arm_data[arm_id]['target']    = arm.get('gene', 'UNK')
-            arm_data[arm_id]['drug_name'] = arm['targetName']
-            arm_data[arm_id]['drug_id']   = arm['treatmentArmDrugs'][0]['drugId']
-            arm_data[arm_id]['status']    = arm['treatmentArmStatus']
-            arm_data[arm_id]['version']   = arm['version']
-            arm_data[arm_id]['assigned']  = arm['numPatientsAssigned']
-
-            arm_data[arm_id]['excl_diseases'] = self.__retrieve_data_with_keys(
-                arm['exclusionDiseases'], 'ctepCategory', '_id')
-            arm_data[arm_id]['ihc']           = self.__retrieve_data_with_keys(
-                arm['assayResults'], 'gene', 'assayResultStatus')
-
-            # Make aMOI mappings.
-            arm_data[arm_id]['amois'] = self.__parse_amois(arm['variantReport'])
-
-            arm_data[arm_id]['outside_open'] = False
-            if 'OUTSIDE_ASSAY' in arm['studyTypes']:
-                arm_data[arm_id]['outside_open'] = True
-        # utils.pp(arm_data)
-        # sys.exit()
+            arm_versions[arm['treatmentArmId']].append(
+                (self.__parse_date(arm['version']), arm['version'], 
+                self.__make_arm_record(arm)))
+
+        arm_data = {}
+        for arm_id, versions in arm_versions.items():
+            versions.sort(key=lambda x: x[:2])
+            records = [record for *_, record in versions]
+            arm_data[arm_id] = records[-1]
+            arm_data[arm_id]['history'] = records[:-1]
         return arm_data
     
     @staticmethod
@@ -374,13 +630,8 @@ class TreatmentArms(object):
         # processing. Will have different amounts of data depending on the
         # source data. From MATCHBox we'll get less than user input, and going
         # to need to account for that.
-        acceptable_keys = ('type', 'gene', 'identifier', 'exon', 'function', 
-            'oncominevariantclass')
-        if 'type' in variant:
-            if variant['type'] == 'cnvs':
-                acceptable_keys = ('type', 'identifier')
-            elif variant['type'] == 'fusions':
-                acceptable_keys = ('type', 'identifier')
+        acceptable_keys = TreatmentArms._variant_keys.get(variant.get('type'),
+            TreatmentArms._variant_keys['snvs_indels'])
 
         if not all(i in variant.keys() for i in acceptable_keys):
             sys.stderr.write("ERROR: Your variant dict is missing keys. You "
@@ -389,7 +640,7 @@ class TreatmentArms(object):
             sys.stderr.write('\n')
             return None
 
-    def map_amoi(self, variant, status=None, outside=False):
+    def map_amoi(self, variant, status=None, outside=False, as_of=None):
         """
         Input a variant dict derived from some kind and return either an aMOI 
         id in the form of Arm(i|e). If variant is not an aMOI, returns 
@@ -418,6 +669,10 @@ class TreatmentArms(object):
                 Designated (AKA 'Outside') Labs program.  Otherwise will list
                 all. DEFAULT: `False`.
 
+            as_of (str): Use the arm rules that were in effect on this date 
+                (``YYYY-MM-DD`` string or ``datetime.date``) rather than the
+                current rules, e.g. to annotate historical variant reports.
+
         Returns
             list:  
             Arm ID(s) with (i)nclusion or (e)xclusion information, or ``None``
@@ -479,57 +734,193 @@ class TreatmentArms(object):
         # Make sure the input data is correctly formatted and complete
         self.__validate_variant_dict(variant)
 
-        result = ''
-        if variant['type'] == 'snvs_indels':
-            if variant['identifier'] in self.amoi_lookup_table['hotspot']:
-                result = (self.amoi_lookup_table['hotspot'][variant['identifier']])
-            elif (
-                variant['oncominevariantclass'] == 'Deleterious' 
-                and variant['gene'] in self.amoi_lookup_table['deleterious']
-            ):
-                result = self.amoi_lookup_table['deleterious'][variant['gene']]
-            else:
-                for v in self.amoi_lookup_table['positional']:
-                    if v.startswith(variant['gene']):
-                        gene, exon, func = v.split('|')
-                        if (variant['exon'].lstrip('Exon') == exon 
-                            and variant['function'] == func
-                        ):
-                            result = self.amoi_lookup_table['positional'][v]
-
-        elif variant['type'] == 'cnvs':
-            # Sometimes the MATCHBox team is inserting these data as "gene" (
-            # the way it was originally intended!) and sometimes it's as 
-            # "identifier".  Need to be able to handle both.
-            if variant['gene'] in ('-', '.', None, 'null', ''):
-                variant['gene'] = variant['identifier']
-
-            if variant['gene'] in self.amoi_lookup_table['cnv']:
-                result = self.amoi_lookup_table['cnv'][variant['gene']]
-
-        elif variant['type'] == 'fusions':
-            if variant['identifier'] in self.amoi_lookup_table['fusion']:
-                result = self.amoi_lookup_table['fusion'][variant['identifier']]
-
-        if result:
-            if outside:
-                # Filter out any arms that are not open to outside labs
-                filtered = [arm for arm in result if self.arm_summary(
-                    arm = arm.split('(')[0])['outside_open']]
-                result = filtered
-
-            if status:
-                # Filter out arms that don't match the status
-                filtered = [arm for arm in result if self.arm_summary(
-                    arm = arm.split('(')[0])['status'] == status]
-                result = filtered
-            return sorted(result)
+        # Sometimes the MATCHBox team is inserting CNV data as "gene" (the way
+        # it was originally intended!) and sometimes it's as "identifier".
+        # The rules lookup handles both, without changing the caller's dict.
+        epoch = self.__rules_as_of(as_of)
+        masks = None
+        if epoch:
+            masks = epoch[0].lookup(variant['type'], variant.get('gene'),
+                variant['identifier'], variant.get('oncominevariantclass'),
+                variant.get('exon'), variant.get('function'))
+
+        if masks:
+            # Filter out any arms that are not open to outside labs and / or
+            # that don't match the status.
+            return epoch[0].decode(*masks, 
+                allowed=self.__allowed_arms(epoch, status, outside))
         else:
             if not self._quiet:
                 sys.stderr.write("No arms matched your criteria!\n")
             return None
 
-    def map_drug_arm(self, armid=None, drugname=None, drugcode=None):
+    def map_amois(self, variants, status=None, outside=False, as_of=None):
+        """
+        Batch version of :meth:`map_amoi`. Input a collection of variants and
+        return the aMOI mapping for each one, in the same order as the input.
+
+        Variants are validated in one pass, and the rules lookups are grouped
+        by variant type so that each distinct gene / identifier is only looked
+        up once, which makes this much faster than calling ``map_amoi()`` in a
+        loop for large outside lab reports.
+
+        Args:
+            variants (list, dict): Either an iterable of variant dicts with the
+                same keys as for :meth:`map_amoi`, or a columnar table in the
+                form of a dict of equal length lists keyed by those same 
+                field names (e.g. as parsed from a VCF or outside lab report).
+
+            status (str): Only output arms that contain this status. Valid 
+                statuses are 'OPEN', 'SUSPENDED', 'CLOSED'. If no value input,
+                all arms will be output.
+
+            outside (bool): If `True`, only output arms that are open for the 
+                Designated (AKA 'Outside') Labs program.  Otherwise will list
+                all. DEFAULT: `False`.
+
+            as_of (str): Use the arm rules that were in effect on this date 
+                (``YYYY-MM-DD`` string or ``datetime.date``) rather than the
+                current rules, e.g. to annotate historical variant reports.
+
+        Returns
+            list:
+            One entry per input variant, containing the list of Arm ID(s) with
+            (i)nclusion or (e)xclusion information, or ``None`` if the variant
+            is not an aMOI or is missing required fields. Returns ``None`` if 
+            the columns of a columnar table are not all the same length.
+
+        Examples:
+            >>> variants = {
+                'type' : ['snvs_indels', 'cnvs'],
+                'gene' : ['BRAF', 'ERBB2'],
+                'identifier' : ['COSM476', 'ERBB2'],
+                'exon' : ['15', '-'],
+                'function' : ['missense', '-'],
+                'oncominevariantclass' : ['Hotspot', 'Amplification'],
+            }
+            >>> self.map_amois(variants)
+            [['EAY131-H(i)', 'EAY131-N(e)', 'EAY131-P(e)', 'EAY131-Y(e)'], 
+            ['EAY131-B(i)', 'EAY131-Q(e)']]
+
+        """
+        fields = ('type', 'gene', 'identifier', 'oncominevariantclass', 'exon',
+            'function')
+        missing = object()
+
+        if isinstance(variants, dict):
+            lengths = set(len(col) for col in variants.values())
+            if len(lengths) > 1:
+                sys.stderr.write("ERROR: The columns of your variant table are "
+                    "not all the same length!\n")
+                return None
+            size = lengths.pop() if lengths else 0
+            rows = zip(*[variants.get(f, [missing] * size) for f in fields])
+        else:
+            rows = (tuple(v.get(f, missing) for f in fields) for v in variants)
+
+        required = {
+            var_type : [fields.index(k) for k in keys]
+            for var_type, keys in self._variant_keys.items()
+        }
+        default_required = required['snvs_indels']
+
+        epoch = self.__rules_as_of(as_of)
+        if epoch is None:
+            sys.stderr.write("ERROR: No arms were in effect on %s.\n" % as_of)
+            return None
+        rules = epoch[0]
+        allowed = self.__allowed_arms(epoch, status, outside)
+        results = []
+        lookups = {}
+        invalid = 0
+        for row in rows:
+            var_type, gene, identifier, varclass, exon, function = row
+            if missing in row and any(row[i] is missing for i in 
+                    required.get(var_type, default_required)):
+                invalid += 1
+                results.append(None)
+                continue
+
+            # Only key the lookup on the fields the rules for each variant
+            # type actually use, so that repeat CNVs and fusions are shared.
+            if var_type == 'snvs_indels':
+                key = row
+            elif var_type == 'cnvs':
+                if gene is missing or gene in NULL_GENES:
+                    gene = identifier
+                key = (var_type, gene)
+            else:
+                key = (var_type, identifier)
+
+            if key not in lookups:
+                masks = rules.lookup(var_type, gene, identifier, varclass, 
+                    exon, function)
+                if masks:
+                    lookups[key] = rules.decode(*masks, allowed=allowed)
+                else:
+                    lookups[key] = None
+            result = lookups[key]
+            results.append(None if result is None else list(result))
+
+        if invalid:
+            sys.stderr.write("ERROR: %s variant(s) are missing required keys "
+                "and could not be mapped. You must input all keys:\n" % invalid)
+            for var_type, keys in sorted(self._variant_keys.items()):
+                sys.stderr.write("\t%s: %s\n" % (var_type, ', '.join(keys)))
+        if not self._quiet:
+            sys.stderr.write("Mapped %s variants (%s distinct lookups).\n" % (
+                len(results), len(lookups)))
+        return results
+
+    def map_patient_amois(self, variants, status=None, outside=False, 
+        as_of=None):
+        """
+        Input a patient's full set of variants and return all of the arms for 
+        which any of those variants is an aMOI, in a single pass over the
+        compiled rules tables (see :class:`AmoiRules`).
+
+        Args:
+            variants (list): List of variant dicts, with the same keys as for
+                :meth:`map_amoi`.
+
+            status (str): Only output arms that contain this status. Valid 
+                statuses are 'OPEN', 'SUSPENDED', 'CLOSED'. If no value input,
+                all arms will be output.
+
+            outside (bool): If `True`, only output arms that are open for the 
+                Designated (AKA 'Outside') Labs program.  Otherwise will list
+                all. DEFAULT: `False`.
+
+            as_of (str): Use the arm rules that were in effect on this date 
+                (``YYYY-MM-DD`` string or ``datetime.date``) rather than the
+                current rules, e.g. to annotate historical variant reports.
+
+        Returns
+            list:
+            Arm ID(s) with (i)nclusion or (e)xclusion information, in the same
+            format as :meth:`map_amoi`, or ``None`` if none of the variants is
+            an aMOI. An arm can be listed as both (i) and (e) if one variant
+            is an inclusion and another an exclusion aMOI for it.
+
+        Examples:
+            >>> self.map_patient_amois([braf_v600e, pik3ca_h1047r])
+            ['EAY131-H(i)', 'EAY131-I(i)', 'EAY131-N(e)', 'EAY131-P(e)', 
+            'EAY131-Y(e)', 'EAY131-Z1F(i)', 'EAY131-Z1G(e)', 'EAY131-Z1H(e)']
+
+        """
+        epoch = self.__rules_as_of(as_of)
+        incl = excl = 0
+        if epoch:
+            incl, excl = epoch[0].evaluate(variants)
+        if not (incl or excl):
+            if not self._quiet:
+                sys.stderr.write("No arms matched your criteria!\n")
+            return None
+        return epoch[0].decode(incl, excl, 
+            allowed=self.__allowed_arms(epoch, status, outside))
+
+    def map_drug_arm(self, armid=None, drugname=None, drugcode=None, 
+        partial=False):
         """
         Input an Arm ID or a drug name, and return a tuple of arm, drugname,
         and ID. 
@@ -539,13 +930,18 @@ class TreatmentArms(object):
                 (e.g. 'EAY131-Z1A').
 
             drugname (str): Drug name as registered in the NCI-MATCH 
-                subprotocols. Right now, required to have the full string (e.g.
-                'MLN0128(TAK-228)' or, unfortunately, 'Sunitinib malate 
-                (SU011248 L-malate)'), but will work on a regex to help make 
-                this easier later on.
+                subprotocols. Matching is case insensitive, but requires the 
+                full string (e.g. 'MLN0128(TAK-228)' or, unfortunately, 
+                'Sunitinib malate (SU011248 L-malate)') unless ``partial`` is 
+                set.
 
             drugcode (str): Use the 6-digit drug code to pull results.
 
+            partial (bool): Match drug names on the start of words rather than
+                the full string, so that 'sunitinib', 'SU0112' or 'tak 228'
+                will all find their arms. Every word in the query has to
+                match. DEFAULT: ``False``.
+
         .. note::
             Note that using the ``drugname`` or ``drugcode`` option may return
             more than one result as we can have more than one arm per drug.
@@ -567,6 +963,9 @@ class TreatmentArms(object):
              ('EAY131-B', 'Afatinib', '750691'),
              ('EAY131-BX1', 'Afatinib', '750691')]
 
+            >>> map_drug_arm(drugname='sunit', partial=True)
+            [('EAY131-V', 'Sunitinib malate (SU011248 L-malate)', '736511')]
+
             >>> map_drug_arm(drugname='Tylenol')
             None
 
@@ -581,15 +980,20 @@ class TreatmentArms(object):
                 return (armid, self.data[armid]['drug_name'], 
                         self.data[armid]['drug_id'])
         elif drugname or drugcode: 
-            results = [] 
-            for arm in self.data:
-                if drugname and self.data[arm]['drug_name'] != drugname:
-                    continue
-                elif drugcode and self.data[arm]['drug_id'] != drugcode:
-                    continue
-                results.append(
-                    (self.data[arm]['arm_id'], self.data[arm]['drug_name'], 
-                    self.data[arm]['drug_id']))
+            arms = (1 << len(self._arm_ids)) - 1
+            if drugname and partial:
+                arms &= self.__search_drug_trie(drugname)
+            elif drugname:
+                arms &= self._drug_names.get(
+                    ' '.join(drugname.lower().split()), 0)
+            if drugcode:
+                arms &= self._drug_codes.get(drugcode, 0)
+
+            results = [
+                (self.data[arm]['arm_id'], self.data[arm]['drug_name'], 
+                    self.data[arm]['drug_id'])
+                for i, arm in enumerate(self.amoi_rules.arms) if arms >> i & 1
+            ]
             if not results:
                 results = None
             return results
@@ -633,7 +1037,7 @@ class TreatmentArms(object):
             print('ERROR: No arm with ID: "%s" found in study!' % armid)
             return None
 
-    def get_amois_by_arm(self, arm):
+    def get_amois_by_arm(self, arm, as_of=None):
         """
         Input an arm identifier and return a list of aMOIs for the arm broken
         down by category.
@@ -641,18 +1045,26 @@ class TreatmentArms(object):
         Args:
             arm (str):  Arm identifier to query
 
+            as_of (str): Use the version of the arm that was in effect on this
+                date (``YYYY-MM-DD`` string or ``datetime.date``) rather than
+                the current version.
+
         Returns:
             dict: All aMOIs indicated for an arm.
 
         """
 
-        try:
-            arm_data = self.data[arm]
-        except KeyError:
+        if arm not in self.data:
             sys.stderr.write('ERROR: No arm with ID: "%s" found in '
                 'study!\n' % arm)
             return None
 
+        arm_data = self.__arm_as_of(arm, as_of)
+        if arm_data is None:
+            sys.stderr.write('ERROR: Arm "%s" was not in effect on %s!\n' % (
+                arm, as_of))
+            return None
+
         # Iterate through hotspots, cnvs, fusions, and non-hs aMOIs and generate
         # a list of tuples of data that can be printed easily later.
         return dict(arm_data['amois'])
@@ -687,13 +1099,21 @@ class TreatmentArms(object):
         Query study arms by gene or hotspot ID
 
         Input either a HUGO gene name or a hotspot ID as it is represented in
-        the hotspots BED file (e.g. COSM476, MCH12, etc.), and return a list of
-        arms for which that variant is a part, along with the type of variant 
+        the hotspots BED file (e.g. COSM476, MCH12, etc.), and return the arms
+        for which that variant is a part, broken down by the type of aMOI rule
         represented by the identifier.  If one were to enter BRAF, then all arms
-        that contain BRAF mutations, along with the categories of `Hotspot` and 
-        `Fusion` would be indicated, as BRAF can be activating in either of 
+        that contain BRAF mutations, along with the categories of `hotspot` and 
+        `fusion` would be indicated, as BRAF can be activating in either of 
         those categories.  
 
+        Gene queries span all of the aMOI categories in the rules table: 
+        ``hotspot``, ``cnv``, ``fusion`` (by driver gene), ``deleterious`` and
+        ``positional``.  Hotspots can only be found by gene if the arm data 
+        was generated with a version of this package that records hotspot 
+        genes (in a ``<ta_obj>.genes`` file next to the arm data).  If not, 
+        gene queries leave out the hotspot arms and write a warning to stderr;
+        regenerate the arm data with ``matchbox_json_dump.py`` to fix this.
+
         Args:
             gene (str): HUGO genename to use for querying the database.
 
@@ -701,33 +1121,43 @@ class TreatmentArms(object):
                 query the database.
 
         Returns:
-            list: List of study arms for which the query variants are aMOIs.
+            dict: aMOI category with a list of study arms (with (i)nclusion or 
+            (e)xclusion information) for which the query is an aMOI, or 
+            ``None`` if the query is not an aMOI for any arm.
 
         Examples:
+            >>> self.get_arm_by_amoi(gene='BRAF')
+            {'fusion': ['EAY131-R(e)'], 'hotspot': ['EAY131-H(i)', 
+            'EAY131-N(e)', 'EAY131-P(e)', 'EAY131-Y(e)']}
 
-            >>> # Need to put an example here.
-
-        .. attention::
-            This method is not yet functional and is only a placeholder for
-            now.  Intend to code and implement soon!
+            >>> self.get_arm_by_amoi(hotspot='COSM476')
+            {'hotspot': ['EAY131-H(i)', 'EAY131-N(e)', 'EAY131-P(e)', 
+            'EAY131-Y(e)']}
 
         """
-        sys.stderr.write('This method is not yet functional and is only a'
-            'placeholder for now.  Intend to code and implement soon!\n')
-        return None
-        
         if gene:
-            pass
+            if not self._hotspot_genes and self.amoi_lookup_table['hotspot']:
+                sys.stderr.write('WARN: The treatment arm data has no hotspot '
+                    'genes, so hotspot arms are left out of the results for '
+                    '%s. Regenerate the arm data with matchbox_json_dump.py '
+                    'to include them.\n' % gene)
+            results = self._gene_index.get(gene)
+            query = gene
         elif hotspot:
-            arm_list = self.amoi_lookup_table['hotspot'].get(hotspot, None)
-            if not arm_list:
-                sys.stderr.write("No arms found for ID %s.\n" % hotspot)
-                return None
+            arm_list = self.amoi_lookup_table['hotspot'].get(hotspot)
+            results = {'hotspot' : sorted(arm_list)} if arm_list else None
+            query = hotspot
         else:
             sys.stderr.write("ERROR: No gene or hotspot ID entered!\n")
             return None
 
-    def arm_summary(self, arm):
+        if not results:
+            if not self._quiet:
+                sys.stderr.write("No arms found for %s.\n" % query)
+            return None
+        return {category : list(arms) for category, arms in results.items()}
+
+    def arm_summary(self, arm, as_of=None):
         """
         Output summary information about a particular arm
 
@@ -737,6 +1167,10 @@ class TreatmentArms(object):
         Args:
              arm (str): Valid NCI-MATCH arm name, in the format EAY131-<arm>
 
+             as_of (str): Summarize the version of the arm that was in effect
+                 on this date (``YYYY-MM-DD`` string or ``datetime.date``) 
+                 rather than the current version.
+
         Returns:
              dict: Summary of arm details.
 
@@ -756,24 +1190,28 @@ class TreatmentArms(object):
 
         """
 
-        try:
-            arm_data = self.data[arm]
-        except KeyError:
+        if arm not in self.data:
             sys.stderr.write("ERROR: Arm %s does not exist in this trial!\n"
                 % arm)
             return None
 
+        arm_data = self.__arm_as_of(arm, as_of)
+        if arm_data is None:
+            sys.stderr.write("ERROR: Arm %s was not in effect on %s!\n" % (
+                arm, as_of))
+            return None
+
         wanted_fields = ('arm_id', 'assigned', 'drug_name', 'name', 'status',
             'outside_open', 'version')
 
         results = dict((x, arm_data[x]) for x in wanted_fields)
 
         for amoi_type in ('cnv', 'fusion', 'hotspot'):
-            vrts = self.data[arm]['amois'][amoi_type]
+            vrts = arm_data['amois'][amoi_type]
             count = len(vrts) if vrts else 0
             results.update({amoi_type : count})
-        non_hs_amois = (len(self.data[arm]['amois']['non_hs']['deleterious'].keys())
-            + len(self.data[arm]['amois']['non_hs']['positional'].keys()))
+        non_hs_amois = (len(arm_data['amois']['non_hs']['deleterious'].keys())
+            + len(arm_data['amois']['non_hs']['positional'].keys()))
         results.update({'non_hs' : non_hs_amois})
 
         return results
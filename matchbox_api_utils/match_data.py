@@ -1,19 +1,86 @@
 # -*- coding: utf-8 -*-
+import os
 import sys
 import json
-#import itertools
+import itertools
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 from matchbox_api_utils import utils
 from matchbox_api_utils import matchbox_conf
 
 from matchbox_api_utils.matchbox import Matchbox
 from matchbox_api_utils.match_arms import TreatmentArms
+from matchbox_api_utils.cohort import PatientIndex
+from matchbox_api_utils.amoi_rules import (screen_patients, 
+    init_screen_worker, screen_worker_patients, NULL_GENES)
+from matchbox_api_utils.frozen import freeze
+from matchbox_api_utils.records import compact_patient, intern_patient
+from matchbox_api_utils.query_cache import QueryCache, cached_query
+from matchbox_api_utils import snapshot
 import matchbox_api_utils._version
 
 from pprint import pformat # noqa
 
 
+# Cache keys for the cached query methods, made from the normalized method 
+# arguments so that equivalent queries (e.g. the same genes in a different 
+# order, or PSNs with and without the prefix) share a result. ``None`` means
+# don't cache the call.
+def _id_key(ids, prefix=''):
+    return tuple(sorted({str(x).lstrip(prefix) for x in str(ids).split(',')}))
+
+def _genes_key(genes):
+    if isinstance(genes, (list, tuple, set)):
+        return tuple(sorted(set(genes)))
+    return genes
+
+def _biopsy_summary_key(category=None, ret_type='counts'):
+    return (category, ret_type)
+
+def _disease_summary_key(query_disease=None, query_meddra=None, outside=False):
+    if query_meddra:
+        if not isinstance(query_meddra, list):
+            return None
+        query = ('meddra', tuple(sorted({str(x) for x in query_meddra})))
+    elif query_disease:
+        if not isinstance(query_disease, list):
+            return None
+        query = ('disease', tuple(sorted({str(x) for x in query_disease})))
+    else:
+        query = ('all',)
+    return (query, bool(outside))
+
+def _histology_key(psn=None, msn=None, bsn=None, outside=False, 
+        no_disease=False, ret_type='ctep_term'):
+    if sum((x is None for x in (psn, msn, bsn))) < 2:
+        return None
+    if psn:
+        query = ('psn', _id_key(psn, 'PSN'))
+    elif msn:
+        query = ('msn', _id_key(msn, 'MSN'))
+    elif bsn:
+        query = ('bsn', tuple(sorted(set(bsn.split(',')))))
+    else:
+        query = ('all',)
+    return (query, outside is False, no_disease is False, ret_type)
+
+def _variant_frequency_key(query, query_patients=None):
+    if query_patients:
+        if not isinstance(query_patients, list):
+            return None
+        # Keep any repeats, since they count towards the biopsy total.
+        query_patients = tuple(sorted(str(x).lstrip('PSN') 
+            for x in query_patients))
+    else:
+        query_patients = None
+    return (tuple(sorted((k, _genes_key(v)) for k, v in query.items())), 
+        query_patients)
+
+def _patients_by_arm_key(arm, outside=False):
+    return (arm, outside is False)
+
+
 class MatchData(object):
 
     """
@@ -76,7 +143,9 @@ class MatchData(object):
             dataset. This is usually generated from 'matchbox_json_dump.py'. 
             By default the package JSON file, located in ``mb_root`` is loaded
             if no value passed to this argument. If you wish you get a live 
-            call, set this variable to ``None``.
+            call, set this variable to ``None``. A JSON Lines file 
+            (``.jsonl``, from :meth:`matchbox_json_lines`) or a snapshot 
+            (from :meth:`matchbox_snapshot`) can be loaded too.
 
         load_raw (file): Load a raw API dataset rather than making a fresh
             call to the API. This is intended for dev purpose only and may 
@@ -88,11 +157,25 @@ class MatchData(object):
         quiet (bool): If ``True``, suppress module output debug, information, 
             etc. messages. 
 
+        frozen (bool): If ``True``, load the data in read-only, frozen mode, 
+            so that the object can be shared between threads (see 
+            :meth:`freeze`).
+
+        compact (bool): If ``True``, store the patient records as compact, 
+            read-only record objects to save memory (see :meth:`compact`).
+
+        cache_size (int): If set, cache the results of up to this many 
+            queries (see :meth:`enable_cache`).
+
+        cache_ttl (float): Number of seconds to keep cached query results.
+            Only used with ``cache_size``. DEFAULT: ``None`` (no expiry).
+
     """
 
     def __init__(self, matchbox='adult', method='mongo', config_file=None, 
         username=None, password=None, patient=None, json_db='sys_default', 
-        load_raw=None, make_raw=None, quiet=False):
+        load_raw=None, make_raw=None, quiet=False, frozen=False, 
+        compact=False, cache_size=None, cache_ttl=None):
 
         sys.stderr.write('\nWelcome to MATCHBox API Utils Version %s\n\n' % 
             matchbox_api_utils._version.__version__)
@@ -112,6 +195,11 @@ class MatchData(object):
         self._json_db = json_db
         self.db_date = utils.get_today('long')
         self._quiet = quiet
+        self._indexed = False
+        self._frozen = False
+        self._query_cache = None
+        summaries = None
+        indexes = None
 
         self._patient = self.__format_id('rm', psn=patient)
         if self._patient is not None and self._quiet is not None:
@@ -159,12 +247,54 @@ class MatchData(object):
         if load_raw:
             if self._quiet is False:
                 sys.stderr.write('\n  ->  Starting from a raw MB JSON Obj\n')
-            self.db_date, matchbox_data = utils.load_dumped_json(load_raw)
+            # Stream the patient documents out of the dump one at a time. When
+            # filtering on a patient, the other patients are dropped as they 
+            # are read, before they are processed.
+            self.db_date, matchbox_data = utils.stream_dumped_json(load_raw)
             self.data = self.__gen_patients_list(matchbox_data, self._patient)
 
+        # Load a memory mapped snapshot of a parsed MB dataset.
+        elif self._json_db and snapshot.is_snapshot(self._json_db):
+            self.data = snapshot.Snapshot(self._json_db)
+            self.db_date = self.data.db_date
+            summaries = self.data.summaries
+            indexes = self.data.indexes
+            if self._quiet is False:
+                sys.stderr.write('\n  ->  Starting from a MB snapshot.\n')
+                sys.stderr.write('\n  ->  Snapshot date: %s\n' % self.db_date)
+            if self._patient:
+                self.data = self.__get_record(self._patient)
+                summaries = indexes = None
+
+        # Load a parsed MB JSON Lines dataset, one patient per line.  When 
+        # filtering on a patient, only their lines are decoded.
+        elif self._json_db and self._json_db.endswith('.jsonl'):
+            self.db_date = utils.get_file_date(self._json_db)
+            keys = [self._patient] if self._patient else None
+            self.data = {}
+            for psn, record in utils.iter_json_lines(self._json_db, keys):
+                self.data[psn] = intern_patient(record)
+            if self._quiet is False:
+                sys.stderr.write('\n  ->  Starting from a processed MB JSON '
+                    'Lines file.\n')
+                sys.stderr.write('\n  ->  JSON database object date: '
+                    '%s\n' % self.db_date)
+            if self._patient:
+                self.data = self.__get_record(self._patient)
+
         # Load parsed MB JSON dataset rather than a live query.
         elif self._json_db:
             self.db_date, self.data = utils.load_dumped_json(self._json_db)
+
+            # Use the precomputed summaries stored alongside the file, if they
+            # were made from this version of it.  Early dumps stored them in
+            # the file itself, under a key that is not a patient.
+            self.data.pop('_summaries', None)
+            summaries = self.__load_summaries(self._json_db)
+
+            # Share one copy of each repeated categorical value.
+            for record in self.data.values():
+                intern_patient(record)
             if self._quiet is False:
                 sys.stderr.write('\n  ->  Starting from a processed MB JSON '
                     'Object.\n')
@@ -175,6 +305,7 @@ class MatchData(object):
                     sys.stderr.write('Filtering on patient: '
                         '%s.\n' % self._patient)
                 self.data = self.__get_record(self._patient)
+                summaries = None
 
         # Make a live query to MB and either create a new raw_db or parse it 
         # out and work from there.
@@ -217,9 +348,191 @@ class MatchData(object):
                 matchbox_data = [matchbox_data]
             self.data = self.__gen_patients_list(matchbox_data, self._patient)
 
-        # Load up a meddra : ctep term db based on entries so that we can look
-        # data up on the fly.
-        self._disease_db = self.__make_disease_db()
+        self.__build_indexes(summaries, indexes)
+        if compact:
+            self.compact()
+        if frozen:
+            self.freeze()
+        if cache_size:
+            self.enable_cache(cache_size, cache_ttl)
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        if self._frozen:
+            raise AttributeError('Can not replace the data of a frozen '
+                'MatchData object.')
+        # Replacing the dataset makes the indexes and cached summaries stale, 
+        # so rebuild them if we are past the initial load.
+        self._data = data
+        if self._indexed:
+            self.reindex()
+
+    def reindex(self):
+        """
+        Rebuild the lookup indexes and cached summaries for the dataset.
+
+        Indexes and summaries are built once when the data is loaded, and are
+        rebuilt automatically if ``data`` is replaced.  If patient records are
+        edited in place, call this method to bring them back in sync.
+
+        """
+        if self._frozen:
+            sys.stderr.write('ERROR: A frozen MatchData object can not be '
+                'reindexed.\n')
+            return None
+        self.__build_indexes()
+
+    @property
+    def frozen(self):
+        """``True`` if the object is in read-only, frozen mode."""
+        return self._frozen
+
+    def compact(self):
+        """
+        Convert the patient records to compact record objects (see 
+        :mod:`records`) to cut the memory used by the dataset several fold.
+
+        Patients, biopsies, NGS results and variants are stored in slotted 
+        classes rather than dicts, so the field names are not repeated in 
+        every record, and all of the records share one copy of each repeated
+        string value (gene names, statuses, etc.).  The records work like 
+        read-only dicts, so the query methods, and callers that only read the
+        records, work as before, and records compare equal to the dicts they 
+        replace.  Records can't be edited in place, and on a frozen object 
+        the values in them are frozen too. Data loaded from a snapshot is 
+        decoded on demand and is left as is.
+
+        Returns:
+            MatchData: The object, with compact records.
+
+        Examples:
+            >>> data = MatchData(json_db='mb_obj.json', compact=True)
+            >>> data.data['10005']['biopsies']['T-16-000048']['biopsy_status']
+            'Pass'
+
+        """
+        if isinstance(self._data, dict):
+            strings = {}
+            data = {psn : compact_patient(record, strings) 
+                for psn, record in self._data.items()}
+            # Compacting copies the values out of the frozen records, so 
+            # freeze them again to keep the data read-only.
+            self._data = freeze(data) if self._frozen else data
+        return self
+
+    def freeze(self):
+        """
+        Switch to a read-only, frozen mode that is safe to use from many 
+        threads at once.
+
+        The patient records are replaced with deep read-only copies (see 
+        :mod:`frozen`), so that neither the query methods nor their callers
+        can change the shared data through the records, lists, etc. that the 
+        query methods return.  Frozen records still compare equal to, and 
+        serialize the same as, the plain dicts and lists they replace.  The
+        data can't be replaced or reindexed once frozen.  Data loaded from a
+        snapshot is already read-only, and is left as is.
+
+        Returns:
+            MatchData: The object, now frozen.
+
+        Examples:
+            >>> data = MatchData(json_db='mb_obj.json').freeze()
+            >>> with ThreadPoolExecutor() as pool:
+            ...     results = list(pool.map(data.get_histology, psns))
+
+        """
+        if not self._frozen:
+            if isinstance(self._data, dict):
+                self._data = freeze(self._data)
+            self._frozen = True
+        return self
+
+    def __build_indexes(self, summaries=None, indexes=None):
+        # Assign dense PSN ordinals, which all of the bitmap indexes are based
+        # on.
+        self._patient_index = PatientIndex(self.data)
+
+        if indexes and indexes.get('patients') == len(self.data):
+            # Use the indexes stored with a snapshot, so that we don't have to
+            # decode every record to rebuild them.
+            self.__load_indexes(indexes)
+        else:
+            # Load up a meddra : ctep term db based on entries so that we can 
+            # look data up on the fly, along with the disease lookup indexes.
+            self._disease_db = self.__make_disease_db()
+
+            # Build the bitmap indexes used to make and combine patient 
+            # cohorts.
+            self.__make_indexes()
+
+        # Biopsy and disease summaries only change when the data does, so 
+        # compute them once here (or use the ones stored with the processed 
+        # DB if they match) rather than on every call.
+        if not summaries or summaries.get('patients') != len(self.data):
+            summaries = self.__make_summaries()
+        self._summaries = summaries
+        self._indexed = True
+
+        # Any cached query results are for the old data.
+        self.clear_cache()
+
+    def enable_cache(self, maxsize=256, ttl=None):
+        """
+        Cache the results of the heavier query methods: 
+        :meth:`find_variant_frequency`, :meth:`get_histology`, 
+        :meth:`get_disease_summary`, :meth:`get_biopsy_summary`, and 
+        :meth:`get_patients_by_arm`.
+
+        Cache keys are made from the normalized query arguments, so that, for
+        example, the same genes in a different order or PSNs with or without 
+        the ``PSN`` prefix will use the same cached result.  Each caller gets 
+        their own copy of a cached result.  Messages a query writes to stderr 
+        (e.g. filtered specimen warnings) are only written when the query is
+        first run.  The cache is cleared whenever the data is replaced or 
+        reindexed.
+
+        Args:
+            maxsize (int): Maximum number of query results to cache. The least
+                recently used results are dropped first. DEFAULT: ``256``.
+
+            ttl (float): Number of seconds to keep a cached result. DEFAULT: 
+                ``None`` (keep results until they're dropped or the data is 
+                reloaded).
+
+        Examples:
+            >>> data.enable_cache(maxsize=100, ttl=3600)
+            >>> data.get_histology(psn='11352')
+            {'PSN11352': 'Serous endometrial adenocarcinoma'}
+            >>> data.get_histology(psn='PSN11352')
+            {'PSN11352': 'Serous endometrial adenocarcinoma'}
+            >>> data.cache_info()
+            {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 100, 'ttl': 3600}
+
+        """
+        self._query_cache = QueryCache(maxsize, ttl)
+
+    def disable_cache(self):
+        """Stop caching query results, and drop any cached results."""
+        self._query_cache = None
+
+    def clear_cache(self):
+        """Drop all cached query results."""
+        if self._query_cache is not None:
+            self._query_cache.clear()
+
+    def cache_info(self):
+        """
+        Return the query cache statistics (``hits``, ``misses``, ``size``, 
+        ``maxsize`` and ``ttl``), or ``None`` if caching is not enabled.
+        """
+        if self._query_cache is None:
+            return None
+        return self._query_cache.info()
 
     def __str__(self):
         return utils.print_json(self.data)
@@ -237,8 +550,19 @@ class MatchData(object):
         # Make an on the fly mapping of meddra to ctep term db for mapping later
         # on.  Might make a class and all that later, but for now, since we do
         # not know how this will be displayed later, this is good enough.
+        #
+        # Also build the disease indexes so that lookups don't have to scan
+        # every patient:
+        #   - ctep term -> meddra code (first code seen for the term).
+        #   - meddra code -> bitmap of PSNs, and ctep term -> bitmap of PSNs.
+        #   - trigram -> set of lower cased ctep terms, for case insensitive 
+        #     substring searches.
         med_map = {}
-        for pt in self.data.values():
+        meddra_bits = defaultdict(int)
+        term_bits = defaultdict(int)
+
+        for psn, ordinal in self._patient_index.ordinals.items():
+            pt = self.data[psn]
             meddra = pt.get('meddra_code', None)
             if meddra is None:
                 print('Offending record:')
@@ -246,8 +570,186 @@ class MatchData(object):
                 sys.exit()
             if meddra != 'null':
                 med_map.update({pt['meddra_code'] : pt['ctep_term']})
+            meddra_bits[meddra] |= 1 << ordinal
+            term_bits[pt['ctep_term']] |= 1 << ordinal
+
+        self._meddra_bits = dict(meddra_bits)
+
+        # Key the term postings on the lower case term, since all of the 
+        # substring searches are case insensitive.
+        self._term_bits = defaultdict(int)
+        for term, bits in term_bits.items():
+            self._term_bits[term.lower()] |= bits
+        self._term_bits = dict(self._term_bits)
+        self.__make_term_lookups(med_map)
         return med_map
 
+    def __make_term_lookups(self, med_map):
+        # ctep term -> meddra code, and the trigram index over the lower case
+        # terms in the term postings.
+        self._term_index = {}
+        for meddra, term in med_map.items():
+            self._term_index.setdefault(term, meddra)
+        self._term_trigrams = defaultdict(set)
+        for lc_term in self._term_bits:
+            for i in range(len(lc_term) - 2):
+                self._term_trigrams[lc_term[i:i+3]].add(lc_term)
+        self._term_trigrams = dict(self._term_trigrams)
+
+    def __match_terms(self, query, prefix=False):
+        # Return the set of lower cased ctep terms that contain (or start with)
+        # the query string. Narrow the candidates down with the trigram index
+        # and then check them, so that we only look at a handful of terms 
+        # rather than every patient.
+        query = query.lower()
+        if len(query) < 3:
+            candidates = self._term_bits.keys()
+        else:
+            candidates = None
+            for i in range(len(query) - 2):
+                terms = self._term_trigrams.get(query[i:i+3], set())
+                candidates = terms if candidates is None else candidates & terms
+                if not candidates:
+                    return set()
+        if prefix:
+            return {x for x in candidates if x.startswith(query)}
+        return {x for x in candidates if query in x}
+
+    def __make_indexes(self):
+        # Using the dense PSN ordinals, store sets of patients as int bitmaps 
+        # (see the cohort module), and make bitmaps of outside assay patients
+        # and gene carriers by variant type. Gene carriers follow
+        # the same rules as find_variant_frequency(): only passed, non-outside
+        # biopsies, and no novel or non-targeted fusions.  Also keep a bitmap 
+        # of patients with any sequencing data to use as the background set
+        # for gene level stats, and an arm -> [(psn, arm status)] index so 
+        # that arm queries don't have to look at every patient.
+        var_types = {
+            'singleNucleotideVariants' : 'snvs',
+            'indels'                   : 'indels',
+            'copyNumberVariants'       : 'cnvs',
+            'unifiedGeneFusions'       : 'fusions',
+        }
+        self._outside_bits = 0
+        self._sequenced_bits = 0
+        self._gene_bits = {}
+        self._arm_index = defaultdict(list)
+
+        for psn, ordinal in self._patient_index.ordinals.items():
+            bit = 1 << ordinal
+            record = self.data[psn]
+            if 'OUTSIDE' in record['source']:
+                self._outside_bits |= bit
+            for arm, arm_status in record['ta_arms'].items():
+                self._arm_index[arm].append((psn, arm_status))
+            if record['biopsies'] == 'No_Biopsy':
+                continue
+            for biopsy in record['biopsies'].values():
+                if biopsy['biopsy_status'] != 'Pass':
+                    continue
+                if not biopsy['ngs_data'] or 'mois' not in biopsy['ngs_data']:
+                    continue
+                self._sequenced_bits |= bit
+                for var_key, variants in biopsy['ngs_data']['mois'].items():
+                    var_type = var_types[var_key]
+                    for variant in variants:
+                        if var_type == 'fusions' and any(
+                            x in variant['identifier'] 
+                            for x in ('Novel', 'Non-Targeted')
+                        ):
+                            continue
+                        gene_types = self._gene_bits.setdefault(
+                            variant['gene'], {})
+                        gene_types[var_type] = gene_types.get(var_type, 0) | bit
+        self._arm_index = dict(self._arm_index)
+
+    def __dump_indexes(self):
+        # The disease, arm and gene indexes in a JSON friendly form, to be 
+        # stored with a snapshot. Bitmaps are written as hex strings, which 
+        # convert to and from ints in linear time.
+        return {
+            'patients'       : len(self.data),
+            'disease_db'     : self._disease_db,
+            'meddra_bits'    : {k : '%x' % v 
+                for k, v in self._meddra_bits.items()},
+            'term_bits'      : {k : '%x' % v 
+                for k, v in self._term_bits.items()},
+            'outside_bits'   : '%x' % self._outside_bits,
+            'sequenced_bits' : '%x' % self._sequenced_bits,
+            'gene_bits'      : {
+                gene : {var_type : '%x' % bits 
+                    for var_type, bits in var_types.items()}
+                for gene, var_types in self._gene_bits.items()
+            },
+            'arm_index'      : self._arm_index,
+        }
+
+    def __load_indexes(self, indexes):
+        # Restore the indexes from __dump_indexes().
+        self._disease_db = indexes['disease_db']
+        self._meddra_bits = {k : int(v, 16) 
+            for k, v in indexes['meddra_bits'].items()}
+        self._term_bits = {k : int(v, 16) 
+            for k, v in indexes['term_bits'].items()}
+        self.__make_term_lookups(self._disease_db)
+        self._outside_bits = int(indexes['outside_bits'], 16)
+        self._sequenced_bits = int(indexes['sequenced_bits'], 16)
+        self._gene_bits = {
+            gene : {var_type : int(bits, 16) 
+                for var_type, bits in var_types.items()}
+            for gene, var_types in indexes['gene_bits'].items()
+        }
+        self._arm_index = {arm : [tuple(x) for x in patients]
+            for arm, patients in indexes['arm_index'].items()}
+
+    def __make_summaries(self):
+        # Make the biopsy counts / BSN lists for get_biopsy_summary() and the 
+        # per MEDDRA code patient counts for get_disease_summary(), both with 
+        # and without outside assay patients.
+        count = defaultdict(int)
+        ids = defaultdict(list)
+        disease_counts = {
+            'with_outside'    : defaultdict(int),
+            'without_outside' : defaultdict(int),
+        }
+
+        for p, record in self.data.items():
+            count['patients'] += 1
+
+            # Skip the registered but not yet biopsied patients.
+            if record['meddra_code'] != 'null':
+                disease_counts['with_outside'][record['meddra_code']] += 1
+                if 'OUTSIDE' not in record['source']:
+                    disease_counts['without_outside'][record['meddra_code']] += 1
+
+            try:
+                if record['biopsies'] == 'No_Biopsy':
+                    count['no_biopsy'] += 1
+                    continue
+                for bsn, biopsy in record['biopsies'].items():
+                    biopsy_flag = biopsy['biopsy_status']
+                    source      = biopsy['biopsy_source']
+                    count[biopsy_flag.lower()] += 1
+                    ids[biopsy_flag.lower()].append(bsn) 
+
+                    # Source will be '---' when a biopsy fails, so exclude those
+                    if source != '---':
+                        count[source.lower()] += 1
+                        ids[source.lower()].append(bsn)
+                    if biopsy['ngs_data']:
+                        count['sequenced'] += 1
+                        ids['sequenced'].append(bsn)
+            except:
+                print('offending record: %s' % p)
+                raise
+
+        return {
+            'patients'       : len(self.data),
+            'biopsy_counts'  : dict(count),
+            'biopsy_ids'     : dict(ids),
+            'disease_counts' : {k : dict(v) for k, v in disease_counts.items()},
+        }
+
     def __get_record(self, psn):
         # Get a patient record based on a PSN if it's in the DB. Return a dict
         # of PSN : Record.
@@ -402,130 +904,167 @@ class MatchData(object):
         # into a much more concise and easily parsable dict of data. This dict 
         # will be the main dataset used for later data analysis and queries and
         # is the main structure for the MatchboxData class below.
-        patients = defaultdict(dict)
+        return dict(self.iter_patients(matchbox_data, self.arm_data, patient))
+
+    @classmethod
+    def iter_patients(cls, matchbox_data, arm_data, patient=None):
+        """
+        Process raw MATCHBox patient documents into the records used in 
+        ``MatchData.data``, one patient at a time.
+
+        Unlike loading a raw dataset with ``MatchData(load_raw=...)``, the raw
+        documents can come from any iterator (e.g. a MongoDB cursor, or the 
+        lines of a ``mongoexport`` dump; see :mod:`pipeline`), and neither the
+        raw nor the processed dataset is ever held in memory as a whole.  No 
+        ``MatchData`` object is needed, so this can be called on the class.
+
+        Args:
+            matchbox_data (iterable): Raw MATCHBox patient documents (dicts).
+
+            arm_data (TreatmentArms): Treatment arm data used to annotate the
+                variants with aMOIs.
+
+            patient (str): Only process this patient (PSN, without the prefix).
+
+        Yields:
+            tuple: ``(psn, record)`` for each patient.
+
+        Examples:
+            >>> ta = TreatmentArms('adult', quiet=True)
+            >>> with open('raw_mb_dump.jsonl') as fh:
+            ...     for psn, record in MatchData.iter_patients(
+            ...             pipeline.read_json_lines(fh), ta):
+            ...         print(psn, record['ctep_term'])
+
+        """
         for record in matchbox_data:
             psn = record['patientSequenceNumber']
             
             if patient and psn != str(patient):
                 continue
-            
-            patients[psn]['psn']         = psn
-            patients[psn]['gender']      = record.get('gender', 'null')
-            patients[psn]['ethnicity']   = record.get('ethnicity', 'null')
-            patients[psn]['source']      = record.get('patientType', 'null')
-            patients[psn]['concordance'] = record.get('concordance', 'null')
-
-            races = record.get('races', [])
-            if len(record.get('races', [])) > 0:
-                patients[psn]['race'] = races[0]
-            else: patients[psn]['race'] = 'null'
-
-            # For diseases, we have a list, where the last element is the latest
-            # edit and the most correct data. But the list might be empty if no
-            # biopsy ever taken.
-            try:
-                latest_disease = record['diseases'][-1]
-            except IndexError:
-                latest_disease = {}
 
-            patients[psn]['ctep_term'] = latest_disease.get('ctepTerm', 'null')
-            patients[psn]['meddra_code'] = latest_disease.get('_id', 'null')
+            yield psn, cls.__gen_patient_record(psn, record, arm_data)
+
+    @classmethod
+    def __gen_patient_record(cls, psn, record, arm_data):
+        # Make the processed record for one raw patient document.
+        pt_data = {}
+        pt_data['psn']         = psn
+        pt_data['gender']      = record.get('gender', 'null')
+        pt_data['ethnicity']   = record.get('ethnicity', 'null')
+        pt_data['source']      = record.get('patientType', 'null')
+        pt_data['concordance'] = record.get('concordance', 'null')
+
+        races = record.get('races', [])
+        if len(record.get('races', [])) > 0:
+            pt_data['race'] = races[0]
+        else: pt_data['race'] = 'null'
+
+        # For diseases, we have a list, where the last element is the latest
+        # edit and the most correct data. But the list might be empty if no
+        # biopsy ever taken.
+        try:
+            latest_disease = record['diseases'][-1]
+        except IndexError:
+            latest_disease = {}
 
-            patients[psn]['all_msns']     = []
-            patients[psn]['all_biopsies'] = []
+        pt_data['ctep_term'] = latest_disease.get('ctepTerm', 'null')
+        pt_data['meddra_code'] = latest_disease.get('_id', 'null')
 
-            # Get treatment arm history. 
-            # TODO: Right now just getting a dict of arm : status. Do we want to
-            # set this up as a list of dicts that include assignment date too, 
-            # so that we can order them, and make length on arm calcs?
-            pt_triggers = record.get('patientTriggers', [])
-            pt_assignments = record.get('patientAssignments', [])
-            pt_rejoin_trigs = record.get('patientRejoinTriggers', [])
+        pt_data['all_msns']     = []
+        pt_data['all_biopsies'] = []
 
-            try:
-                last_status, last_msg, arm_hist, progressed = self.__get_pt_hist(
-                    pt_triggers, pt_assignments, pt_rejoin_trigs)
-            except:
-                print('bad patient: %s' % psn)
-                raise
+        # Get treatment arm history. 
+        # TODO: Right now just getting a dict of arm : status. Do we want to
+        # set this up as a list of dicts that include assignment date too, 
+        # so that we can order them, and make length on arm calcs?
+        pt_triggers = record.get('patientTriggers', [])
+        pt_assignments = record.get('patientAssignments', [])
+        pt_rejoin_trigs = record.get('patientRejoinTriggers', [])
 
-            patients[psn]['current_trial_status']    = last_status
-            patients[psn]['last_msg']                = last_msg
-            patients[psn]['ta_arms']                 = arm_hist
-            patients[psn]['progressed']              = progressed
+        try:
+            last_status, last_msg, arm_hist, progressed = cls.__get_pt_hist(
+                pt_triggers, pt_assignments, pt_rejoin_trigs)
+        except:
+            print('bad patient: %s' % psn)
+            raise
 
-            patients[psn]['biopsies'] = {}
-            if not record['biopsies']:
-                patients[psn]['biopsies'] = 'No_Biopsy'
-            else:
-                for biopsy in record['biopsies']:
-                    bsn = biopsy['biopsySequenceNumber']
-                    # TODO: manual skip for now; will have to find a way to 
-                    #       clean up database later.
-                    if bsn == 'T-16-002080' and psn == '12850':
-                        continue
-                    patients[psn]['all_biopsies'].append(bsn)
-                
-                    biopsy_data = defaultdict(dict)
-                    biopsy_data[bsn]['ihc']      = '---'
-                    biopsy_data[bsn]['biopsy_source']   = '---'
-                    biopsy_data[bsn]['ngs_data'] = {}
+        pt_data['current_trial_status']    = last_status
+        pt_data['last_msg']                = last_msg
+        pt_data['ta_arms']                 = arm_hist
+        pt_data['progressed']              = progressed
+
+        pt_data['biopsies'] = {}
+        if not record['biopsies']:
+            pt_data['biopsies'] = 'No_Biopsy'
+        else:
+            for biopsy in record['biopsies']:
+                bsn = biopsy['biopsySequenceNumber']
+                # TODO: manual skip for now; will have to find a way to 
+                #       clean up database later.
+                if bsn == 'T-16-002080' and psn == '12850':
+                    continue
+                pt_data['all_biopsies'].append(bsn)
+            
+                biopsy_data = defaultdict(dict)
+                biopsy_data[bsn]['ihc']      = '---'
+                biopsy_data[bsn]['biopsy_source']   = '---'
+                biopsy_data[bsn]['ngs_data'] = {}
 
-                    if biopsy['failure']:
-                        biopsy_data[bsn]['biopsy_status'] = 'Failed_Biopsy'
+                if biopsy['failure']:
+                    biopsy_data[bsn]['biopsy_status'] = 'Failed_Biopsy'
+                else:
+                    biopsy_data[bsn]['biopsy_status'] = 'Pass'
+                    biopsy_data[bsn]['ihc'] = cls.__get_ihc_results(
+                            biopsy['assayMessages']
+                    )
+
+                    # Define biopsy type as Initial, Progression, or Outside
+                    biopsy_type = biopsy['biopsyType']
+                    if biopsy_type == 'STANDARD':
+                        biopsy_type = biopsy['associatedPatientStatus']
+
+                    biopsy_sources = {
+                        'OUTSIDE' : 'Outside',
+                        'CONFIRMATION' : 'Confirmation',
+                        'PROGRESSION_REBIOPSY' : 'Progression',
+                        'REGISTRATION' : 'Initial'
+                    }
+                    status = biopsy_sources[biopsy_type]
+                    biopsy_data[bsn]['biopsy_source'] = status
+
+                    # Don't load up outside assay data as it's mish-mosh
+                    if status == 'Outside':
+                        biopsy_data[bsn]['ngs_data'] = 'NA'
                     else:
-                        biopsy_data[bsn]['biopsy_status'] = 'Pass'
-                        biopsy_data[bsn]['ihc'] = self.__get_ihc_results(
-                                biopsy['assayMessages']
-                        )
-
-                        # Define biopsy type as Initial, Progression, or Outside
-                        biopsy_type = biopsy['biopsyType']
-                        if biopsy_type == 'STANDARD':
-                            biopsy_type = biopsy['associatedPatientStatus']
-
-                        biopsy_sources = {
-                            'OUTSIDE' : 'Outside',
-                            'CONFIRMATION' : 'Confirmation',
-                            'PROGRESSION_REBIOPSY' : 'Progression',
-                            'REGISTRATION' : 'Initial'
-                        }
-                        status = biopsy_sources[biopsy_type]
-                        biopsy_data[bsn]['biopsy_source'] = status
-
-                        # Don't load up outside assay data as it's mish-mosh
-                        if status == 'Outside':
-                            biopsy_data[bsn]['ngs_data'] = 'NA'
-                        else:
-                            for result in biopsy['nextGenerationSequences']:
-                                # Skip all Failed and Pending reports.
-                                if result['status'] != 'CONFIRMED':  
-                                    continue 
-                                ir_data = result['ionReporterResults']
-                                msn, runid, dna, rna, vcf, vardata = utils.get_vals(
-                                    ir_data, 
-                                    'molecularSequenceNumber',
-                                    'jobName', 
-                                    'dnaBamFilePath',
-                                    'rnaBamFilePath',
-                                    'vcfFilePath',
-                                    'variantReport',
-                                )
-                                patients[psn]['all_msns'].append(msn)
-                                biopsy_data[bsn]['ngs_data']['msn'] = msn
-                                biopsy_data[bsn]['ngs_data']['ir_runid'] = runid
-                                biopsy_data[bsn]['ngs_data']['dna_bam_path'] = dna
-                                biopsy_data[bsn]['ngs_data']['rna_bam_path'] = rna
-                                biopsy_data[bsn]['ngs_data']['vcf_path'] = vcf
-
-                                biopsy_data[bsn]['ngs_data']['mois']  = dict(
-                                    self.__proc_ngs_data(vardata)
-                                )
-
-                    patients[psn]['biopsies'].update(dict(biopsy_data))
-        # utils.pp(dict(patients))
-        # utils.__exit__(448, "Finished with generating Patient DB.")
-        return patients
+                        for result in biopsy['nextGenerationSequences']:
+                            # Skip all Failed and Pending reports.
+                            if result['status'] != 'CONFIRMED':  
+                                continue 
+                            ir_data = result['ionReporterResults']
+                            msn, runid, dna, rna, vcf, vardata = utils.get_vals(
+                                ir_data, 
+                                'molecularSequenceNumber',
+                                'jobName', 
+                                'dnaBamFilePath',
+                                'rnaBamFilePath',
+                                'vcfFilePath',
+                                'variantReport',
+                            )
+                            pt_data['all_msns'].append(msn)
+                            biopsy_data[bsn]['ngs_data']['msn'] = msn
+                            biopsy_data[bsn]['ngs_data']['ir_runid'] = runid
+                            biopsy_data[bsn]['ngs_data']['dna_bam_path'] = dna
+                            biopsy_data[bsn]['ngs_data']['rna_bam_path'] = rna
+                            biopsy_data[bsn]['ngs_data']['vcf_path'] = vcf
+
+                            biopsy_data[bsn]['ngs_data']['mois']  = dict(
+                                cls.__proc_ngs_data(vardata, arm_data)
+                            )
+
+                pt_data['biopsies'].update(dict(biopsy_data))
+        intern_patient(pt_data)
+        return pt_data
 
     @staticmethod
     def __get_ihc_results(ihc_data):
@@ -542,7 +1081,8 @@ class MatchData(object):
             ihc_results['RB'] = 'ND'
         return ihc_results
 
-    def __proc_ngs_data(self, ngs_results):
+    @classmethod
+    def __proc_ngs_data(cls, ngs_results, arm_data):
        # Create and return a dict of variant call data that can be stored in 
        # the patient's obj.
         variant_call_data = defaultdict(list)
@@ -556,14 +1096,18 @@ class MatchData(object):
                     if var_type == 'unifiedGeneFusions':
                         if 'Targeted' in variant['identifier']:
                             continue
-                    var_data = self.__gen_variant_dict(variant, var_type)
-                    var_data.update({'amoi' : self.arm_data.map_amoi(var_data)})
+                    var_data = cls.__gen_variant_dict(variant, var_type)
+                    # CNV gene names are sometimes only in the identifier.
+                    if (var_data['type'] == 'cnvs' 
+                            and var_data['gene'] in NULL_GENES):
+                        var_data['gene'] = var_data['identifier']
+                    var_data.update({'amoi' : arm_data.map_amoi(var_data)})
                     variant_call_data[var_type].append(var_data)
 
         # Remap the driver / partner genes so that we know they're correct, and 
         # add a 'gene' field to use later on.
         if 'unifiedGeneFusions' in variant_call_data:
-            variant_call_data['unifiedGeneFusions'] = self.__remap_fusion_genes(
+            variant_call_data['unifiedGeneFusions'] = cls.__remap_fusion_genes(
                 variant_call_data['unifiedGeneFusions']
             )
         return variant_call_data
@@ -661,6 +1205,7 @@ class MatchData(object):
         else:
             return pt_data
 
+    @cached_query(_biopsy_summary_key)
     def get_biopsy_summary(self, category=None, ret_type='counts'):
         # TODO: These numbers are sort of wonky.  Because of the way patients
         #       are registered, the numbers don't always really make sense. i
@@ -733,37 +1278,14 @@ class MatchData(object):
                  'T-18-000031']}
 
         """
-        count = defaultdict(int)
-        ids = defaultdict(list)
-
-        for p in self.data:
-            count['patients'] += 1
-            try:
-                if self.data[p]['biopsies'] == 'No_Biopsy':
-                    count['no_biopsy'] += 1
-                    continue
-                for bsn, biopsy in self.data[p]['biopsies'].items():
-                    biopsy_flag = biopsy['biopsy_status']
-                    source      = biopsy['biopsy_source']
-                    count[biopsy_flag.lower()] += 1
-                    ids[biopsy_flag.lower()].append(bsn) 
-
-                    # Source will be '---' when a biopsy fails, so exclude those
-                    if source != '---':
-                        count[source.lower()] += 1
-                        ids[source.lower()].append(bsn)
-                    if biopsy['ngs_data']:
-                        count['sequenced'] += 1
-                        ids['sequenced'].append(bsn)
-            except:
-                print('offending record: %s' % p)
-                raise
-
+        # Summaries are computed once at load; hand back copies so that the 
+        # cached data can not be changed by the caller.
         results = {}
         if ret_type == 'counts':
-            results = dict(count)
+            results = dict(self._summaries['biopsy_counts'])
         elif ret_type == 'ids':
-            results = dict(ids)
+            results = {k : list(v) 
+                for k, v in self._summaries['biopsy_ids'].items()}
 
         if category:
             try:
@@ -774,7 +1296,8 @@ class MatchData(object):
         else:
             return results
     
-    def matchbox_dump(self, filename=None):
+    def matchbox_dump(self, filename=None, pretty=True, index=False, 
+        checksum=False):
         """
         Dump a parsed MATCHBox dataset.
         
@@ -783,13 +1306,31 @@ class MatchData(object):
         look ups as the API call can be very, very slow with such a large DB.
 
         .. note:: 
-            This is a different dataset than the raw dump.
+            This is a different dataset than the raw dump.  The precomputed 
+            biopsy and disease summaries are stored alongside the file, in 
+            ``<filename>.summaries``, with the SHA-256 checksum of the file 
+            they were made from. They are loaded back in with the data, 
+            unless the file has changed since.
+
+        The file is written one patient at a time to a temp file, which is 
+        only renamed into place once it is complete, so an interrupted dump 
+        never leaves a truncated file for the system default data lookup to 
+        pick up.
 
         Args:
             filename (str): Filename to use for output. Default filename is:
 
                 ``mb_obj_<date_generated>.json``
 
+            pretty (bool): Write indented JSON. If ``False``, write compact 
+                JSON, which is smaller and quicker to write and load.
+
+            index (bool): Also write an offset index of the patient records,
+                ``<filename>.idx`` (see ``utils.write_json_dict()``).
+
+            checksum (bool): Also write the SHA-256 checksum of the file to
+                ``<filename>.sha256``.
+
         Returns:
             JSON: 
             MATCHBox API JSON file.
@@ -803,7 +1344,88 @@ class MatchData(object):
         formatted_date = utils.get_today('short')
         if not filename:
             filename = 'mb_obj_' + formatted_date + '.json'
-        utils.make_json(outfile=filename, data=self.data)
+
+        digest = utils.write_json_dict(outfile=filename, data=self.data, 
+            pretty=pretty, index=index, checksum=checksum)
+
+        # Store the precomputed summaries alongside the data so that they 
+        # don't have to be regenerated on load.
+        with utils.atomic_write(filename + '.summaries') as fh:
+            json.dump({
+                'data_sha256' : digest,
+                'db_date'     : self.db_date,
+                'summaries'   : self._summaries,
+            }, fh)
+
+    @staticmethod
+    def __load_summaries(json_db):
+        # Load the summaries stored alongside a JSON dump by matchbox_dump(), 
+        # if there are any and they were made from this exact file.
+        try:
+            stored = utils.read_json(json_db + '.summaries')
+        except (OSError, ValueError):
+            return None
+        if stored.get('data_sha256') != utils.file_sha256(json_db):
+            return None
+        return stored.get('summaries')
+
+    def matchbox_json_lines(self, filename=None, append=False):
+        """
+        Write the parsed MATCHBox dataset to a JSON Lines file, with one 
+        ``[psn, record]`` JSON array per line.
+
+        Unlike the single JSON object from :meth:`matchbox_dump`, patients 
+        can be added to or updated in a JSON Lines file by appending lines to
+        it (the last line for a patient wins when the file is loaded), and one
+        patient can be loaded without decoding the others.  Load the file by
+        passing it as the ``json_db`` argument to ``MatchData``. The biopsy 
+        and disease summaries are not stored, and are made when the file is 
+        loaded.
+
+        Args:
+            filename (str): Filename to use for output. Default filename is:
+
+                ``mb_obj_<date_generated>.jsonl``
+
+            append (bool): Add the patients in this dataset to the end of an
+                existing file (e.g. to sync patients that have changed since 
+                the file was made), rather than writing a new file.
+
+        """
+        if not filename:
+            filename = 'mb_obj_' + utils.get_today('short') + '.jsonl'
+        utils.make_json_lines(outfile=filename, items=self.data.items(),
+            append=append)
+
+    def matchbox_snapshot(self, filename=None):
+        """
+        Write the parsed MATCHBox dataset to a memory mapped snapshot file.
+
+        Snapshots hold the same data as the JSON dump from 
+        :meth:`matchbox_dump`, but in a read-only binary format that is 
+        memory mapped rather than parsed when loaded. Many processes (e.g. web
+        server or multiprocessing workers) can then load the same snapshot and 
+        share one copy of the patient records through the OS page cache, 
+        rather than each holding their own copy of the whole dataset.  Load a
+        snapshot by passing it as the ``json_db`` argument to ``MatchData``.
+
+        The summaries and the disease, arm and gene indexes are stored in the 
+        snapshot too, so loading one doesn't decode any patient records. Each
+        process still holds its own copy of those indexes, which are small 
+        next to the records.  Query methods that read patient records decode
+        them from the snapshot on every call, so those queries are slower 
+        than on data loaded from JSON.
+
+        Args:
+            filename (str): Filename to use for output. Default filename is:
+
+                ``mb_obj_<date_generated>.mbsnap``
+
+        """
+        if not filename:
+            filename = 'mb_obj_' + utils.get_today('short') + '.mbsnap'
+        snapshot.write_snapshot(filename, self.data, db_date=self.db_date,
+            summaries=self._summaries, indexes=self.__dump_indexes())
 
     def get_psn(self, msn=None, bsn=None):
         """
@@ -830,15 +1452,15 @@ class MatchData(object):
 
         """
         query_term = ''
-        for p in self.data:
+        for p, record in self.data.items():
             if msn:
                 msn = self.__format_id('add', msn=msn)
                 query_term = msn
-                if msn in self.data[p]['all_msns']:
+                if msn in record['all_msns']:
                     return self.__format_id('add',psn=p)
             elif bsn:
                 query_term = bsn
-                if bsn in self.data[p]['all_biopsies']:
+                if bsn in record['all_biopsies']:
                     return self.__format_id('add',psn=p)
             else:
                 sys.stderr.write('ERROR: No MSN or BSN entered!\n')
@@ -882,9 +1504,9 @@ class MatchData(object):
                 return self.data[psn]['all_msns']
         elif bsn:
             query_term = bsn
-            for p in self.data:
-                if bsn in self.data[p]['all_biopsies']:
-                    biopsy_data = self.data[p]['biopsies'][bsn]
+            for p, record in self.data.items():
+                if bsn in record['all_biopsies']:
+                    biopsy_data = record['biopsies'][bsn]
                     try:
                         return [biopsy_data['ngs_data']['msn']]
                     except KeyError:
@@ -945,9 +1567,9 @@ class MatchData(object):
         elif msn:
             msn = self.__format_id('add',msn=msn)
             query_term = msn
-            for p in self.data:
-                if msn in self.data[p]['all_msns']:
-                    for b, data in self.data[p]['biopsies'].items():
+            for p, record in self.data.items():
+                if msn in record['all_msns']:
+                    for b, data in record['biopsies'].items():
                         msn = data['ngs_data'].get('msn', None)
                         if msn is None:
                             continue
@@ -961,6 +1583,7 @@ class MatchData(object):
         sys.stderr.write('No result for id %s\n' % query_term)
         return None
 
+    @cached_query(_disease_summary_key)
     def get_disease_summary(self, query_disease=None, query_meddra=None, 
             outside=False):
         """
@@ -993,17 +1616,11 @@ class MatchData(object):
               '10024193': (u'Leiomyosarcoma (excluding uterine leiomyosarcoma)', 55)}
             
         """
-        disease_counts = defaultdict(int)
         results = defaultdict(list)
-
-        for psn in self.data.values():
-            if outside is False and 'OUTSIDE' in psn['source']:
-                continue
-
-            # Skip the registered but not yet biopsied patients.
-            if psn['meddra_code'] == 'null': 
-                continue
-            disease_counts[psn['meddra_code']] += 1
+        if outside:
+            disease_counts = self._summaries['disease_counts']['with_outside']
+        else:
+            disease_counts = self._summaries['disease_counts']['without_outside']
 
         if query_meddra:
             if isinstance(query_meddra, list) is False:
@@ -1024,22 +1641,23 @@ class MatchData(object):
                 return None
             for q in query_disease:
                     q = str(q)
-                    meddra = next((meddra for meddra, term in self._disease_db.items() if q == term), None)
+                    meddra = self._term_index.get(q, None)
                     if meddra is not None:
-                        results[meddra] = (q, disease_counts[meddra])
+                        results[meddra] = (q, disease_counts.get(meddra, 0))
                     else:
                         sys.stderr.write('CTEP Term "%s" was not found in the '
                             'MATCH study dataset.\n' % q)
         else:
             for meddra in self._disease_db:
                 results[meddra] = (self._disease_db[meddra], 
-                    disease_counts[meddra])
+                    disease_counts.get(meddra, 0))
 
         if results:
             return dict(results)
         else:
             return None
 
+    @cached_query(_histology_key)
     def get_histology(self, psn=None, msn=None, bsn=None, outside=False, 
             no_disease=False, ret_type='ctep_term'):
         """
@@ -1154,17 +1772,18 @@ class MatchData(object):
         # Iterate through the valid PSNs and get results if they pass filters.
         filtered = []
         for psn in query_list:
-            if psn in self.data:
+            record = self.data.get(psn)
+            if record is not None:
                 # If the no disease filter is turned on (i.e. False) don't 
                 # output "No Biopsy" results.
-                if outside is False and 'OUTSIDE' in self.data[psn]['source']:
+                if outside is False and 'OUTSIDE' in record['source']:
                     filtered.append(psn)
                     continue
-                if no_disease is False and self.data[psn]['ctep_term']=='null':
+                if no_disease is False and record['ctep_term']=='null':
                     filtered.append(psn)
                     continue
 
-                output_data[query_list[psn]] = self.data[psn][ret_type]
+                output_data[query_list[psn]] = record[ret_type]
 
         if filtered: 
             if len(filtered) > 10:
@@ -1178,6 +1797,7 @@ class MatchData(object):
                 sys.stderr.write('\t%s\n' % ','.join(filtered))
         return output_data
 
+    @cached_query(_variant_frequency_key)
     def find_variant_frequency(self, query, query_patients=None):
         """
         Find and return variant hit rates.
@@ -1272,17 +1892,17 @@ class MatchData(object):
             pt_list = self.data.keys()
 
         for patient in pt_list:
+            record = self.data[patient]
             # Skip no biopsy and all outside biospy cases.  For outside assay 
             # cases, we don't want to consider any of it since the confirmation 
             # data will skew results.
-            if self.data[patient]['biopsies'] == 'No_Biopsy':
+            if record['biopsies'] == 'No_Biopsy':
                 continue
-            elif 'OUTSIDE' in self.data[patient]['source']:
+            elif 'OUTSIDE' in record['source']:
                 continue
             else:
                 matches = []
-                for biopsy in self.data[patient]['biopsies']:
-                    b_record = self.data[patient]['biopsies'][biopsy]
+                for biopsy, b_record in record['biopsies'].items():
 
                     # Get rid of Outside assays biopsies (but not outside 
                     # confirmation) and Failed biopsies.
@@ -1340,14 +1960,154 @@ class MatchData(object):
 
                     if matches:
                         results[patient] = {
-                            'psn'      : self.data[patient]['psn'],
-                            'disease'  : self.data[patient]['ctep_term'],
-                            'msns'     : self.data[patient]['all_msns'],
+                            'psn'      : record['psn'],
+                            'disease'  : record['ctep_term'],
+                            'msns'     : record['all_msns'],
                             'bsns'     : biopsies,
                             'mois'     : matches
                         }
         return results, len(set(plist)), len(plist)
 
+    def get_variant_summary(self, group_by=('gene',), query=None, 
+            query_patients=None, outside=False):
+        """
+        Count patients and variants grouped by any combination of variant and
+        patient level fields.
+
+        Rather than running ``find_variant_frequency()`` once for each gene, 
+        disease, or arm of interest, this will generate the whole breakdown 
+        (i.e. a pivot table) in a single pass over the dataset.  The same
+        patient and biopsy filters as ``find_variant_frequency()`` are used, 
+        and a variant seen in more than one biopsy from the same patient 
+        (e.g. an initial and a progression biopsy) is only counted once.
+
+        Args:
+            group_by (list): Fields on which to group the counts. Can be any
+                combination of: ::
+
+                    - gene
+                    - variant_type (one of 'snvs', 'indels', 'cnvs', 'fusions')
+                    - ctep_term
+                    - meddra_code
+                    - arm
+                    - arm_status
+                    - source
+
+                Since a patient can be on more than one arm, grouping on 
+                ``arm`` or ``arm_status`` will count the patient under each 
+                arm.  Patients never assigned to an arm are grouped under 
+                ``'-'``.
+
+            query (dict): Optional dict of ``variant_type : gene list`` in the
+                same format as ``find_variant_frequency()`` to limit the 
+                variants counted. DEFAULT: all variants.
+            query_patients (list): Optional list of patients to count.
+            outside (bool): Include outside assay patients. DEFAULT: ``False``.
+
+        Returns:
+            dict: Dict of ``group : {'patients' : count, 'variants' : count}``
+            where group is a tuple of values in the order of ``group_by``.
+
+        Examples:
+            >>> data.get_variant_summary(group_by=('gene', 'ctep_term'),
+            ...     query={'snvs' : ['BRAF']})
+            {('BRAF', 'Adenocarcinoma of the colon'): {'patients': 14, 
+                                                       'variants': 14},
+             ('BRAF', 'Melanoma'): {'patients': 21, 'variants': 22},
+             ...}
+
+        """
+        valid_fields = ('gene', 'variant_type', 'ctep_term', 'meddra_code', 
+            'arm', 'arm_status', 'source')
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        if not group_by or any(x not in valid_fields for x in group_by):
+            sys.stderr.write('ERROR: group_by fields must be one or more of: '
+                '%s.\n' % ', '.join(valid_fields))
+            return None
+
+        var_types = {
+            'singleNucleotideVariants' : 'snvs',
+            'indels'                   : 'indels',
+            'copyNumberVariants'       : 'cnvs',
+            'unifiedGeneFusions'       : 'fusions',
+        }
+        var_fields = [i for i, x in enumerate(group_by) 
+            if x in ('gene', 'variant_type')]
+        arm_fields = [i for i, x in enumerate(group_by) 
+            if x in ('arm', 'arm_status')]
+
+        if query_patients:
+            if isinstance(query_patients, list) is False:
+                sys.stderr.write('ERROR: You must input the query patients as '
+                    'a list, even if only inputting one!\n')
+                return None
+            pt_list = [self.__format_id('rm', psn=x) for x in query_patients]
+        else:
+            pt_list = self.data.keys()
+
+        patient_counts = defaultdict(set)
+        variant_counts = defaultdict(set)
+
+        for patient in pt_list:
+            record = self.data.get(patient)
+            if record is None or record['biopsies'] == 'No_Biopsy':
+                continue
+            if outside is False and 'OUTSIDE' in record['source']:
+                continue
+
+            # Collect the unique variants for the patient across biopsies.
+            variants = set()
+            for biopsy in record['biopsies'].values():
+                if biopsy['biopsy_status'] != 'Pass':
+                    continue
+                if not biopsy['ngs_data'] or 'mois' not in biopsy['ngs_data']:
+                    continue
+                for var_key, var_list in biopsy['ngs_data']['mois'].items():
+                    var_type = var_types[var_key]
+                    if query is not None and var_type not in query:
+                        continue
+                    for variant in var_list:
+                        if query is not None and (
+                            variant['gene'] not in query[var_type]):
+                            continue
+                        if var_type == 'fusions' and any(
+                            x in variant['identifier'] 
+                            for x in ('Novel', 'Non-Targeted')
+                        ):
+                            continue
+                        variants.add((var_type, variant['gene'], 
+                            variant['identifier'], variant.get('hgvs')))
+            if not variants:
+                continue
+
+            # Patient level values are the same for every variant, and arm 
+            # values give one group per arm.  Two arms can land in the same 
+            # group (e.g. with the same arm_status), so count each of the 
+            # patient's variants once per group.
+            if arm_fields:
+                arms = list(record['ta_arms'].items()) or [('-', '-')]
+            else:
+                arms = [(None, None)]
+            base = [record.get(x) for x in group_by]
+            for arm, arm_status in arms:
+                for i in arm_fields:
+                    base[i] = arm if group_by[i] == 'arm' else arm_status
+                for variant in variants:
+                    for i in var_fields:
+                        base[i] = (variant[1] if group_by[i] == 'gene' 
+                            else variant[0])
+                    group = tuple(base)
+                    patient_counts[group].add(patient)
+                    variant_counts[group].add((patient, variant))
+
+        return {
+            group : {
+                'patients' : len(patient_counts[group]),
+                'variants' : len(variant_counts[group])
+            } for group in sorted(variant_counts)
+        }
+
     def get_variant_report(self, psn=None, msn=None):
         """
         .. _get_variant_report:
@@ -1500,8 +2260,8 @@ class MatchData(object):
             else:
                 return None
         else:
-            for p in self.data:
-                results[p] = self.data[p]['ta_arms']
+            for p, record in self.data.items():
+                results[p] = record['ta_arms']
         return results 
     
     def get_patients_by_disease(self, histology=None, meddra_code=None, 
@@ -1586,21 +2346,49 @@ class MatchData(object):
                 "meddra code to query!\n")
             return None
 
-        results = {}
+        bits = 0
         if histology:
-            for pt in self.data:
-                if outside is False and 'OUTSIDE' in self.data[pt]['source']:
-                    continue
-                if histology.lower() in self.data[pt]['ctep_term'].lower():
-                    results[pt] = self.data[pt]['ctep_term']
+            for term in self.__match_terms(histology):
+                bits |= self._term_bits[term]
         elif meddra_code:
-            for pt in self.data:
-                if outside is False and 'OUTSIDE' in self.data[pt]['source']:
-                    continue
-                if meddra_code == self.data[pt]['meddra_code']:
-                    results[pt] = self.data[pt]['ctep_term']
-        return results
+            bits = self._meddra_bits.get(meddra_code, 0)
+
+        if outside is False:
+            bits &= ~self._outside_bits
+        return {pt : self.data[pt]['ctep_term'] 
+            for pt in self._patient_index.cohort(bits=bits)}
+
+    def search_diseases(self, query, prefix=False):
+        """
+        Search the CTEP terms of the diseases in the dataset.
+
+        Case insensitive search for diseases whose CTEP term contains the query
+        string, or starts with it if ``prefix`` is set.  This is a good way to
+        find the exact term or MEDDRA code to use with the other disease 
+        methods.
+
+        Args:
+            query (str): String to search for.
+            prefix (bool): Only match terms that start with the query string.
+                DEFAULT: ``False``.
+
+        Returns:
+            dict: Dict of ``{meddra_code : ctep_term}`` for matching diseases.
 
+        Examples:
+            >>> data.search_diseases('glioma')
+            {'10030286': 'Oligodendroglioma, NOS', 
+             '10002224': 'Anaplastic oligodendroglioma'}
+
+            >>> data.search_diseases('small cell', prefix=True)
+            {'10041067': 'Small cell lung cancer'}
+
+        """
+        matches = self.__match_terms(query, prefix=prefix)
+        return {meddra : term for meddra, term in self._disease_db.items()
+            if term.lower() in matches}
+
+    @cached_query(_patients_by_arm_key)
     def get_patients_by_arm(self, arm, outside=False):
         """
         Input an official NCI-MATCH arm identifier (e.g. `EAY131-A`) and return
@@ -1649,13 +2437,385 @@ class MatchData(object):
             sys.stderr.write('ERROR: No such arm: {}!\n'.format(arm))
             return None
 
-        for pt in self.data:
+        for pt, arm_status in self._arm_index.get(arm, []):
             if outside is False and 'OUTSIDE' in self.data[pt]['source']:
                 continue
-            if arm in self.data[pt]['ta_arms']:
-                results.append((pt, arm, self.data[pt]['ta_arms'][arm]))
+            results.append((pt, arm, arm_status))
+        return results
+
+    def get_arm_status_summary(self, outside=False):
+        """
+        Return a cross tabulation of patient counts by arm and arm status for 
+        the whole study.
+
+        This is a single pass over the arm index built at load, and is a much
+        faster way to get study wide enrollment numbers than calling 
+        ``get_patients_by_arm()`` for each arm.  Every arm in the treatment arm
+        data is reported, even if no patients have qualified for it.
+
+        Args:
+            outside (bool): Include outside assay patients in the counts. 
+                DEFAULT: ``False``.
+
+        Returns:
+            dict: Dict of ``{arm : {arm_status : count}}``.
+
+        Examples:
+            >>> data.get_arm_status_summary()['EAY131-E']
+            {'ON_TREATMENT_ARM': 2, 'OFF_TRIAL_DECEASED': 1, 
+             'FORMERLY_ON_ARM_OFF_TRIAL': 1}
+
+        """
+        results = {arm : {} for arm in self.arm_data.data}
+        for arm, patients in self._arm_index.items():
+            counts = results.setdefault(arm, {})
+            for pt, arm_status in patients:
+                if outside is False and 'OUTSIDE' in self.data[pt]['source']:
+                    continue
+                counts[arm_status] = counts.get(arm_status, 0) + 1
+        return dict(sorted(results.items()))
+
+    def get_cohort(self, psns=None, arm=None, histology=None,
+            meddra_code=None, gene=None, variant_type=None, outside=False):
+        """
+        Return a cohort of patients as a bitmap that can be quickly combined
+        with other cohorts.
+
+        Each PSN in the dataset is assigned a dense ordinal at load, and a
+        cohort is stored as a single int bitmap over those ordinals.  Cohorts
+        support ``&`` (AND), ``|`` (OR), ``-`` (difference), ``^`` and ``~``
+        (NOT) operations, ``len()`` for cardinality, and can be converted back
+        to a list of PSNs with ``psns()``.  This is much faster than building
+        and intersecting lists or dicts of PSN strings when many cohorts are
+        being generated and combined.
+
+        Any combination of criteria can be input, and the result will be the
+        intersection of all of them.  With no criteria, the whole dataset is
+        returned.
+
+        Args:
+            psns (list): List of PSNs to include in the cohort. Can also be a
+                dict keyed by PSN (e.g. from ``get_patients_by_disease()``) or
+                a list of tuples starting with a PSN (e.g. from
+                ``get_patients_by_arm()``).
+            arm (str): Patients that have ever qualified for this arm (see
+                ``get_patients_by_arm()``).
+            histology (str): Patients with this disease, using the partial
+                matching rules of ``get_patients_by_disease()``.
+            meddra_code (str): Patients with this MEDDRA code.
+            gene (str): Gene, or list of genes, for which patients must carry
+                a confirmed MOI.
+            variant_type (list): Limit the ``gene`` query to these variant
+                types.  Can be any of 'snvs', 'indels', 'cnvs', 'fusions'.
+                DEFAULT: all types.
+            outside (bool): Include outside assay patients in the cohort.
+                DEFAULT: ``False``.
+
+        Returns:
+            Cohort: Cohort bitmap of the matching patients, or ``None`` if
+            there was a problem with the query.
+
+        Examples:
+            >>> braf = data.get_cohort(gene='BRAF')
+            >>> arm_h = data.get_cohort(arm='EAY131-H')
+            >>> len(braf)
+            316
+            >>> (braf - arm_h).psns()[:3]
+            ['10005', '10077', '10134']
+
+            >>> lung_egfr = (data.get_cohort(histology='lung')
+            ...     & data.get_cohort(gene='EGFR', variant_type=['snvs']))
+
+        """
+        index = self._patient_index
+        bits = index.mask
+
+        if psns is not None:
+            if isinstance(psns, (str, int)):
+                psns = [psns]
+            wanted = []
+            for p in psns:
+                if isinstance(p, (tuple, list)):
+                    p = p[0]
+                wanted.append(self.__format_id('rm', psn=p))
+            bits &= index.bits(wanted)
+
+        if arm:
+            arm_results = self.get_patients_by_arm(arm, outside=True)
+            if arm_results is None:
+                return None
+            bits &= index.bits(x[0] for x in arm_results)
+
+        if histology or meddra_code:
+            bits &= index.bits(self.get_patients_by_disease(
+                histology=histology, meddra_code=meddra_code, outside=True))
+
+        if gene:
+            valid_types = ('snvs', 'indels', 'cnvs', 'fusions')
+            if variant_type is None:
+                variant_type = valid_types
+            elif isinstance(variant_type, str):
+                variant_type = [variant_type]
+            if any(x not in valid_types for x in variant_type):
+                sys.stderr.write('ERROR: variant types must be one of: '
+                    '%s.\n' % ', '.join(valid_types))
+                return None
+
+            if isinstance(gene, str):
+                gene = [gene]
+            carriers = 0
+            for g in gene:
+                gene_types = self._gene_bits.get(g, {})
+                for var_type in variant_type:
+                    carriers |= gene_types.get(var_type, 0)
+            bits &= carriers
+
+        if outside is False:
+            bits &= ~self._outside_bits
+        return index.cohort(bits=bits)
+
+    def get_gene_incidence(self, genes=None, variant_type=None, histology=None,
+            meddra_code=None, outside=False, min_count=1):
+        """
+        Return a patient by gene incidence matrix of confirmed MOIs.
+
+        The matrix is stored column-wise as one bit-packed :class:`Cohort` per
+        gene, where each set bit is a patient carrying a confirmed MOI in that
+        gene.  Only patients with sequencing data are considered, and the set 
+        can be further limited by disease.  The background set of patients is
+        returned along with the matrix so that the columns can be converted to
+        rates or combined with other cohorts.
+
+        Args:
+            genes (list): Genes to include. DEFAULT: all genes with at least
+                ``min_count`` carriers.
+            variant_type (list): Variant types to consider. Can be any of
+                'snvs', 'indels', 'cnvs', 'fusions'. DEFAULT: all types.
+            histology (str): Limit patients to this disease (partial match
+                rules of ``get_patients_by_disease()``).
+            meddra_code (str): Limit patients to this MEDDRA code.
+            outside (bool): Include outside assay patients. DEFAULT: ``False``.
+            min_count (int): Minimum number of carriers for a gene to be 
+                included when no gene list is input. DEFAULT: 1.
+
+        Returns:
+            tuple: Background :class:`Cohort` of patients considered, and a 
+            dict of ``{gene : Cohort}`` of carriers.
+
+        Examples:
+            >>> background, matrix = data.get_gene_incidence(
+            ...     genes=['BRAF', 'KRAS', 'NRAS'], histology='Melanoma')
+            >>> len(background), len(matrix['BRAF'])
+            (98, 23)
+
+        """
+        background = self.get_cohort(histology=histology, 
+            meddra_code=meddra_code, outside=outside)
+        if background is None:
+            return None
+        index = self._patient_index
+        background_bits = background.bits & self._sequenced_bits
+
+        if genes is None:
+            genes = sorted(self._gene_bits)
+        else:
+            min_count = 0
+
+        matrix = {}
+        for gene in genes:
+            cohort = self.get_cohort(gene=gene, variant_type=variant_type, 
+                outside=True)
+            if cohort is None:
+                return None
+            carriers = cohort.bits & background_bits
+            if carriers or min_count == 0:
+                column = index.cohort(bits=carriers)
+                if len(column) >= min_count:
+                    matrix[gene] = column
+        return index.cohort(bits=background_bits), matrix
+
+    def get_gene_cooccurrence(self, genes=None, variant_type=None, 
+            histology=None, meddra_code=None, outside=False, min_count=1):
+        """
+        Compute pairwise co-occurrence and mutual exclusivity statistics of
+        confirmed MOIs for a set of genes.
+
+        Builds the gene incidence matrix from ``get_gene_incidence()`` and,
+        for each pair of genes, computes the 2x2 table of patients with MOIs in
+        both genes, either one only, or neither, using bitwise operations on 
+        the gene columns rather than re-scanning the dataset for each pair.
+        From the table, a log odds ratio and one-sided Fisher's exact test 
+        p-values for mutual exclusivity and for co-occurrence are reported.
+
+        Args:
+            genes (list): Genes to test. DEFAULT: all genes with at least 
+                ``min_count`` carriers.
+            variant_type (list): Variant types to consider. Can be any of
+                'snvs', 'indels', 'cnvs', 'fusions'. DEFAULT: all types.
+            histology (str): Limit patients to this disease.
+            meddra_code (str): Limit patients to this MEDDRA code.
+            outside (bool): Include outside assay patients. DEFAULT: ``False``.
+            min_count (int): Minimum number of carriers for a gene to be 
+                included when no gene list is input. DEFAULT: 1.
+
+        Returns:
+            dict: Dict of ``(gene1, gene2) : stats`` for each gene pair, where 
+            stats is a dict of counts (``both``, ``only_1``, ``only_2``, 
+            ``neither``), ``log_odds``, ``p_exclusive``, and ``p_cooccur``.
+
+        Examples:
+            >>> data.get_gene_cooccurrence(genes=['KRAS', 'NRAS'])
+            {('KRAS', 'NRAS'): {'both': 0,
+                                'only_1': 612,
+                                'only_2': 175,
+                                'neither': 4961,
+                                'log_odds': -3.412,
+                                'p_exclusive': 1.07e-06,
+                                'p_cooccur': 1.0}}
+
+        """
+        incidence = self.get_gene_incidence(genes=genes, 
+            variant_type=variant_type, histology=histology, 
+            meddra_code=meddra_code, outside=outside, min_count=min_count)
+        if incidence is None:
+            return None
+        background, matrix = incidence
+        total = len(background)
+
+        results = {}
+        for gene1, gene2 in itertools.combinations(sorted(matrix), 2):
+            carriers1 = len(matrix[gene1])
+            carriers2 = len(matrix[gene2])
+            both = len(matrix[gene1] & matrix[gene2])
+            only_1 = carriers1 - both
+            only_2 = carriers2 - both
+            neither = total - both - only_1 - only_2
+
+            p_exclusive, p_cooccur = utils.fisher_exact_tails(both, only_1,
+                only_2, neither)
+            results[(gene1, gene2)] = {
+                'both'        : both,
+                'only_1'      : only_1,
+                'only_2'      : only_2,
+                'neither'     : neither,
+                'log_odds'    : utils.log_odds_ratio(both, only_1, only_2, 
+                                    neither),
+                'p_exclusive' : p_exclusive,
+                'p_cooccur'   : p_cooccur,
+            }
         return results
 
+    def screen_cohort(self, arms=None, status=None, outside=False, 
+            processes=None):
+        """
+        Screen every patient in the dataset against the current arm rules, and 
+        return the patients eligible for each arm.
+
+        Each patient's latest passed biopsy with confirmed sequencing data is 
+        re-evaluated against each arm's aMOIs, IHC requirements, and excluded 
+        diseases, as loaded in the ``TreatmentArms`` data (see 
+        :class:`AmoiRules` for the eligibility rules).  This uses the rules 
+        that ``TreatmentArms`` has already compiled, so it's a quick way to 
+        re-screen the whole cohort when arm rules change.  Large cohorts are
+        split up and screened in parallel across a process pool.
+
+        Args:
+            arms (list): Arm ID, or list of arm IDs, to screen. DEFAULT: all
+                arms.
+            status (str): Only screen arms with this status (e.g. 'OPEN').
+            outside (bool): Include outside assay patients. DEFAULT: ``False``.
+            processes (int): Number of worker processes to use. ``1`` screens
+                in this process. DEFAULT: one per CPU for cohorts of 1000 or 
+                more patients, otherwise ``1``.
+
+        Returns:
+            dict: Dict of arm ID : :class:`Cohort` of eligible patients, or 
+            ``None`` if an invalid arm ID was entered.
+
+        Examples:
+            >>> eligible = data.screen_cohort(status='OPEN')
+            >>> len(eligible['EAY131-H'])
+            52
+            >>> (eligible['EAY131-H'] - data.get_cohort(arm='EAY131-H')).psns()[:3]
+            ['10163', '11452', '12066']
+
+        """
+        rules = self.arm_data.amoi_rules
+        if arms is None:
+            arms = list(rules.arms)
+        elif isinstance(arms, str):
+            arms = [arms]
+        unknown = [arm for arm in arms if arm not in rules.arm_ids]
+        if unknown:
+            sys.stderr.write('ERROR: No such arm(s): %s. Please check your '
+                'query.\n' % ', '.join(unknown))
+            return None
+        if status:
+            arms = [arm for arm in arms 
+                if self.arm_data.arm_attributes[arm].status == status]
+
+        patients = []
+        for psn, ordinal in self._patient_index.ordinals.items():
+            if outside is False and self._outside_bits >> ordinal & 1:
+                continue
+            record = self.data[psn]
+            if record['biopsies'] == 'No_Biopsy':
+                continue
+
+            # Use the latest passed biopsy that has sequencing data.
+            for bsn in reversed(record['all_biopsies']):
+                biopsy = record['biopsies'].get(bsn)
+                if (biopsy and biopsy['biopsy_status'] == 'Pass'
+                        and biopsy['ngs_data'] 
+                        and 'mois' in biopsy['ngs_data']):
+                    break
+            else:
+                continue
+
+            variants = [
+                (v['type'], v.get('gene'), v.get('identifier'), 
+                    v.get('oncominevariantclass'), v.get('exon'), 
+                    v.get('function'))
+                for var_list in biopsy['ngs_data']['mois'].values()
+                for v in var_list
+            ]
+            patients.append((ordinal, variants, biopsy['ihc'], 
+                record['meddra_code']))
+
+        if processes is None:
+            processes = (os.cpu_count() or 1) if len(patients) >= 1000 else 1
+        if processes == 1 or not patients:
+            results = screen_patients(rules, patients)
+        else:
+            # A few chunks per worker to even out the load. The rules are 
+            # sent to each worker once, when it starts.
+            chunk_size = -(-len(patients) // (processes * 4))
+            chunks = [patients[i:i + chunk_size] 
+                for i in range(0, len(patients), chunk_size)]
+            with ProcessPoolExecutor(max_workers=processes, 
+                    initializer=init_screen_worker, 
+                    initargs=(rules,)) as executor:
+                results = list(itertools.chain.from_iterable(executor.map(
+                    screen_worker_patients, chunks)))
+
+        # Flip the patient -> eligible arms masks around to arm -> eligible 
+        # patients bitmaps.
+        wanted = 0
+        for arm in arms:
+            wanted |= 1 << rules.arm_ids[arm]
+        arm_bits = [0] * len(rules.arms)
+        for ordinal, eligible in results:
+            bitstring = bin(eligible & wanted)[:1:-1]
+            i = bitstring.find('1')
+            while i != -1:
+                arm_bits[i] |= 1 << ordinal
+                i = bitstring.find('1', i + 1)
+
+        return {
+            arm : self._patient_index.cohort(bits=arm_bits[rules.arm_ids[arm]])
+            for arm in arms
+        }
+
     @staticmethod
     def __map_ihc_results(ihc_data):
         # Set up a dict of assays now that we'll fill in since the number has 
@@ -59,10 +59,10 @@ class Matchbox(object):
 
     """
 
-    def __init__(self, method, config, params={}, mongo_collection=None, 
+    def __init__(self, method, config, params=None, mongo_collection=None, 
         make_raw=None, quiet=False):
 
-        self._params = params
+        self._params = dict(params or {})
         self._quiet = quiet
         self.today = utils.get_today('short')
         self.api_data = []
@@ -190,10 +190,11 @@ class Matchbox(object):
         header = {'Authorization' : 'bearer %s' % self._token}
         # For async page requests, will need to update the page number for each 
         # loop.
+        params = dict(self._params)
         if page is not None:
-            self._params['page'] = page 
+            params['page'] = page 
 
-        response = requests.get(self._url, params=self._params, headers=header)
+        response = requests.get(self._url, params=params, headers=header)
         
         # DEBUG XXX: remove me
         '''
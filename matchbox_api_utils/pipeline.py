@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import contextlib
+
+from matchbox_api_utils import utils
+from matchbox_api_utils.match_data import MatchData
+from matchbox_api_utils.match_arms import TreatmentArms
+from matchbox_api_utils.records import json_default
+from matchbox_api_utils.snapshot import SnapshotWriter as SnapshotSink
+
+
+def read_json_lines(fh):
+    """
+    Read a file of one JSON document per line (e.g. ``mongoexport`` output),
+    one document at a time. Blank lines are skipped.
+
+    Args:
+        fh (file): Open file (or any iterable of lines).
+
+    Yields:
+        dict: The next document.
+
+    """
+    for line in fh:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+class JsonLinesSink(object):
+    """
+    **JSON Lines Sink**
+
+    Write each patient as a ``[psn, record]`` JSON array on a line of its own,
+    the ``mb_obj_<date>.jsonl`` format that ``MatchData`` can load (see 
+    ``utils.make_json_lines()``).  The lines are written to a temp file that
+    is renamed into place when the sink is closed, so a run that fails part 
+    way through never leaves a partial dataset behind.
+
+    Args:
+        filename (str): Output filename.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._stack = contextlib.ExitStack()
+        self._fh = self._stack.enter_context(utils.atomic_write(filename))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            # Discard the temp file rather than renaming it into place.
+            self._stack.__exit__(*exc)
+        self.close()
+
+    def write(self, psn, record):
+        """Add a patient record to the file."""
+        self._fh.write(utils.json_line(psn, record))
+
+    def close(self):
+        """Close the file, and rename it into place."""
+        self._stack.close()
+
+
+class SQLiteSink(object):
+    """
+    **SQLite Sink**
+
+    Write each patient as a row of an SQLite table, keyed on PSN, with the
+    record stored as JSON text::
+
+        CREATE TABLE patients (psn TEXT PRIMARY KEY, record TEXT NOT NULL)
+
+    Rows are inserted in batches, and a patient that is already in the table
+    is replaced, so that a database can be brought up to date by running the
+    pipeline over it again.
+
+    Args:
+        filename (str): SQLite database filename.
+
+        table (str): Name of the table. DEFAULT: ``patients``.
+
+        batch_size (int): Number of rows to insert per transaction.
+            DEFAULT: ``500``.
+
+    """
+
+    def __init__(self, filename, table='patients', batch_size=500):
+        if not table.isidentifier():
+            raise ValueError('Invalid table name: %s.' % table)
+        self.filename = filename
+        self.table = table
+        self.batch_size = batch_size
+        self._batch = []
+        self._conn = sqlite3.connect(filename)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS %s (psn TEXT PRIMARY '
+            'KEY, record TEXT NOT NULL)' % table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, psn, record):
+        """Add a patient record to the table."""
+        self._batch.append((psn, json.dumps(record, separators=(',', ':'),
+            default=json_default)))
+        if len(self._batch) >= self.batch_size:
+            self.__flush()
+
+    def __flush(self):
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO %s (psn, record) '
+                'VALUES (?, ?)' % self.table, self._batch)
+        self._batch = []
+
+    def close(self):
+        """Insert any rows that are left, and close the database."""
+        if self._conn is None:
+            return
+        self.__flush()
+        self._conn.close()
+        self._conn = None
+
+
+def run_pipeline(matchbox_data, sink, arm_data=None, matchbox='adult',
+        patient=None):
+    """
+    Process raw MATCHBox patient documents and write each patient record to a
+    sink as it is made, so that neither the raw nor the processed dataset is
+    ever held in memory as a whole.  The sink is closed when the pipeline is
+    done.
+
+    A sink is any object with a ``write(psn, record)`` method and a
+    ``close()`` method that can be used as a context manager.  If a PSN is
+    written more than once, the last record written wins.
+
+    Args:
+        matchbox_data (iterable): Raw MATCHBox patient documents (dicts).
+
+        sink: Where to write the records (e.g. :class:`JsonLinesSink`,
+            :class:`SQLiteSink`, or :class:`SnapshotSink`).
+
+        arm_data (TreatmentArms): Treatment arm data used to annotate the
+            variants with aMOIs. DEFAULT: the system default treatment arm
+            data for ``matchbox``.
+
+        matchbox (str): Name of the MATCHBox system. DEFAULT: ``adult``.
+
+        patient (str): Only process this patient (PSN, without the prefix).
+
+    Returns:
+        int: Number of patient records written.
+
+    Examples:
+        >>> with open('raw_mb_dump.jsonl') as fh:
+        ...     run_pipeline(read_json_lines(fh), SQLiteSink('mb_patients.db'))
+        2000
+
+    """
+    if arm_data is None:
+        arm_data = TreatmentArms(matchbox=matchbox, quiet=True)
+
+    count = 0
+    with sink:
+        for psn, record in MatchData.iter_patients(matchbox_data, arm_data,
+                patient):
+            sink.write(psn, record)
+            count += 1
+    return count
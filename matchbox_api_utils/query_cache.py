@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import time
+import pickle
+import functools
+import threading
+from collections import OrderedDict
+
+
+class QueryCache(object):
+    """
+    **Query Result Cache**
+
+    Bounded least recently used cache of query results, with an optional time
+    to live for each entry.  Results are stored pickled, so that every caller
+    gets their own copy of a cached result, and changing it can't change what
+    the next caller gets.  The cache is thread safe.
+
+    Args:
+        maxsize (int): Maximum number of results to keep. DEFAULT: ``256``.
+
+        ttl (float): Number of seconds after which a result is no longer used.
+            DEFAULT: ``None`` (results don't expire).
+
+    """
+
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def __repr__(self):
+        return '%s: %s' % (self.__class__, self.info())
+
+    def get(self, key):
+        """
+        Return ``(True, result)`` for a cached result, or ``(False, None)`` if
+        the result is not in the cache or has expired.
+        """
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and self.ttl is not None:
+                if time.monotonic() - entry[0] > self.ttl:
+                    del self._results[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._results.move_to_end(key)
+            self.hits += 1
+        return True, pickle.loads(entry[1])
+
+    def put(self, key, result):
+        """Add a result to the cache, dropping the least recently used result
+        if the cache is full."""
+        entry = (time.monotonic(), pickle.dumps(result,
+            pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._results[key] = entry
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        """Drop all cached results. The hit and miss counts are kept."""
+        with self._lock:
+            self._results.clear()
+
+    def info(self):
+        """
+        Return a dict of the cache ``hits``, ``misses``, ``size``,
+        ``maxsize`` and ``ttl``.
+        """
+        return {
+            'hits'    : self.hits,
+            'misses'  : self.misses,
+            'size'    : len(self._results),
+            'maxsize' : self.maxsize,
+            'ttl'     : self.ttl,
+        }
+
+
+def cached_query(make_key):
+    """
+    Decorator for ``MatchData`` query methods whose results can be cached.
+    ``make_key`` is called with the same arguments as the method, and returns
+    a hashable key of the normalized arguments (e.g. sorted gene lists), or
+    ``None`` if the call should not be cached (e.g. invalid arguments).  The
+    method is called as normal if the object has no ``_query_cache``.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, '_query_cache', None)
+            if cache is None:
+                return method(self, *args, **kwargs)
+            try:
+                key = make_key(*args, **kwargs)
+                if key is not None:
+                    key = (method.__name__,) + key
+                    hash(key)
+            except (TypeError, AttributeError):
+                key = None
+            if key is None:
+                return method(self, *args, **kwargs)
+
+            found, result = cache.get(key)
+            if not found:
+                result = method(self, *args, **kwargs)
+                cache.put(key, result)
+            return result
+        return wrapper
+    return decorator
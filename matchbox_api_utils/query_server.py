@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import sys
+import json
+import pickle
+import socket
+import struct
+import hashlib
+import weakref
+import socketserver
+import contextlib
+
+from matchbox_api_utils import mb_utils_root
+from matchbox_api_utils.match_data import MatchData
+from matchbox_api_utils.cohort import PatientIndex
+from matchbox_api_utils.reloader import ReloadingMatchData
+
+# The read-only query methods and attributes that are served, by target.  
+# Anything else (methods that write files or change the shared dataset, cache
+# or settings, and the raw data itself) is not available to clients.
+_ALLOWED = {
+    'data' : frozenset((
+        'db_date', 'frozen', 'cache_info', 'get_patient_meta', 
+        'get_biopsy_summary', 'get_psn', 'get_msn', 'get_bsn', 
+        'get_disease_summary', 'get_histology', 'find_variant_frequency',
+        'get_variant_summary', 'get_variant_report', 'get_patient_ta_status',
+        'get_patients_by_disease', 'search_diseases', 'get_patients_by_arm',
+        'get_arm_status_summary', 'get_cohort', 'get_gene_incidence',
+        'get_gene_cooccurrence', 'screen_cohort', 'get_ihc_results',
+        'get_biopsy_info', 'get_patient_demographics',
+    )),
+    'arms' : frozenset((
+        'db_date', 'map_amoi', 'map_amois', 'map_patient_amois', 
+        'map_drug_arm', 'get_exclusion_disease', 'get_amois_by_arm',
+        'get_match_arm_info', 'get_arm_by_amoi', 'arm_summary',
+    )),
+}
+
+
+def default_socket(matchbox='adult'):
+    """
+    Default query server socket path for a MATCHBox system, which lives in the
+    MATCHBox API Utils root dir (``$HOME/.mb_utils``).
+    """
+    return os.path.join(mb_utils_root, 'query_server_%s.sock' % matchbox)
+
+
+def _send(sock, payload):
+    sock.sendall(struct.pack('!Q', len(payload)) + payload)
+
+
+def _recv(sock):
+    header = _recv_bytes(sock, 8)
+    if header is None:
+        return None
+    return _recv_bytes(sock, struct.unpack('!Q', header)[0])
+
+
+def _recv_bytes(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+# Fingerprints of the server's patient indexes, made once per index.
+_index_keys = weakref.WeakKeyDictionary()
+
+# The client's copy of each patient index it has been sent, by fingerprint, so
+# that all of the Cohorts from one dataset share one index and can be combined.
+_patient_indexes = {}
+
+
+def _index_key(index, db_date):
+    # Fingerprint of a patient index: the dataset date, and a hash of the PSNs
+    # so that different datasets from the same day don't get mixed up.
+    if index not in _index_keys:
+        digest = hashlib.sha1('\n'.join(index.psns).encode('utf-8'))
+        _index_keys[index] = digest.hexdigest()
+    return (db_date, _index_keys[index])
+
+
+class _ResponsePickler(pickle.Pickler):
+    # Pickle the patient index of a Cohort by reference, and only send the 
+    # PSNs when the client doesn't have the index yet, so that a Cohort costs
+    # its bitmap rather than a copy of the whole index.
+    def __init__(self, fh, db_date, known):
+        super().__init__(fh, pickle.HIGHEST_PROTOCOL)
+        self._db_date = db_date
+        self._known = known
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, PatientIndex):
+            return None
+        key = _index_key(obj, self._db_date)
+        if key in self._known:
+            return ('patient_index', key, None)
+        self._known.add(key)
+        return ('patient_index', key, obj.psns)
+
+
+class _ResponseUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        kind, key, psns = pid
+        if kind != 'patient_index':
+            raise pickle.UnpicklingError('Unknown persistent id: %s.' % kind)
+        if key not in _patient_indexes:
+            _patient_indexes[key] = PatientIndex(psns)
+        return _patient_indexes[key]
+
+
+class _QueryHandler(socketserver.BaseRequestHandler):
+    # One request per connection. Requests are JSON so that the server never
+    # unpickles anything from a client; responses are pickled so that tuples,
+    # tuple keyed dicts, Cohorts, etc. come back just as they would from a
+    # local MatchData object.  Cohorts from the same dataset share one patient
+    # index on the client side (see _ResponsePickler).
+    def handle(self):
+        message = _recv(self.request)
+        if message is None:
+            return
+
+        stderr = io.StringIO()
+        known = set()
+        db_date = None
+        try:
+            request = json.loads(message.decode('utf-8'))
+            known = set(tuple(key) for key in request.get('indexes', []))
+            db_date = self.server.data.db_date
+            with contextlib.redirect_stderr(stderr):
+                response = ('ok', self.server.run(request))
+        except Exception as exc:
+            response = ('raise', exc)
+
+        fh = io.BytesIO()
+        _ResponsePickler(fh, db_date, known).dump(
+            response + (stderr.getvalue(),))
+        _send(self.request, fh.getvalue())
+
+
+class QueryServer(socketserver.UnixStreamServer):
+    """
+    **MATCHBox Query Server**
+
+    Load a :class:`MatchData` object (and its :class:`TreatmentArms` object)
+    once, and serve its query methods over a Unix socket, so that scripts and
+    interactive sessions don't have to pay the cost of loading the dataset for
+    every query.  Clients connect with :class:`QueryClient`, or more usually
+    with :func:`get_match_data`, which falls back to loading the data in
+    process if there is no server running.
+
+    Requests are handled one at a time, and the socket is only accessible to
+    the user who started the server.  Only the system default dataset is
+    served, and only the read-only query methods are available; methods that
+    write files or change the data, cache or settings are not.
+
+    Args:
+        matchbox (str): Name of the MATCHBox system to serve. DEFAULT:
+            ``adult``.
+
+        socket_path (str): Path of the Unix socket to listen on. DEFAULT:
+            ``$HOME/.mb_utils/query_server_<matchbox>.sock``.
+
+        quiet (bool): If ``True``, supress module output debug, information,
+            etc. messages.
+
+        reload_interval (int): If set, check for a new system default dataset
+            every ``reload_interval`` seconds, and serve it once it's loaded
+            (see :class:`reloader.ReloadingMatchData`).
+
+        cache_size (int): If set, cache the results of up to this many queries
+            (see :meth:`MatchData.enable_cache`).
+
+    Examples:
+        >>> server = QueryServer('adult')
+        >>> server.serve_forever()
+
+    """
+
+    def __init__(self, matchbox='adult', socket_path=None, quiet=True,
+        reload_interval=None, cache_size=None):
+        self.matchbox = matchbox
+        self.socket_path = socket_path or default_socket(matchbox)
+        self._quiet = quiet
+
+        if os.path.exists(self.socket_path):
+            if _ping(self.socket_path) is not None:
+                raise RuntimeError('A query server is already running on '
+                    '%s.' % self.socket_path)
+            # Left over from a server that didn't shut down cleanly.
+            os.unlink(self.socket_path)
+
+        if reload_interval:
+            self.data = ReloadingMatchData(matchbox=matchbox,
+                interval=reload_interval, quiet=quiet, cache_size=cache_size)
+        else:
+            self.data = MatchData(matchbox=matchbox, json_db='sys_default',
+                quiet=quiet, cache_size=cache_size)
+
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(self.socket_path, _QueryHandler)
+        finally:
+            os.umask(old_umask)
+
+        if self._quiet is False:
+            sys.stderr.write('[ INFO ]  Serving MATCHBox data (%s) on %s.\n' % (
+                self.data.db_date, self.socket_path))
+
+    def server_close(self):
+        super().server_close()
+        if isinstance(self.data, ReloadingMatchData):
+            self.data.stop()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def run(self, request):
+        """
+        Run a query request and return the result. Requests are dicts with an
+        ``op`` of ``ping``, ``get`` (attribute lookup), or ``call`` (method
+        call, with ``args`` and ``kwargs``), and the ``target`` (``data`` for
+        the MatchData object, or ``arms`` for the TreatmentArms object) and
+        ``name`` of the attribute.
+        """
+        if request['op'] == 'ping':
+            return {'matchbox' : self.matchbox, 'db_date' : self.data.db_date}
+
+        # Get the current dataset once, so the whole request runs on the same
+        # one even if a reload swaps in a new one.
+        data = getattr(self.data, 'data', None)
+        if not isinstance(data, MatchData):
+            data = self.data
+        if request['target'] == 'data':
+            target = data
+        elif request['target'] == 'arms':
+            target = data.arm_data
+        else:
+            raise ValueError('Unknown request target: %s.' % request['target'])
+        name = request['name']
+        if name not in _ALLOWED[request['target']]:
+            raise AttributeError('%s is not available from the query server.'
+                % name)
+        attr = getattr(target, name)
+
+        if request['op'] == 'get':
+            return ('method', None) if callable(attr) else ('value', attr)
+        elif request['op'] == 'call':
+            return attr(*request.get('args', []), **request.get('kwargs', {}))
+        raise ValueError('Unknown request op: %s.' % request['op'])
+
+
+class QueryClient(object):
+    """
+    **MATCHBox Query Server Client**
+
+    Proxy for a :class:`MatchData` object served by a :class:`QueryServer`.
+    Query methods and attributes can be used in the same way as on a local
+    ``MatchData`` object, and ``arm_data`` is a proxy for the server's
+    ``TreatmentArms`` object.  Arguments have to be JSON serializable.
+
+    Args:
+        socket_path (str): Path to the query server Unix socket.
+
+    Examples:
+        >>> data = QueryClient(default_socket('adult'))
+        >>> data.get_psn(msn='MSN3111')
+        'PSN10005'
+
+    """
+
+    def __init__(self, socket_path, target='data'):
+        self._socket_path = socket_path
+        self._target = target
+        self._methods = {}
+
+    def __repr__(self):
+        return '%s: %s (%s)' % (self.__class__, self._socket_path,
+            self._target)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name == 'arm_data' and self._target == 'data':
+            return QueryClient(self._socket_path, 'arms')
+
+        if name not in self._methods:
+            kind, value = _request(self._socket_path,
+                {'op' : 'get', 'target' : self._target, 'name' : name})
+            if kind == 'value':
+                return value
+            self._methods[name] = self.__make_method(name)
+        return self._methods[name]
+
+    def __make_method(self, name):
+        def method(*args, **kwargs):
+            return _request(self._socket_path, {'op' : 'call',
+                'target' : self._target, 'name' : name, 'args' : args,
+                'kwargs' : kwargs})
+        method.__name__ = name
+        return method
+
+
+def _request(socket_path, request):
+    # Send a request to the server, and return the result (or raise the
+    # exception the server raised), passing on anything the server wrote to
+    # stderr while running it.
+    request = dict(request, indexes=list(_patient_indexes))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        _send(sock, json.dumps(request).encode('utf-8'))
+        message = _recv(sock)
+    if message is None:
+        raise ConnectionError('No response from the query server on %s.'
+            % socket_path)
+    status, result, stderr = _ResponseUnpickler(io.BytesIO(message)).load()
+    if stderr:
+        sys.stderr.write(stderr)
+    if status == 'raise':
+        raise result
+    return result
+
+
+def _ping(socket_path):
+    # Return the server info if a server owned by this user is listening on
+    # the socket, or None.
+    try:
+        if os.stat(socket_path).st_uid != os.getuid():
+            return None
+        return _request(socket_path, {'op' : 'ping'})
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def get_match_data(matchbox='adult', json_db='sys_default', socket_path=None,
+    **kwargs):
+    """
+    Get a MATCHBox dataset for a script or interactive session, from a running
+    :class:`QueryServer` if there is one, or else by loading a new
+    :class:`MatchData` object.
+
+    The query server is only used for the system default dataset with no
+    other ``MatchData`` options (e.g. ``patient``), since that's all it serves.
+
+    Args:
+        matchbox (str): Name of the MATCHBox system. DEFAULT: ``adult``.
+
+        json_db (str): ``MatchData`` JSON database. DEFAULT: ``sys_default``.
+
+        socket_path (str): Query server socket. DEFAULT:
+            ``$HOME/.mb_utils/query_server_<matchbox>.sock``.
+
+        **kwargs: Other arguments to ``MatchData`` if loading the data in
+            process.
+
+    Returns:
+        QueryClient or MatchData: Object with the ``MatchData`` query methods.
+
+    Examples:
+        >>> data = get_match_data('adult', quiet=True)
+        >>> data.db_date
+        '2019-10-19'
+
+    """
+    socket_path = socket_path or default_socket(matchbox)
+    server_options = set(kwargs) <= {'method', 'quiet'}
+    if (json_db == 'sys_default' and server_options and hasattr(socket,
+            'AF_UNIX') and os.path.exists(socket_path)):
+        info = _ping(socket_path)
+        if info is not None and info['matchbox'] == matchbox:
+            return QueryClient(socket_path)
+    return MatchData(matchbox=matchbox, json_db=json_db, **kwargs)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+import sys
+from collections.abc import Mapping
+
+# Record fields with a small number of distinct values that are repeated over
+# and over across the dataset (statuses, diseases, genes, etc.), along with 
+# the fields that hold a placeholder string (e.g. 'No_Biopsy', 'NA') rather 
+# than data.
+CATEGORICAL_FIELDS = frozenset((
+    # Patient
+    'gender', 'ethnicity', 'race', 'source', 'concordance', 'ctep_term',
+    'meddra_code', 'current_trial_status', 'last_msg', 'biopsies',
+    # Biopsy
+    'biopsy_source', 'biopsy_status', 'ihc', 'ngs_data',
+    # Variant
+    'type', 'gene', 'chromosome', 'function', 'oncominevariantclass', 'exon',
+    'identifier', 'transcript', 'driverGene', 'partnerGene', 'annotation',
+    'amoi',
+))
+
+
+class Record(Mapping):
+    """
+    **Compact Read-only Record**
+
+    Base class for the compact patient, biopsy, NGS result, and variant
+    records used by :meth:`MatchData.compact`.  Fields are stored in
+    ``__slots__`` rather than in a per record dict, which makes each record a
+    fraction of the size of the dict it replaces, but records still work like
+    a read-only dict (``record['gene']``, ``record.get('exon')``, ``in``,
+    ``keys()``, ``items()``, etc.) and compare equal to the dict they were
+    made from.  Fields that were not in the source dict are not set, and are
+    missing just as they would be from the dict.
+
+    Records can't be changed. Use ``dict(record)`` or ``record.copy()`` for a
+    mutable copy. Use :func:`json_default` to serialize records with the
+    ``json`` module.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls._fields)
+
+    def __init__(self, data=()):
+        for field, value in dict(data).items():
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise TypeError('%s object is read-only' % self.__class__.__name__)
+
+    __delattr__ = __setattr__
+
+    @classmethod
+    def fits(cls, data):
+        """``True`` if all of the keys of the dict are fields of the record."""
+        return isinstance(data, dict) and data.keys() <= cls._field_set
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._field_set:
+            return getattr(self, key, default)
+        return default
+
+    def __contains__(self, key):
+        return key in self._field_set and hasattr(self, key)
+
+    def __iter__(self):
+        for field in self._fields:
+            if hasattr(self, field):
+                yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self))
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def copy(self):
+        return dict(self)
+
+    def map_values(self, func):
+        """Return a new record of the same type with ``func`` applied to each
+        of the values."""
+        return self.__class__({k : func(v) for k, v in self.items()})
+
+
+class Patient(Record):
+    """Compact patient record."""
+    __slots__ = _fields = ('all_biopsies', 'all_msns', 'biopsies',
+        'concordance', 'ctep_term', 'current_trial_status', 'ethnicity',
+        'gender', 'last_msg', 'meddra_code', 'progressed', 'psn', 'race',
+        'source', 'ta_arms')
+
+
+class Biopsy(Record):
+    """Compact biopsy record."""
+    __slots__ = _fields = ('biopsy_source', 'biopsy_status', 'ihc', 'ngs_data')
+
+
+class NgsResult(Record):
+    """Compact NGS (sequencing) result record."""
+    __slots__ = _fields = ('dna_bam_path', 'ir_runid', 'mois', 'msn',
+        'rna_bam_path', 'vcf_path')
+
+
+class Variant(Record):
+    """
+    Base class for the compact variant records. Use :func:`make_variant` to
+    make the right type of variant record for a variant dict.
+    """
+    __slots__ = ()
+
+
+class SnvIndel(Variant):
+    """Compact SNV / indel variant record."""
+    __slots__ = _fields = ('alleleFrequency', 'alternative',
+        'alternativeAlleleObservationCount', 'amoi', 'chromosome', 'confirmed',
+        'exon', 'flowAlternativeAlleleObservationCount',
+        'flowReferenceAlleleObservations', 'function', 'gene', 'hgvs',
+        'identifier', 'oncominevariantclass', 'position', 'protein',
+        'readDepth', 'reference', 'referenceAlleleObservations', 'transcript',
+        'type')
+
+
+class Cnv(Variant):
+    """Compact CNV variant record."""
+    __slots__ = _fields = ('amoi', 'chromosome', 'confidenceInterval5percent',
+        'confidenceInterval95percent', 'confirmed', 'copyNumber', 'gene',
+        'identifier', 'type')
+
+
+class Fusion(Variant):
+    """Compact fusion variant record."""
+    __slots__ = _fields = ('amoi', 'annotation', 'confirmed', 'driverGene',
+        'driverReadCount', 'gene', 'identifier', 'partnerGene', 'type')
+
+
+_variant_types = {
+    'snvs_indels' : SnvIndel,
+    'cnvs'        : Cnv,
+    'fusions'     : Fusion,
+}
+
+
+def _share(value, strings):
+    # Use one copy of each distinct string in the dataset, rather than the
+    # fresh copy of each value that the JSON parser makes.
+    if isinstance(value, str):
+        return strings.setdefault(value, value)
+    elif isinstance(value, list):
+        return [_share(x, strings) for x in value]
+    elif isinstance(value, dict):
+        return {_share(k, strings) : _share(v, strings)
+            for k, v in value.items()}
+    return value
+
+
+def make_variant(variant, strings=None):
+    """
+    Convert a variant dict to a compact variant record of its type, or return
+    the dict as is if it doesn't fit one.
+    """
+    cls = _variant_types.get(variant.get('type'))
+    if cls is None or not cls.fits(variant):
+        return variant
+    if strings is None:
+        strings = {}
+    return cls(_share(variant, strings))
+
+
+def compact_patient(record, strings=None):
+    """
+    Convert a processed patient record (a value of ``MatchData.data``) to
+    compact records.  Any part of the record with fields that the record
+    classes don't know about is left as a dict.
+
+    Args:
+        record (dict): Patient record.
+        strings (dict): Optional dict of shared string values to use, so that
+            records converted with the same dict share one copy of each
+            repeated value (gene names, statuses, etc.).
+
+    """
+    if not Patient.fits(record):
+        return record
+    if strings is None:
+        strings = {}
+    record = {k : v if k == 'biopsies' else _share(v, strings)
+        for k, v in record.items()}
+    if isinstance(record.get('biopsies'), dict):
+        record['biopsies'] = {_share(bsn, strings) : _compact_biopsy(biopsy,
+            strings) for bsn, biopsy in record['biopsies'].items()}
+    elif 'biopsies' in record:
+        record['biopsies'] = _share(record['biopsies'], strings)
+    return Patient(record)
+
+
+def _compact_biopsy(biopsy, strings):
+    if not Biopsy.fits(biopsy):
+        return _share(biopsy, strings)
+    biopsy = {k : v if k == 'ngs_data' else _share(v, strings)
+        for k, v in biopsy.items()}
+    ngs_data = biopsy.get('ngs_data')
+    if ngs_data and NgsResult.fits(ngs_data):
+        ngs_data = {k : v if k == 'mois' else _share(v, strings)
+            for k, v in ngs_data.items()}
+        if isinstance(ngs_data.get('mois'), dict):
+            ngs_data['mois'] = {
+                _share(var_type, strings) : [make_variant(v, strings)
+                    for v in variants]
+                for var_type, variants in ngs_data['mois'].items()
+            }
+        biopsy['ngs_data'] = NgsResult(ngs_data)
+    elif 'ngs_data' in biopsy:
+        biopsy['ngs_data'] = _share(ngs_data, strings)
+    return Biopsy(biopsy)
+
+
+def _intern_fields(data):
+    for field, value in data.items():
+        if field not in CATEGORICAL_FIELDS:
+            continue
+        if isinstance(value, str):
+            data[field] = sys.intern(value)
+        elif isinstance(value, list):
+            value[:] = [sys.intern(x) if isinstance(x, str) else x 
+                for x in value]
+
+
+def _intern_mapping(data):
+    return {sys.intern(k) : sys.intern(v) if isinstance(v, str) else v
+        for k, v in data.items()}
+
+
+def intern_patient(record):
+    """
+    Intern the categorical values (see ``CATEGORICAL_FIELDS``) of a processed
+    patient record in place, along with the arm IDs and statuses in
+    ``ta_arms``, the IHC assays and results, and the variant type keys.
+
+    The JSON parser makes a new string object for every value it reads, so
+    the dataset otherwise holds thousands of copies of strings like ``'Pass'``
+    or ``'FORMERLY_ON_ARM_OFF_TRIAL'``.  Interned values are shared, which
+    saves memory, and they are the same objects as the string literals in the
+    code and as interned query arguments, so equality tests on them can be
+    decided by identity rather than by comparing characters.
+
+    Args:
+        record (dict): Patient record (a value of ``MatchData.data``).
+
+    Returns:
+        dict: The record.
+
+    """
+    if not isinstance(record, dict):
+        return record
+    _intern_fields(record)
+    if isinstance(record.get('ta_arms'), dict):
+        record['ta_arms'] = _intern_mapping(record['ta_arms'])
+
+    biopsies = record.get('biopsies')
+    if not isinstance(biopsies, dict):
+        return record
+    for biopsy in biopsies.values():
+        if not isinstance(biopsy, dict):
+            continue
+        _intern_fields(biopsy)
+        if isinstance(biopsy.get('ihc'), dict):
+            biopsy['ihc'] = _intern_mapping(biopsy['ihc'])
+        ngs_data = biopsy.get('ngs_data')
+        if isinstance(ngs_data, dict) and isinstance(ngs_data.get('mois'), 
+                dict):
+            ngs_data['mois'] = {sys.intern(var_type) : variants 
+                for var_type, variants in ngs_data['mois'].items()}
+            for variants in ngs_data['mois'].values():
+                for variant in variants:
+                    if isinstance(variant, dict):
+                        _intern_fields(variant)
+    return record
+
+
+def json_default(obj):
+    """
+    ``default`` function for ``json.dump()`` and ``json.dumps()`` that
+    serializes records as dicts.
+    """
+    if isinstance(obj, Record):
+        return dict(obj)
+    raise TypeError('Object of type %s is not JSON serializable' %
+        obj.__class__.__name__)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import threading
+
+import matchbox_api_utils
+from matchbox_api_utils.match_data import MatchData
+
+
+class ReloadingMatchData(object):
+    """
+    **Hot Reloading MATCHBox Dataset**
+
+    Handle to the system default :class:`MatchData` dataset that keeps itself
+    up to date.  A background thread polls the MATCHBox API Utils root dir
+    (``$HOME/.mb_utils``) for a newer dated ``mb_obj`` or ``ta_obj`` file (or
+    for the current ones being rewritten), loads the new dataset and builds
+    its indexes while the old one carries on serving queries, and then swaps
+    the new one in.  Long running services can then pick up the nightly dump
+    without a restart, and without a cold start stall.
+
+    Query methods and attributes can be used just as on a ``MatchData``
+    object, and always go to the newest dataset.  A query that is already
+    running when the swap happens finishes on the old dataset.  For several
+    queries that need to see the same dataset, get a reference with
+    :attr:`data` and use that.
+
+    If a reload fails (e.g. a half written file), the error is reported and
+    the current dataset is kept; the reload will be tried again on the next
+    poll.
+
+    Args:
+        matchbox (str): Name of the MATCHBox system. DEFAULT: ``adult``.
+
+        interval (int): Number of seconds between checks for new files.
+            DEFAULT: ``300``.
+
+        quiet (bool): If ``True``, supress module output debug, information,
+            etc. messages.
+
+        start (bool): Start polling for new files right away. If ``False``,
+            call :meth:`start` to start polling, or :meth:`reload` to check
+            for new files by hand.
+
+        **kwargs: Other arguments to ``MatchData`` (e.g. ``method``).
+
+    Examples:
+        >>> data = ReloadingMatchData('adult', interval=600)
+        >>> data.db_date
+        '2019-10-19'
+        >>> data.get_psn(msn='MSN3111')
+        'PSN10005'
+
+    """
+
+    def __init__(self, matchbox='adult', interval=300, quiet=True, start=True,
+        **kwargs):
+        self.matchbox = matchbox
+        self.interval = interval
+        self._quiet = quiet
+        self._kwargs = kwargs
+        self._reload_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self._files = self.__find_files()
+        self._data = self.__load()
+        if start:
+            self.start()
+
+    def __repr__(self):
+        return '%s: %s (%s)' % (self.__class__, self.matchbox,
+            self._data.db_date)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._data, name)
+
+    @property
+    def data(self):
+        """The current ``MatchData`` object."""
+        return self._data
+
+    def __find_files(self):
+        # Current system default MB and TA files, with their modification
+        # times so that we notice files that have been rewritten in place.
+        files = matchbox_api_utils.refresh_data_files()
+        found = []
+        for key in ('mb_json_data', 'ta_json_data'):
+            path = files[key]
+            try:
+                found.append((path, os.path.getmtime(path)))
+            except (OSError, TypeError):
+                found.append((path, None))
+        return tuple(found)
+
+    def __load(self):
+        return MatchData(matchbox=self.matchbox, json_db=self._files[0][0],
+            quiet=self._quiet, **self._kwargs)
+
+    def reload(self, force=False):
+        """
+        Check for new system default data files, and if there are any, load
+        them and swap the new dataset in.
+
+        Args:
+            force (bool): Reload the dataset even if there are no new files.
+
+        Returns:
+            bool: ``True`` if a new dataset was swapped in.
+
+        """
+        with self._reload_lock:
+            files = self.__find_files()
+            if files == self._files and not force:
+                return False
+
+            if self._quiet is False:
+                sys.stderr.write('[ INFO ]  Reloading MATCHBox data from '
+                    '%s.\n' % files[0][0])
+            old_files, self._files = self._files, files
+            try:
+                data = self.__load()
+                if getattr(data, 'data', None) is None:
+                    raise ValueError('no data loaded')
+            except Exception as exc:
+                self._files = old_files
+                sys.stderr.write('ERROR: Could not reload the MATCHBox data '
+                    'from %s: %s. Keeping the data from %s.\n' % (files[0][0],
+                    exc, self._data.db_date))
+                return False
+
+            self._data = data
+            if self._quiet is False:
+                sys.stderr.write('[ INFO ]  Now serving MATCHBox data from '
+                    '%s.\n' % data.db_date)
+            return True
+
+    def start(self):
+        """Start polling for new data files in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.__poll, daemon=True,
+            name='mb_data_reloader')
+        self._thread.start()
+
+    def stop(self):
+        """Stop polling for new data files."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __poll(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.reload()
+            except Exception as exc:
+                sys.stderr.write('ERROR: MATCHBox data reload check failed: '
+                    '%s\n' % exc)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+import sys
+import json
+import mmap
+import struct
+import contextlib
+from array import array
+from collections.abc import Mapping
+
+from matchbox_api_utils import utils
+from matchbox_api_utils.records import json_default
+
+# Snapshot files start with the magic string, and end with a footer of the
+# offset and length of the JSON metadata block, and the magic string again.
+MAGIC = b'MBSNAP01'
+_FOOTER = struct.Struct('<QQ8s')
+
+
+def is_snapshot(filename):
+    """Return ``True`` if the file is a MATCHBox snapshot file."""
+    try:
+        with open(filename, 'rb') as fh:
+            return fh.read(len(MAGIC)) == MAGIC
+    except (OSError, TypeError):
+        return False
+
+
+def write_snapshot(filename, data, db_date=None, summaries=None, 
+        indexes=None):
+    """
+    Write a processed MATCHBox dataset to a snapshot file that can be memory
+    mapped with :class:`Snapshot`.
+
+    The file is laid out as the magic string, then each patient record encoded
+    as a compact JSON blob, then a string table of PSNs, then a flat array of
+    ``(offset, length)`` pairs for the records in PSN table order, and finally
+    a JSON metadata block (DB date, precomputed summaries and indexes, and the
+    locations of the other sections) and the footer.
+
+    Args:
+        filename (str): Output filename.
+        data (dict): Processed patient data (``MatchData.data``).
+        db_date (str): Date of the dataset.
+        summaries (dict): Precomputed ``MatchData`` summaries.
+        indexes (dict): Precomputed ``MatchData`` indexes.
+
+    """
+    with SnapshotWriter(filename, db_date, summaries, indexes) as writer:
+        for psn in data:
+            writer.write(psn, data[psn])
+
+
+class SnapshotWriter(object):
+    """
+    **Streaming Snapshot Writer**
+
+    Write a snapshot file (see :func:`write_snapshot`) one patient at a time,
+    so that the dataset never has to be held in memory.  This is also a sink
+    for :func:`pipeline.run_pipeline`.  The file is written to a temp file
+    that is finished and renamed into place when the writer is closed, or 
+    discarded if the writer is used as a context manager and an exception is
+    raised.
+
+    Args:
+        filename (str): Output filename.
+
+        db_date (str): Date of the dataset. DEFAULT: today.
+
+        summaries (dict): Precomputed ``MatchData`` summaries, if there are
+            any. Otherwise they will be made when the snapshot is loaded.
+
+        indexes (dict): Precomputed ``MatchData`` indexes, if there are any.
+            Otherwise they will be made, by decoding every record, when the
+            snapshot is loaded.
+
+    Examples:
+        >>> with SnapshotWriter('mb_obj_101926.mbsnap') as writer:
+        ...     for psn, record in records:
+        ...         writer.write(psn, record)
+
+    """
+
+    def __init__(self, filename, db_date=None, summaries=None, indexes=None):
+        self.filename = filename
+        self.db_date = db_date or utils.get_today('long')
+        self.summaries = summaries
+        self.indexes = indexes
+        self._slots = {}
+        self._offsets = array('Q')
+        self._stack = contextlib.ExitStack()
+        self._fh = self._stack.enter_context(utils.atomic_write(filename, 
+            'wb'))
+        self._fh.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            # Discard the temp file rather than renaming it into place.
+            self._stack.__exit__(*exc)
+        self.close()
+
+    def write(self, psn, record):
+        """
+        Add a patient record to the snapshot. If the patient has already been
+        written, the new record replaces the old one (which is left in the 
+        file, but is no longer referenced).
+        """
+        blob = json.dumps(record, separators=(',', ':'),
+            default=json_default).encode('utf-8')
+        slot = self._slots.get(psn)
+        if slot is None:
+            self._slots[psn] = len(self._slots)
+            self._offsets.extend((self._fh.tell(), len(blob)))
+        else:
+            self._offsets[2 * slot] = self._fh.tell()
+            self._offsets[2 * slot + 1] = len(blob)
+        self._fh.write(blob)
+
+    def close(self):
+        """
+        Write the PSN table, offsets, and metadata, and rename the finished
+        file into place.
+        """
+        if self._fh.closed:
+            return
+        fh = self._fh
+        # PSNs in slot order, which is the order they were first written.
+        psn_table = '\n'.join(self._slots).encode('utf-8')
+        psn_table_offset = fh.tell()
+        fh.write(psn_table)
+
+        # Align the offsets array so that it can be cast in place.
+        fh.write(b'\0' * (-fh.tell() % self._offsets.itemsize))
+        offsets_offset = fh.tell()
+        self._offsets.tofile(fh)
+
+        meta = json.dumps({
+            'db_date'     : self.db_date,
+            'summaries'   : self.summaries,
+            'indexes'     : self.indexes,
+            'patients'    : len(self._slots),
+            'byteorder'   : sys.byteorder,
+            'itemsize'    : self._offsets.itemsize,
+            'psn_table'   : [psn_table_offset, len(psn_table)],
+            'offsets'     : [offsets_offset,
+                len(self._offsets) * self._offsets.itemsize],
+        }).encode('utf-8')
+        meta_offset = fh.tell()
+        fh.write(meta)
+        fh.write(_FOOTER.pack(meta_offset, len(meta), MAGIC))
+        self._stack.close()
+
+
+class Snapshot(Mapping):
+    """
+    **Memory Mapped MATCHBox Dataset**
+
+    Read-only, dict like view of a snapshot file made by
+    :func:`write_snapshot` (usually with :meth:`MatchData.matchbox_snapshot`).
+    The file is memory mapped, and the record offsets are read straight from
+    the mapped pages, so any number of processes can open the same snapshot
+    and share one copy of it through the OS page cache. Patient records are
+    only decoded when they are looked up, and are not held on to, so the
+    records returned are fresh copies that can't change the snapshot.  Only 
+    the records are shared this way; the summaries and indexes stored with 
+    the snapshot are decoded into each process that opens it.
+
+    A snapshot is usually loaded by passing its path as the ``json_db`` of
+    :class:`MatchData`, which then provides all of the usual query methods.
+
+    Args:
+        filename (str): Snapshot file to open.
+
+    Examples:
+        >>> data = MatchData(json_db='mb_obj_101926.mbsnap')
+        >>> snapshot = Snapshot('mb_obj_101926.mbsnap')
+        >>> snapshot['10005']['ctep_term']
+        'Squamous cell carcinoma of the anus'
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if (self._mmap[:len(MAGIC)] != MAGIC
+                or self._mmap[-len(MAGIC):] != MAGIC):
+            self._mmap.close()
+            raise ValueError('%s is not a MATCHBox snapshot file.' % filename)
+
+        meta_offset, meta_length, _ = _FOOTER.unpack(
+            self._mmap[-_FOOTER.size:])
+        meta = json.loads(
+            self._mmap[meta_offset:meta_offset + meta_length].decode('utf-8'))
+        self.db_date = meta['db_date']
+        self.summaries = meta['summaries']
+        self.indexes = meta.get('indexes')
+
+        offset, length = meta['psn_table']
+        psn_table = self._mmap[offset:offset + length].decode('utf-8')
+        self._psns = psn_table.split('\n') if psn_table else []
+        self._ordinals = {psn : i for i, psn in enumerate(self._psns)}
+
+        offset, length = meta['offsets']
+        if meta['byteorder'] == sys.byteorder:
+            self._offsets = memoryview(self._mmap)[offset:offset + length].cast(
+                'Q')
+        else:
+            # Written on a machine with the other byte order, so we need our
+            # own swapped copy.
+            self._offsets = array('Q', self._mmap[offset:offset + length])
+            self._offsets.byteswap()
+
+    def __getitem__(self, psn):
+        i = self._ordinals[psn]
+        offset, length = self._offsets[2 * i], self._offsets[2 * i + 1]
+        return json.loads(self._mmap[offset:offset + length].decode('utf-8'))
+
+    def __iter__(self):
+        return iter(self._psns)
+
+    def __len__(self):
+        return len(self._psns)
+
+    def __contains__(self, psn):
+        return psn in self._ordinals
+
+    def __repr__(self):
+        return '%s: %s (%s patients)' % (self.__class__, self.filename,
+            len(self._psns))
+
+    def close(self):
+        """Release the memory map."""
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        self._mmap.close()
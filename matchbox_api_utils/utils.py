@@ -4,28 +4,95 @@ import os
 import sys
 import re
 import json
+import math
 import datetime
 import inspect
+import hashlib
+import tempfile
+import contextlib
 
 from termcolor import colored, cprint
 from pprint import pprint
 
 from matchbox_api_utils import matchbox_conf
+from matchbox_api_utils.records import json_default
 
 
-def load_dumped_json(json_file):
-    # Load in a JSON DB file (raw or proc) and return JSON obj and file ctime.
+def get_file_date(json_file):
+    # Date of a JSON DB file from the date string in its name, or from its 
+    # ctime if it doesn't have one.
     try:
-        date_string = re.search(r'.*?([0-9]+).json$',json_file).group(1)
-        formatted_date=datetime.datetime.strptime(
+        date_string = re.search(r'.*?([0-9]+).jsonl?$',json_file).group(1)
+        return datetime.datetime.strptime(
             date_string,'%m%d%y').strftime('%m/%d/%Y')
     except (AttributeError,ValueError):
         creation_date = os.path.getctime(json_file)
-        formatted_date=datetime.datetime.fromtimestamp(
+        return datetime.datetime.fromtimestamp(
                 creation_date).strftime('%m/%d/%Y')
+
+def load_dumped_json(json_file):
+    # Load in a JSON DB file (raw or proc) and return JSON obj and file ctime.
+    formatted_date = get_file_date(json_file)
     with open(json_file) as fh:
         return formatted_date,json.load(fh)
 
+def stream_dumped_json(json_file):
+    # Like load_dumped_json(), but for a raw dump (a JSON array of documents),
+    # return the date and a generator of the documents rather than the whole 
+    # array. See iter_json_array().
+    return get_file_date(json_file), iter_json_array(json_file)
+
+_JSON_SEPARATOR = re.compile(r'[\s,]*')
+
+def iter_json_array(json_file, chunk_size=1 << 20):
+    """
+    Read a file holding a JSON array of objects (e.g. a raw MATCHBox dump),
+    and yield the objects one at a time, so that only one object (and one 
+    chunk of the file) is ever in memory, rather than the whole array and 
+    the text it was parsed from.
+
+    Args:
+        json_file (str): JSON file.
+
+        chunk_size (int): Number of characters to read at a time.
+
+    Yields:
+        The next object in the array.
+
+    """
+    decoder = json.JSONDecoder()
+    with open(json_file) as fh:
+        buf = fh.read(chunk_size).lstrip()
+        if not buf.startswith('['):
+            raise ValueError('%s does not hold a JSON array.' % json_file)
+        pos = 1
+        while True:
+            pos = _JSON_SEPARATOR.match(buf, pos).end()
+            if pos < len(buf):
+                if buf[pos] == ']':
+                    return
+                if buf[pos] not in '{[':
+                    raise ValueError('Expected a JSON object at character %i '
+                        'of the array in %s.' % (pos, json_file))
+                try:
+                    obj, pos = decoder.raw_decode(buf, pos)
+                    yield obj
+                    continue
+                except json.JSONDecodeError:
+                    # Most likely the object runs past the end of the chunk.
+                    pass
+
+            # Read more of the file.  Read at least as much as we already 
+            # have, so that a big object takes a few retries, not one per 
+            # chunk.
+            more = fh.read(max(chunk_size, len(buf) - pos))
+            if not more:
+                if pos < len(buf):
+                    # Raise the real parse error.
+                    decoder.raw_decode(buf, pos)
+                raise ValueError('JSON array in %s is truncated.' % json_file)
+            buf, pos = buf[pos:] + more, 0
+
 def get_today(outtype):
     if outtype == 'long':
         return datetime.date.today().strftime('%Y-%m-%d')
@@ -57,12 +124,230 @@ def map_histology(data, *, medra=None, histology=None):
     else:
         return data
                     
+def log_odds_ratio(a, b, c, d):
+    # Log odds ratio of a 2x2 table [[a, b], [c, d]], with a 0.5 (Haldane) 
+    # correction so that we don't blow up on empty cells.
+    return math.log(((a + 0.5) * (d + 0.5)) / ((b + 0.5) * (c + 0.5)))
+
+def fisher_exact_tails(a, b, c, d):
+    # One-sided Fisher's exact test on a 2x2 table [[a, b], [c, d]]. Return a
+    # tuple of (P(X <= a), P(X >= a)), where X is the top left cell under the 
+    # hypergeometric null with the table margins fixed.  The lower tail tests 
+    # for mutual exclusivity and the upper tail for co-occurrence.
+    def lbinom(n, k):
+        return math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+
+    row1, col1, total = a + b, a + c, a + b + c + d
+    low = max(0, row1 + col1 - total)
+    high = min(row1, col1)
+    denom = lbinom(total, row1)
+    probs = [
+        math.exp(lbinom(col1, x) + lbinom(total - col1, row1 - x) - denom)
+        for x in range(low, high + 1)
+    ]
+    return (min(1.0, sum(probs[:a - low + 1])), min(1.0, sum(probs[a - low:])))
+
+# The process umask, for the permissions of files made by atomic_write(). 
+# The umask can only be read by setting it, which is not safe to do once there
+# are other threads making files, so read it once here at import time.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+@contextlib.contextmanager
+def atomic_write(outfile, mode='w'):
+    # Open a temp file next to outfile for writing, and rename it over outfile
+    # once it has been written in full, so that a crash or a full disk never 
+    # leaves a truncated file behind (for get_latest_data() to pick up). The
+    # temp file is hidden and has a .tmp extension so that it is never taken 
+    # for a data file. 
+    dirname, basename = os.path.split(os.path.abspath(outfile))
+    fd, tmpfile = tempfile.mkstemp(dir=dirname, prefix='.%s.' % basename, 
+        suffix='.tmp')
+    try:
+        # Give the file the usual permissions rather than mkstemp()'s 0600.
+        os.chmod(tmpfile, 0o666 & ~_UMASK)
+        with os.fdopen(fd, mode) as fh:
+            yield fh
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmpfile, outfile)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmpfile)
+        raise
+
 def make_json(*, outfile, data, sort=True):
-    with open(outfile, 'w') as fh:
-        json.dump(data, fh, sort_keys=sort, indent=4)
+    with atomic_write(outfile) as fh:
+        json.dump(data, fh, sort_keys=sort, indent=4, default=json_default)
+
+def write_json_dict(*, outfile, data, sort=True, pretty=True, index=False, 
+        checksum=False):
+    """
+    Write a dict to a JSON file one item at a time, rather than encoding it 
+    as a whole, so that only one value is ever held as JSON text (and values
+    that are loaded on demand, as from a snapshot, are only loaded one at a 
+    time).  The file is written to a temp file that is renamed into place 
+    when it is complete (see ``atomic_write()``).
+
+    Args:
+        outfile (str): Output filename.
+
+        data (Mapping): Data to write.
+
+        sort (bool): Sort the keys (at all levels). DEFAULT: ``True``.
+
+        pretty (bool): Write indented JSON, the same as ``make_json()``.  If
+            ``False``, write compact JSON, which is a good deal smaller and 
+            quicker to write and load. DEFAULT: ``True``.
+
+        index (bool): Also write an offset index, ``<outfile>.idx``, made in 
+            the same pass.  This is a JSON object of the byte offset and 
+            length of each value in the file, so that one value can be read 
+            without parsing the rest of the file (see ``read_json_item()``).
+
+        checksum (bool): Also write the SHA-256 checksum of the file, made in 
+            the same pass, to ``<outfile>.sha256`` in the format used by 
+            ``sha256sum``, so that the file can be checked with 
+            ``sha256sum -c``.
+
+    Returns:
+        str: SHA-256 hex digest of the file.
+
+    """
+    if pretty:
+        opts = {'indent' : 4}
+        start, sep, end, key_sep = '{\n    ', ',\n    ', '\n}', ': '
+    else:
+        opts = {'separators' : (',', ':')}
+        start, sep, end, key_sep = '{', ',', '}', ':'
+
+    keys = sorted(data) if sort else list(data)
+    sha = hashlib.sha256()
+    offsets = {}
+    with atomic_write(outfile, 'wb') as fh:
+        def write(text):
+            chunk = text.encode('utf-8')
+            sha.update(chunk)
+            fh.write(chunk)
+            return len(chunk)
+
+        pos = write(start if keys else '{')
+        for n, key in enumerate(keys):
+            value = json.dumps(data[key], sort_keys=sort, 
+                default=json_default, **opts)
+            if pretty:
+                value = value.replace('\n', '\n    ')
+            pos += write((sep if n else '') + json.dumps(key) + key_sep)
+            offsets[key] = (pos, write(value))
+            pos += offsets[key][1]
+        write(end if keys else '}')
+
+    if index:
+        with atomic_write(outfile + '.idx') as fh:
+            json.dump(offsets, fh, separators=(',', ':'))
+    if checksum:
+        with atomic_write(outfile + '.sha256') as fh:
+            fh.write('%s  %s\n' % (sha.hexdigest(), os.path.basename(outfile)))
+    return sha.hexdigest()
+
+def file_sha256(filename):
+    # SHA-256 hex digest of a file, read in chunks.
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def json_line(key, value):
+    # One line of a JSON Lines dataset: a compact [key, value] array, so that 
+    # the key can be read off the start of the line without decoding the rest
+    # of it.  
+    return json.dumps([key, value], separators=(',', ':'), 
+        default=json_default) + '\n'
+
+def make_json_lines(*, outfile, items, append=False):
+    """
+    Write ``(key, value)`` pairs to a JSON Lines dataset, one compact 
+    ``[key, value]`` array per line (see ``iter_json_lines()``). 
+
+    Args:
+        outfile (str): Output filename.
+
+        items (iterable): ``(key, value)`` pairs to write.
+
+        append (bool): Add the items to the end of an existing dataset, rather
+            than writing a new one (which is written to a temp file and 
+            renamed into place, like ``make_json()``).  When the dataset is
+            loaded, an appended item replaces any earlier item with the same
+            key.  Appended lines are synced to disk before returning.
+
+    """
+    if append:
+        with open(outfile, 'ab+') as fh:
+            # An append that was cut short can leave a partial last line with
+            # no newline (which iter_json_lines() skips); end it so that our 
+            # first line isn't run into it.
+            end = fh.seek(0, os.SEEK_END)
+            if end:
+                fh.seek(end - 1)
+                if fh.read(1) != b'\n':
+                    fh.write(b'\n')
+            for key, value in items:
+                fh.write(json_line(key, value).encode('utf-8'))
+            fh.flush()
+            os.fsync(fh.fileno())
+    else:
+        with atomic_write(outfile) as fh:
+            for key, value in items:
+                fh.write(json_line(key, value))
+
+def iter_json_lines(json_file, keys=None):
+    """
+    Read a JSON Lines dataset written by ``make_json_lines()``, one line at a
+    time. 
+
+    Args:
+        json_file (str): JSON Lines file.
+
+        keys (list): Only read the items with these keys. Lines for other keys
+            are skipped by looking at the key at the start of the line, 
+            without decoding the line.
+
+    Yields:
+        tuple: ``(key, value)`` for each line, in file order. Keys may repeat
+        if items were appended; the last one is the current one.  Lines that
+        are not a complete item (e.g. the partial last line left by an append
+        that was cut short) are skipped with a warning.
+
+    """
+    prefixes = None
+    if keys is not None:
+        prefixes = tuple('[%s,' % json.dumps(str(k)) for k in keys)
+    with open(json_file) as fh:
+        for lineno, line in enumerate(fh, 1):
+            if prefixes is not None and not line.startswith(prefixes):
+                continue
+            if not line.strip():
+                continue
+            try:
+                key, value = json.loads(line)
+            except (ValueError, TypeError):
+                sys.stderr.write('WARN: Skipping line %i of %s, which is not a '
+                    'complete item.\n' % (lineno, json_file))
+                continue
+            yield key, value
+
+def read_json_item(json_file, key):
+    # Read one value from a JSON file written by write_json_dict() with an 
+    # offset index, without parsing the rest of the file.
+    with open(json_file + '.idx') as fh:
+        offset, length = json.load(fh)[key]
+    with open(json_file, 'rb') as fh:
+        fh.seek(offset)
+        return json.loads(fh.read(length).decode('utf-8'))
 
 def print_json(data):
-    return json.dumps(data, sort_keys=True, indent=4)
+    return json.dumps(data, sort_keys=True, indent=4, default=json_default)
 
 def read_json(json_file):
     with open(json_file) as fh:
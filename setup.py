@@ -45,6 +45,7 @@ config = {
                               'bin/match_variant_frequency.py',
                               'bin/matchbox_patient_summary.py',
                               'bin/match_arm_enrollment_summary.py',
+                              'bin/matchbox_query_server.py',
                              ],
     'include_package_data' : True,
     'zip_safe'             : False,
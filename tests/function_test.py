@@ -1,8 +1,21 @@
 #!/usr/bin/env python
 import sys,os
+import json
+import sqlite3
+import tempfile
+import threading
 import unittest
+from unittest import mock
+import matchbox_api_utils
+from concurrent.futures import ThreadPoolExecutor
 from matchbox_api_utils import MatchData
 from matchbox_api_utils import utils
+from matchbox_api_utils import query_server
+from matchbox_api_utils import snapshot
+from matchbox_api_utils.reloader import ReloadingMatchData
+from matchbox_api_utils.frozen import FrozenDict
+from matchbox_api_utils import records
+from matchbox_api_utils import pipeline
 
 class FunctionTests(unittest.TestCase):
     # proc_mb_file = 'mb_obj_' + utils.get_today('short') + '.json'
@@ -283,3 +296,508 @@ class FunctionTests(unittest.TestCase):
             self.data.get_ihc_results(psn=10818),
             r3
         )
+
+    def test_get_cohort(self):
+        egfr = self.data.get_cohort(gene='EGFR', variant_type=['snvs', 
+            'indels'])
+        self.assertTrue('15232' in egfr)
+
+        query = {'snvs':['EGFR'], 'indels':['EGFR']}
+        self.assertEqual(
+            sorted(egfr.psns()),
+            sorted(self.data.find_variant_frequency(query)[0])
+        )
+
+        arm_e = self.data.get_cohort(arm='EAY131-E')
+        self.assertEqual(
+            sorted(arm_e.psns()),
+            sorted(x[0] for x in self.data.get_patients_by_arm('EAY131-E'))
+        )
+
+        everyone = self.data.get_cohort(outside=True)
+        self.assertEqual(len(everyone), len(self.data.data))
+        self.assertEqual(len(egfr & ~egfr), 0)
+        self.assertEqual(egfr | arm_e, arm_e | egfr)
+        self.assertEqual(len(egfr - arm_e) + len(egfr & arm_e), len(egfr))
+
+    def test_get_gene_cooccurrence(self):
+        results = self.data.get_gene_cooccurrence(genes=['KRAS', 'PIK3CA'])
+        stats = results[('KRAS', 'PIK3CA')]
+
+        all_types = ('snvs', 'indels', 'cnvs', 'fusions')
+        kras = self.data.find_variant_frequency(
+            {x : ['KRAS'] for x in all_types})[0]
+        pik3ca = self.data.find_variant_frequency(
+            {x : ['PIK3CA'] for x in all_types})[0]
+        self.assertEqual(stats['both'], len(set(kras) & set(pik3ca)))
+        self.assertEqual(stats['only_1'], len(set(kras) - set(pik3ca)))
+        self.assertTrue(0 <= stats['p_exclusive'] <= 1)
+        self.assertTrue(0 <= stats['p_cooccur'] <= 1)
+
+    def test_get_variant_summary(self):
+        query = {'snvs' : ['EGFR'], 'indels' : ['EGFR']}
+        summary = self.data.get_variant_summary(group_by=('gene',), 
+            query=query)
+        hits = self.data.find_variant_frequency(query)[0]
+        self.assertEqual(summary[('EGFR',)]['patients'], len(hits))
+
+        by_disease = self.data.get_variant_summary(
+            group_by=('gene', 'ctep_term'), query=query)
+        self.assertEqual(
+            sum(x['patients'] for x in by_disease.values()),
+            len(hits)
+        )
+        self.assertIsNone(self.data.get_variant_summary(group_by=('foo',)))
+
+        # A patient on more than one arm has each variant counted once, other
+        # than when grouping on the arm.
+        psn = next(p for p in self.data.data 
+            if self.data.get_variant_summary(query_patients=[p]))
+        record = dict(self.data.data[psn], ta_arms={
+            'EAY131-A' : 'FORMERLY_ON_ARM_OFF_TRIAL',
+            'EAY131-B' : 'FORMERLY_ON_ARM_OFF_TRIAL',
+            'EAY131-C' : 'ON_TREATMENT_ARM',
+        })
+        filename = os.path.join(tempfile.mkdtemp(), 'mb_obj.json')
+        utils.make_json(outfile=filename, data={psn : record})
+        data = MatchData(json_db=filename, quiet=True)
+
+        by_gene = data.get_variant_summary()
+        self.assertEqual(by_gene, 
+            self.data.get_variant_summary(query_patients=[psn]))
+        by_arm = data.get_variant_summary(group_by=('gene', 'arm'))
+        self.assertEqual(len(by_arm), len(by_gene) * 3)
+        for (gene, arm), counts in by_arm.items():
+            self.assertEqual(counts, by_gene[(gene,)])
+        total = sum(x['variants'] for x in by_gene.values())
+        self.assertEqual(
+            data.get_variant_summary(group_by=('arm_status',)),
+            {
+                ('FORMERLY_ON_ARM_OFF_TRIAL',) : {'patients' : 1, 
+                    'variants' : total},
+                ('ON_TREATMENT_ARM',) : {'patients' : 1, 'variants' : total},
+            }
+        )
+
+    def test_cached_summaries(self):
+        counts = self.data.get_biopsy_summary()
+        counts['patients'] = -1
+        self.assertNotEqual(self.data.get_biopsy_summary()['patients'], -1)
+
+        ids = self.data.get_biopsy_summary(category='progression', 
+            ret_type='ids')
+        ids['progression'].append('T-00-000000')
+        self.assertNotIn(
+            'T-00-000000',
+            self.data.get_biopsy_summary(category='progression', 
+                ret_type='ids')['progression']
+        )
+
+        before = self.data.get_disease_summary()
+        self.data.reindex()
+        self.assertEqual(before, self.data.get_disease_summary())
+
+    def test_search_diseases(self):
+        results = self.data.search_diseases('BREAST')
+        self.assertEqual(results.get('10006190'), 'Invasive breast carcinoma')
+        self.assertEqual(
+            self.data.search_diseases('invasive breast', prefix=True),
+            {'10006190' : 'Invasive breast carcinoma'}
+        )
+        self.assertEqual(self.data.search_diseases('not a disease'), {})
+
+        patients = self.data.get_patients_by_disease(histology='glioma')
+        self.assertTrue(all('glioma' in x.lower() for x in patients.values()))
+        self.assertEqual(
+            set(self.data.get_patients_by_disease(meddra_code='10006190')),
+            set(self.data.get_patients_by_disease(
+                histology='Invasive breast carcinoma'))
+        )
+
+    def test_get_arm_status_summary(self):
+        summary = self.data.get_arm_status_summary()
+        self.assertIn('EAY131-E', summary)
+        self.assertEqual(
+            sum(summary['EAY131-E'].values()),
+            len(self.data.get_patients_by_arm('EAY131-E'))
+        )
+        with_outside = self.data.get_arm_status_summary(outside=True)
+        self.assertTrue(
+            sum(with_outside['EAY131-E'].values()) 
+            >= sum(summary['EAY131-E'].values())
+        )
+
+    def test_screen_cohort(self):
+        eligible = self.data.screen_cohort(processes=1)
+        self.assertEqual(set(eligible), set(self.data.arm_data.data))
+        self.assertEqual(eligible, self.data.screen_cohort(processes=2))
+
+        # Eligible patients must have an inclusion aMOI for the arm, or the 
+        # arm is IHC only, and can't have an excluded disease.
+        arm = 'EAY131-H'
+        arm_data = self.data.arm_data.data[arm]
+        excluded = set((arm_data['excl_diseases'] or {}).values())
+        for psn in eligible[arm]:
+            self.assertNotIn(self.data.data[psn]['meddra_code'], excluded)
+
+        self.assertEqual(list(self.data.screen_cohort(arms=arm)), [arm])
+        self.assertIsNone(self.data.screen_cohort(arms='EAY131-FAKE'))
+
+    def test_query_server(self):
+        socket_path = os.path.join(tempfile.mkdtemp(), 'mb.sock')
+        server = query_server.QueryServer(socket_path=socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            client = query_server.get_match_data(socket_path=socket_path,
+                quiet=True)
+            self.assertIsInstance(client, query_server.QueryClient)
+            self.assertEqual(client.db_date, server.data.db_date)
+            self.assertEqual(client.get_biopsy_summary(), 
+                server.data.get_biopsy_summary())
+            self.assertEqual(client.get_cohort(gene='BRAF').psns(),
+                server.data.get_cohort(gene='BRAF').psns())
+            # Cohorts from separate responses share one index, and combine
+            # just as local ones do.
+            combined = client.get_cohort(gene='EGFR') | client.get_cohort(
+                arm='EAY131-E')
+            self.assertEqual(combined.psns(), (server.data.get_cohort(
+                gene='EGFR') | server.data.get_cohort(arm='EAY131-E')).psns())
+            background, carriers = client.get_gene_incidence(genes=['BRAF'])
+            self.assertEqual((background & carriers['BRAF']).psns(), 
+                client.get_cohort(gene='BRAF').psns())
+            self.assertEqual(client.arm_data.map_drug_arm(drugname='Afatinib'),
+                server.data.arm_data.map_drug_arm(drugname='Afatinib'))
+            self.assertEqual(sorted(client.arm_data.get_match_arm_info()),
+                sorted(server.data.arm_data.data))
+            for name in ('matchbox_dump', 'matchbox_json_lines', 
+                    'matchbox_snapshot', 'compact', 'freeze', 'reindex', 
+                    'enable_cache', 'disable_cache', 'clear_cache', 'data',
+                    '_summaries'):
+                with self.assertRaises(AttributeError):
+                    getattr(client, name)()
+            for name in ('ta_json_dump', 'make_match_arms_db', 'data'):
+                with self.assertRaises(AttributeError):
+                    getattr(client.arm_data, name)()
+            self.assertFalse(server.data.frozen)
+            self.assertIsNone(server.data._query_cache)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertIsInstance(
+            query_server.get_match_data(socket_path=socket_path, quiet=True),
+            MatchData
+        )
+
+    def test_matchbox_snapshot(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'mb_obj.mbsnap')
+        self.data.matchbox_snapshot(filename)
+        snap = MatchData(json_db=filename, quiet=True)
+        self.assertIsInstance(snap.data, snapshot.Snapshot)
+        self.assertEqual(snap.db_date, self.data.db_date)
+        self.assertEqual(list(snap.data), list(self.data.data))
+        psn = list(self.data.data)[0]
+        self.assertEqual(snap.data[psn], self.data.data[psn])
+        self.assertEqual(snap.get_biopsy_summary(), 
+            self.data.get_biopsy_summary())
+        self.assertEqual(snap.get_cohort(gene='BRAF').psns(),
+            self.data.get_cohort(gene='BRAF').psns())
+        with self.assertRaises(TypeError):
+            snap.data[psn] = {}
+        snap.data.close()
+
+        # The indexes are stored in the snapshot, so loading it doesn't decode
+        # any records.
+        decoded = []
+        class CountingSnapshot(snapshot.Snapshot):
+            def __getitem__(self, psn):
+                decoded.append(psn)
+                return super().__getitem__(psn)
+        with mock.patch.object(snapshot, 'Snapshot', CountingSnapshot):
+            snap = MatchData(json_db=filename, quiet=True)
+        self.assertEqual(decoded, [])
+        self.assertEqual(snap.get_disease_summary(), 
+            self.data.get_disease_summary())
+        self.assertEqual(snap.search_diseases('lung'), 
+            self.data.search_diseases('lung'))
+        self.assertEqual(snap.get_patients_by_arm('EAY131-E'), 
+            self.data.get_patients_by_arm('EAY131-E'))
+        self.assertEqual(snap.get_cohort(histology='lung', outside=True).psns(),
+            self.data.get_cohort(histology='lung', outside=True).psns())
+        _, carriers = snap.get_gene_incidence(genes=['BRAF'])
+        _, expected = self.data.get_gene_incidence(genes=['BRAF'])
+        self.assertEqual(carriers['BRAF'].psns(), expected['BRAF'].psns())
+        snap.data.close()
+
+    def test_pipeline_sinks(self):
+        tmpdir = tempfile.mkdtemp()
+        self.assertEqual(list(MatchData.iter_patients([], None)), [])
+        records = list(self.data.data.items())
+
+        jsonl = os.path.join(tmpdir, 'mb_obj.jsonl')
+        with pipeline.JsonLinesSink(jsonl) as sink:
+            for psn, record in records:
+                sink.write(psn, record)
+        with open(jsonl) as fh:
+            self.assertEqual(dict(pipeline.read_json_lines(fh)),
+                self.data.data)
+
+        db = os.path.join(tmpdir, 'mb_obj.db')
+        with pipeline.SQLiteSink(db, batch_size=100) as sink:
+            for psn, record in records + records[:10]:
+                sink.write(psn, record)
+        with self.assertRaises(ValueError):
+            pipeline.SQLiteSink(db, table='bad name')
+        conn = sqlite3.connect(db)
+        rows = conn.execute('SELECT psn, record FROM patients').fetchall()
+        conn.close()
+        self.assertEqual(len(rows), len(records))
+        self.assertEqual({psn : json.loads(rec) for psn, rec in rows}, 
+            self.data.data)
+
+        snap = os.path.join(tmpdir, 'mb_obj.mbsnap')
+        with pipeline.SnapshotSink(snap, db_date=self.data.db_date) as sink:
+            for psn, record in records + records[:10]:
+                sink.write(psn, record)
+        snap_data = MatchData(json_db=snap, quiet=True)
+        self.assertEqual(len(snap_data.data), len(records))
+        self.assertEqual(list(snap_data.data), list(self.data.data))
+        self.assertEqual(snap_data.get_biopsy_summary(),
+            self.data.get_biopsy_summary())
+        snap_data.data.close()
+
+        # A run that fails part way through leaves no file behind, and 
+        # doesn't touch the one from the last run.
+        for sink_class, filename in ((pipeline.JsonLinesSink, jsonl),
+                (pipeline.SnapshotSink, snap)):
+            before = os.path.getsize(filename)
+            with self.assertRaises(KeyError):
+                with sink_class(filename) as sink:
+                    sink.write(*records[0])
+                    raise KeyError(records[1][0])
+            self.assertEqual(os.path.getsize(filename), before)
+            with self.assertRaises(KeyError):
+                with sink_class(filename + '.new') as sink:
+                    raise KeyError(records[0][0])
+        self.assertEqual(sorted(os.listdir(tmpdir)), 
+            ['mb_obj.db', 'mb_obj.jsonl', 'mb_obj.mbsnap'])
+
+    def test_iter_json_array(self):
+        docs = [{'psn' : str(n), 'text' : 'a "quoted" [{bracket}] \\'}
+            for n in range(50)]
+        filename = os.path.join(tempfile.mkdtemp(), 'raw_mb_dump.json')
+        utils.make_json(outfile=filename, data=docs)
+        self.assertEqual(list(utils.iter_json_array(filename, chunk_size=16)),
+            docs)
+        with open(filename, 'w') as fh:
+            fh.write(json.dumps(docs)[:-20])
+        with self.assertRaises(ValueError):
+            list(utils.iter_json_array(filename, chunk_size=16))
+
+    def test_matchbox_dump(self):
+        tmpdir = tempfile.mkdtemp()
+        pretty = os.path.join(tmpdir, 'mb_obj_pretty.json')
+        compact = os.path.join(tmpdir, 'mb_obj_compact.json')
+        self.data.matchbox_dump(pretty)
+        self.data.matchbox_dump(compact, pretty=False, index=True, 
+            checksum=True)
+        self.assertEqual(utils.read_json(pretty), utils.read_json(compact))
+        self.assertLess(os.path.getsize(compact), os.path.getsize(pretty))
+        psn = list(self.data.data)[0]
+        self.assertEqual(utils.read_json_item(compact, psn), 
+            self.data.data[psn])
+        with open(compact + '.sha256') as fh:
+            self.assertTrue(fh.read().endswith('  mb_obj_compact.json\n'))
+        self.assertEqual(sorted(os.listdir(tmpdir)), ['mb_obj_compact.json',
+            'mb_obj_compact.json.idx', 'mb_obj_compact.json.sha256', 
+            'mb_obj_compact.json.summaries', 'mb_obj_pretty.json',
+            'mb_obj_pretty.json.summaries'])
+        self.assertEqual(sorted(utils.read_json(compact)), 
+            sorted(self.data.data))
+
+    def test_stored_summaries(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'mb_obj.json')
+        self.data.matchbox_dump(filename)
+        stored = utils.read_json(filename + '.summaries')
+        stored['summaries']['stored'] = True
+        with open(filename + '.summaries', 'w') as fh:
+            json.dump(stored, fh)
+        data = MatchData(json_db=filename, quiet=True)
+        self.assertTrue(data._summaries.get('stored'))
+
+        # Summaries for an edited dump with the same patients are not used.
+        dump = utils.read_json(filename)
+        psn = list(dump)[0]
+        dump[psn]['ctep_term'] = 'Edited'
+        utils.make_json(outfile=filename, data=dump)
+        data = MatchData(json_db=filename, quiet=True)
+        self.assertIsNone(data._summaries.get('stored'))
+        summaries = data._summaries
+        data.reindex()
+        self.assertEqual(summaries, data._summaries)
+
+    def test_matchbox_json_lines(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'mb_obj_101926.jsonl')
+        self.data.matchbox_json_lines(filename)
+        data = MatchData(json_db=filename, quiet=True)
+        self.assertEqual(data.data, self.data.data)
+        self.assertEqual(data.get_biopsy_summary(), 
+            self.data.get_biopsy_summary())
+
+        psn = list(self.data.data)[0]
+        patient = MatchData(json_db=filename, quiet=True, patient=psn)
+        self.assertEqual(list(patient.data), [psn])
+        record = dict(patient.data[psn], ctep_term='Updated')
+        utils.make_json_lines(outfile=filename, items=[(psn, record)], 
+            append=True)
+        data = MatchData(json_db=filename, quiet=True)
+        self.assertEqual(len(data.data), len(self.data.data))
+        self.assertEqual(data.data[psn]['ctep_term'], 'Updated')
+
+        # A partial last line, from an append that was cut short, is skipped 
+        # and doesn't run into the next append.
+        with open(filename, 'a') as fh:
+            fh.write(utils.json_line(psn, dict(record, ctep_term='Lost'))[:40])
+        data = MatchData(json_db=filename, quiet=True)
+        self.assertEqual(len(data.data), len(self.data.data))
+        self.assertEqual(data.data[psn]['ctep_term'], 'Updated')
+        record['ctep_term'] = 'Resynced'
+        utils.make_json_lines(outfile=filename, items=[(psn, record)], 
+            append=True)
+        data = MatchData(json_db=filename, quiet=True)
+        self.assertEqual(data.data[psn]['ctep_term'], 'Resynced')
+        patient = MatchData(json_db=filename, quiet=True, patient=psn)
+        self.assertEqual(patient.data[psn]['ctep_term'], 'Resynced')
+        self.assertEqual(matchbox_api_utils.get_latest_data([filename, 
+            filename.replace('.jsonl', '.json')], quiet=True), filename)
+
+    def test_reloading_match_data(self):
+        data = ReloadingMatchData(start=False)
+        current = data.data
+        self.assertIsInstance(current, MatchData)
+        self.assertFalse(data.reload())
+        self.assertIs(data.data, current)
+        self.assertTrue(data.reload(force=True))
+        self.assertIsNot(data.data, current)
+        self.assertEqual(data.db_date, current.db_date)
+        self.assertEqual(data.get_biopsy_summary(), current.get_biopsy_summary())
+
+    def test_frozen_thread_safety(self):
+        data = MatchData(json_db=self.sys_default_json, quiet=True, frozen=True)
+        self.assertTrue(data.frozen)
+        psn = list(data.data)[0]
+        self.assertIsInstance(data.data[psn], FrozenDict)
+        self.assertEqual(data.data[psn], self.data.data[psn])
+        with self.assertRaises(TypeError):
+            data.get_patient_meta(psn)[psn]['ctep_term'] = 'foo'
+        with self.assertRaises(AttributeError):
+            data.data = {}
+
+        queries = [
+            (data.get_biopsy_summary, {}),
+            (data.get_disease_summary, {'outside' : True}),
+            (data.get_histology, {'outside' : True}),
+            (data.find_variant_frequency, {'query' : {'snvs' : ['BRAF'], 
+                'cnvs' : ['ERBB2'], 'fusions' : ['ALK']}}),
+            (data.get_cohort, {'gene' : 'EGFR'}),
+        ]
+        queries += [(data.get_variant_report, {'psn' : p}) 
+            for p in list(data.data)[:50]]
+        queries += [(data.get_patients_by_arm, {'arm' : a}) 
+            for a in sorted(data.arm_data.data)]
+        def run(query):
+            result = query[0](**query[1])
+            return result.psns() if hasattr(result, 'psns') else result
+
+        serial = [run(q) for q in queries]
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            for _ in range(20):
+                self.assertEqual(list(pool.map(run, queries)), serial)
+
+    def test_query_cache(self):
+        data = MatchData(json_db=self.sys_default_json, quiet=True, 
+            cache_size=4)
+        self.assertEqual(data.cache_info()['misses'], 0)
+        query = {'snvs' : ['EGFR', 'BRAF'], 'cnvs' : ['ERBB2']}
+        result = data.find_variant_frequency(query)
+        self.assertEqual(result, self.data.find_variant_frequency(query))
+        self.assertEqual(
+            data.find_variant_frequency({'cnvs' : ['ERBB2'], 
+                'snvs' : ['BRAF', 'EGFR']}), 
+            result
+        )
+        psns = list(data.data)[:3]
+        self.assertEqual(data.get_histology(psn=','.join(psns)), 
+            data.get_histology(psn=','.join('PSN' + p for p in psns[::-1])))
+        self.assertEqual(data.cache_info()['hits'], 2)
+        self.assertEqual(data.cache_info()['misses'], 2)
+
+        # Callers get their own copy of cached results.
+        data.get_biopsy_summary()['patients'] = -1
+        self.assertEqual(data.get_biopsy_summary(), 
+            self.data.get_biopsy_summary())
+
+        for arm in sorted(data.arm_data.data)[:5]:
+            data.get_patients_by_arm(arm)
+        self.assertEqual(data.cache_info()['size'], 4)
+
+        data.reindex()
+        self.assertEqual(data.cache_info()['size'], 0)
+
+    def test_interned_values(self):
+        # Repeated categorical values are shared rather than copied.
+        statuses = [
+            biopsy['biopsy_status'] 
+            for record in self.data.data.values() 
+            if record['biopsies'] != 'No_Biopsy'
+            for biopsy in record['biopsies'].values()
+        ]
+        self.assertTrue(all(s is sys.intern(s) for s in statuses))
+        genes = [
+            variant['gene']
+            for record in self.data.data.values()
+            if record['biopsies'] != 'No_Biopsy'
+            for biopsy in record['biopsies'].values()
+            if biopsy['ngs_data'] and 'mois' in biopsy['ngs_data']
+            for variants in biopsy['ngs_data']['mois'].values()
+            for variant in variants
+        ]
+        self.assertTrue(all(g is sys.intern(g) for g in genes))
+
+    def test_compact_records(self):
+        data = MatchData(json_db=self.sys_default_json, quiet=True, 
+            compact=True)
+        psn = list(data.data)[0]
+        self.assertIsInstance(data.data[psn], records.Patient)
+        self.assertEqual(data.data, self.data.data)
+        self.assertEqual(dict(data.data[psn]), self.data.data[psn])
+        with self.assertRaises(TypeError):
+            data.data[psn]['ctep_term'] = 'foo'
+
+        query = {'snvs' : ['BRAF', 'EGFR'], 'cnvs' : ['ERBB2'], 
+            'fusions' : ['ALK']}
+        self.assertEqual(data.find_variant_frequency(query),
+            self.data.find_variant_frequency(query))
+        self.assertEqual(data.get_histology(outside=True), 
+            self.data.get_histology(outside=True))
+        self.assertEqual(data.get_biopsy_summary(), 
+            self.data.get_biopsy_summary())
+
+        filename = os.path.join(tempfile.mkdtemp(), 'mb_obj.json')
+        data.matchbox_dump(filename)
+        self.assertEqual(MatchData(json_db=filename, quiet=True).data, 
+            self.data.data)
+
+        frozen = MatchData(json_db=self.sys_default_json, quiet=True, 
+            frozen=True).compact()
+        self.assertTrue(frozen.frozen)
+        self.assertIsInstance(frozen.data[psn], records.Patient)
+        self.assertEqual(frozen.data, self.data.data)
+        with self.assertRaises(TypeError):
+            frozen.data[psn]['ta_arms']['EAY131-A'] = 'hacked'
+        with self.assertRaises(TypeError):
+            frozen.data[psn]['all_msns'].append('MSN0')
+        with self.assertRaises(TypeError):
+            frozen.data['00000'] = {}
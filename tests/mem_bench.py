@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measure the memory used by the processed MATCHBox patient records as plain
+dicts, as dicts with interned categorical values (what ``MatchData`` loads), 
+and as compact records (``MatchData(compact=True)``).
+Uses the system default mb_obj JSON file unless one is passed in.
+
+    $ python3 tests/mem_bench.py [mb_obj.json]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+import matchbox_api_utils
+from matchbox_api_utils import utils
+from matchbox_api_utils.records import compact_patient, intern_patient
+
+
+def load_records(json_db):
+    return utils.load_dumped_json(json_db)[1]
+
+
+def interned_records(json_db):
+    return {psn : intern_patient(record)
+        for psn, record in load_records(json_db).items()}
+
+
+def compact_records(json_db):
+    strings = {}
+    return {psn : compact_patient(record, strings)
+        for psn, record in load_records(json_db).items()}
+
+
+def measure(func, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main(json_db):
+    plain, plain_size, plain_time = measure(load_records, json_db)
+    interned, interned_size, interned_time = measure(interned_records, json_db)
+    compact, compact_size, compact_time = measure(compact_records, json_db)
+    assert plain == interned == compact
+
+    print('Dataset: %s (%i patients)' % (json_db, len(plain)))
+    print('{:<10}{:>14}{:>12}'.format('Records', 'Memory (MB)', 'Load (s)'))
+    for name, size, elapsed in (('dict', plain_size, plain_time),
+            ('interned', interned_size, interned_time),
+            ('compact', compact_size, compact_time)):
+        print('{:<10}{:>14.1f}{:>12.2f}'.format(name, size / 2**20, elapsed))
+    print('Interned records use %.1fx less memory.' % (
+        plain_size / interned_size))
+    print('Compact records use %.1fx less memory.' % (
+        plain_size / compact_size))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else matchbox_api_utils.mb_json_data)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time loading and patient queries on a snapshot against the same data loaded
+from JSON, along with the number of records decoded from the snapshot per 
+patient.  The
+dataset is scaled up to ``n`` synthetic patients (copies of the records in 
+the mb_obj JSON file under new PSNs).  Uses the system default mb_obj JSON 
+file unless one is passed in.
+
+    $ python3 tests/snapshot_bench.py [mb_obj.json] [n]
+"""
+import os
+import sys
+import time
+import tempfile
+
+import matchbox_api_utils
+from matchbox_api_utils import MatchData
+from matchbox_api_utils import utils
+from matchbox_api_utils import snapshot
+
+QUERIES = (
+    ('get_histology', (), {}),
+    ('find_variant_frequency', ({'snvs' : ['BRAF'], 'cnvs' : ['ERBB2']},), {}),
+    ('get_patient_ta_status', (), {}),
+    ('get_psn', (), {'bsn' : 'T-00-000000'}),
+)
+
+
+class CountingSnapshot(snapshot.Snapshot):
+    decoded = 0
+
+    def __getitem__(self, psn):
+        CountingSnapshot.decoded += 1
+        return super().__getitem__(psn)
+
+
+def make_dataset(json_db, n):
+    data = utils.load_dumped_json(json_db)[1]
+    records = list(data.values())
+    return {str(20000 + i) : dict(records[i % len(records)], 
+        psn=str(20000 + i)) for i in range(n)}
+
+
+def run(data, name, args, kwargs):
+    start = time.perf_counter()
+    getattr(data, name)(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(json_db, n):
+    data = make_dataset(json_db, n)
+    tmpdir = tempfile.mkdtemp()
+    snap_file = os.path.join(tmpdir, 'mb_obj_bench.mbsnap')
+    json_file = os.path.join(tmpdir, 'mb_obj_bench.json')
+    utils.make_json(outfile=json_file, data=data)
+
+    start = time.perf_counter()
+    from_json = MatchData(json_db=json_file, quiet=True)
+    json_load = time.perf_counter() - start
+    from_json.matchbox_snapshot(snap_file)
+    start = time.perf_counter()
+    from_snap = MatchData(json_db=snap_file, quiet=True)
+    snap_load = time.perf_counter() - start
+    # Count the decodes from here on, without the reindex that replacing 
+    # the data would do.
+    from_snap._data = CountingSnapshot(snap_file)
+
+    print('Dataset: %s (%i patients)' % (json_db, len(data)))
+    print('Load: JSON %.3fs, snapshot %.3fs' % (json_load, snap_load))
+    print('{:<24}{:>10}{:>14}{:>18}'.format('Query', 'JSON (s)', 
+        'Snapshot (s)', 'Decodes / patient'))
+    for name, args, kwargs in QUERIES:
+        json_time = run(from_json, name, args, kwargs)
+        CountingSnapshot.decoded = 0
+        snap_time = run(from_snap, name, args, kwargs)
+        print('{:<24}{:>10.3f}{:>14.3f}{:>18.1f}'.format(name, json_time, 
+            snap_time, CountingSnapshot.decoded / len(data)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else matchbox_api_utils.mb_json_data,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
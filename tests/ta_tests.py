@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import sys
 import os
+import io
+import contextlib
+import tempfile
 import unittest
 
 from matchbox_api_utils import TreatmentArms
@@ -129,6 +132,20 @@ class TreatmentArmTests(unittest.TestCase):
 
         self.assertIsNone(self.ta_data.map_drug_arm(drugname='Tylenol'))
 
+        self.assertEqual(self.ta_data.map_drug_arm(drugname='afatinib'), res)
+        res = self.ta_data.map_drug_arm(drugname='sunit', partial=True)
+        self.assertEqual(
+            res,
+            self.ta_data.map_drug_arm(
+                drugname='Sunitinib malate (SU011248 L-malate)')
+        )
+        self.assertEqual(
+            self.ta_data.map_drug_arm(drugname='SU0112 malate', partial=True),
+            res
+        )
+        self.assertIsNone(
+            self.ta_data.map_drug_arm(drugname='sunit tylenol', partial=True))
+
     def test_get_exlusion_disease(self):
         self.assertListEqual(
             self.ta_data.get_exclusion_disease('EAY131-Z1A'),
@@ -148,3 +165,189 @@ class TreatmentArmTests(unittest.TestCase):
                 'Squamous cell lung carcinoma'
             ]
         )
+
+    def test_positional_rules_match_exact_gene(self):
+        # ERBB2 exon 20 insertions are aMOIs, but a gene that is only a prefix
+        # of ERBB2 should not pick up the rule.
+        variant = {
+            'type' : 'snvs_indels',
+            'gene'         : 'ERBB',
+            'identifier'        : '.',
+            'oncominevariantclass' : '.',
+            'exon'         : '20',
+            'function'     : 'nonframeshiftInsertion'
+        }
+        self.assertIsNone(self.ta_data.map_amoi(variant))
+
+    def test_arm_attributes(self):
+        for arm, attributes in self.ta_data.arm_attributes.items():
+            summary = self.ta_data.arm_summary(arm)
+            self.assertEqual(attributes.status, summary['status'])
+            self.assertEqual(attributes.outside_open, summary['outside_open'])
+            self.assertEqual(attributes.version, summary['version'])
+
+        variant = {
+            'type' : 'snvs_indels',
+            'gene' : 'PIK3CA',
+            'identifier' : 'COSM775', 
+            'exon' : '21',
+            'function' : 'missense', 
+            'oncominevariantclass' : 'Hotspot'
+        }
+        for amoi in self.ta_data.map_amoi(variant, status='OPEN', outside=True):
+            attributes = self.ta_data.arm_attributes[amoi.split('(')[0]]
+            self.assertEqual(attributes.status, 'OPEN')
+            self.assertTrue(attributes.outside_open)
+
+    def test_map_amois(self):
+        variants = [
+            {
+                'type' : 'snvs_indels',
+                'gene'         : 'BRAF',
+                'identifier'        : 'COSM476',
+                'oncominevariantclass' : 'Hotspot',
+                'exon'         : '15',
+                'function'     : 'missense'
+            },
+            {
+                'type' : 'snvs_indels',
+                'gene'         : 'TP53',
+                'identifier'        : 'COSM10660',
+                'oncominevariantclass' : '-',
+                'exon'         : '-',
+                'function'     : 'missense'
+            },
+            {
+                'type' : 'cnvs',
+                'gene'         : '.',
+                'identifier'        : 'ERBB2',
+            },
+            {'type' : 'fusions'},
+        ]
+        expected = [self.ta_data.map_amoi(dict(v)) for v in variants[:3]]
+        expected.append(None)
+        self.assertEqual(self.ta_data.map_amois(variants), expected)
+        self.assertEqual(variants[2]['gene'], '.')
+
+        columns = {
+            field : [v.get(field, '.') for v in variants[:3]]
+            for field in variants[0]
+        }
+        self.assertEqual(self.ta_data.map_amois(columns), expected[:3])
+        self.assertEqual(
+            self.ta_data.map_amois(variants[:3], status='OPEN', outside=True),
+            [self.ta_data.map_amoi(dict(v), status='OPEN', outside=True) 
+                for v in variants[:3]]
+        )
+
+    def test_get_arm_by_amoi(self):
+        table = self.ta_data.amoi_lookup_table
+        for gene, arms in table['cnv'].items():
+            self.assertEqual(
+                self.ta_data.get_arm_by_amoi(gene=gene)['cnv'], sorted(arms))
+
+        for var, arms in table['positional'].items():
+            results = self.ta_data.get_arm_by_amoi(gene=var.split('|')[0])
+            for arm in arms:
+                self.assertIn(arm, results['positional'])
+
+        hotspot = sorted(table['hotspot'])[0]
+        self.assertEqual(
+            self.ta_data.get_arm_by_amoi(hotspot=hotspot),
+            {'hotspot' : sorted(table['hotspot'][hotspot])}
+        )
+        self.assertIsNone(self.ta_data.get_arm_by_amoi(gene='FAKEGENE'))
+        self.assertIsNone(self.ta_data.get_arm_by_amoi())
+
+    def test_hotspot_genes(self):
+        # The hotspot gene map is kept out of the arm records, and is stored
+        # alongside the arm data when it's dumped.
+        for arm in self.ta_data.data:
+            self.assertNotIn('hotspot_genes', self.ta_data.data[arm]['amois'])
+            self.assertNotIn('hotspot_genes',
+                self.ta_data.get_amois_by_arm(arm))
+
+        for hotspot, gene in self.ta_data._hotspot_genes.items():
+            for arm in self.ta_data.amoi_lookup_table['hotspot'][hotspot]:
+                self.assertIn(arm,
+                    self.ta_data.get_arm_by_amoi(gene=gene)['hotspot'])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ta_file = os.path.join(tmpdir, 'ta_obj.json')
+            self.ta_data.ta_json_dump(ta_filename=ta_file,
+                amois_filename=os.path.join(tmpdir, 'amoi_lookup.json'))
+            reloaded = TreatmentArms(json_db=ta_file)
+            self.assertEqual(reloaded.data, self.ta_data.data)
+            self.assertEqual(reloaded._hotspot_genes,
+                self.ta_data._hotspot_genes)
+            self.assertEqual(reloaded._gene_index, self.ta_data._gene_index)
+
+            # Without the hotspot genes, gene queries warn that the hotspot 
+            # arms are missing.
+            os.remove(ta_file + '.genes')
+            reloaded = TreatmentArms(json_db=ta_file)
+            with contextlib.redirect_stderr(io.StringIO()) as stderr:
+                reloaded.get_arm_by_amoi(gene='BRAF')
+            self.assertIn('no hotspot genes', stderr.getvalue())
+
+    def test_map_patient_amois(self):
+        variants = [
+            {
+                'type' : 'snvs_indels',
+                'gene'         : 'BRAF',
+                'identifier'        : 'COSM476',
+                'oncominevariantclass' : 'Hotspot',
+                'exon'         : '15',
+                'function'     : 'missense'
+            },
+            {
+                'type' : 'snvs_indels',
+                'gene'         : 'PIK3CA',
+                'identifier'        : 'COSM775',
+                'oncominevariantclass' : 'Hotspot',
+                'exon'         : '21',
+                'function'     : 'missense'
+            },
+            {
+                'type' : 'cnvs',
+                'gene'         : '.',
+                'identifier'        : 'ERBB2',
+            },
+        ]
+        for status, outside in ((None, False), ('OPEN', True)):
+            expected = set()
+            for v in variants:
+                expected.update(self.ta_data.map_amoi(dict(v), status=status,
+                    outside=outside) or [])
+            self.assertEqual(
+                self.ta_data.map_patient_amois(variants, status=status, 
+                    outside=outside) or [], 
+                sorted(expected)
+            )
+
+    def test_as_of(self):
+        arm = sorted(self.ta_data.data)[0]
+        self.assertEqual(
+            self.ta_data.arm_summary(arm, as_of='2100-01-01'),
+            self.ta_data.arm_summary(arm)
+        )
+        self.assertIsNone(self.ta_data.arm_summary(arm, as_of='1999-01-01'))
+        self.assertIsNone(self.ta_data.get_amois_by_arm(arm, 
+            as_of='1999-01-01'))
+        for record in self.ta_data.data[arm].get('history', []):
+            summary = self.ta_data.arm_summary(arm, as_of=record['version'])
+            self.assertEqual(summary['version'], record['version'])
+
+        variant = {
+            'type' : 'snvs_indels',
+            'gene'         : 'BRAF',
+            'identifier'        : 'COSM476',
+            'oncominevariantclass' : 'Hotspot',
+            'exon'         : '15',
+            'function'     : 'missense'
+        }
+        self.assertEqual(
+            self.ta_data.map_amoi(dict(variant), as_of='2100-01-01'),
+            self.ta_data.map_amoi(dict(variant))
+        )
+        self.assertIsNone(self.ta_data.map_amoi(variant, as_of='1999-01-01'))